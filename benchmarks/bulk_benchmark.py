@@ -0,0 +1,113 @@
+#!/usr/bin/python
+
+"""Compares single engine calls against one bulk call.
+
+Usage:
+  python -m benchmarks.bulk_benchmark [--count 100000] [--oplog]
+                                      [--durability os]
+
+Submits count blogposts, count comments and count labels on those
+blogposts, first with SubmitBlogpost(), SubmitComment() and
+AddLabelToBlogpost() one at a time, then with a single SubmitBlogposts(),
+SubmitComments() and AddLabelsToBlogposts() call each, and reports the
+wall time of each and the operation log records written.
+
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from bloggerengine import base_model
+from bloggerengine import engine
+from bloggerengine import oplog
+
+
+def ResetInstances():
+    for model_class in engine.MODEL_CLASSES.values():
+        model_class.instances.pop(model_class.__name__, None)
+    base_model.BaseModel.instances = {}
+
+
+def Run(blogger_engine, arguments, bulk):
+    blogposts = [('author%d' % (index % arguments.authors),
+                  'Headline %d' % index, 'Body of blogpost %d.' % index)
+                 for index in range(arguments.count)]
+    timings = []
+
+    started = time.time()
+    if bulk:
+        blogpost_ids = [blogpost.id for blogpost in
+                        blogger_engine.SubmitBlogposts(blogposts)]
+    else:
+        blogpost_ids = [blogger_engine.SubmitBlogpost(*blogpost).id
+                        for blogpost in blogposts]
+    timings.append(('blogposts', time.time() - started))
+
+    comments = [('author%d' % random.randrange(arguments.authors),
+                 'Comment %d' % index, random.choice(blogpost_ids))
+                for index in range(arguments.count)]
+    started = time.time()
+    if bulk:
+        blogger_engine.SubmitComments(comments)
+    else:
+        for comment in comments:
+            blogger_engine.SubmitComment(*comment)
+    timings.append(('comments', time.time() - started))
+
+    labels = [('label%d' % (index % arguments.labels), blogpost_id)
+              for index, blogpost_id in enumerate(blogpost_ids)]
+    started = time.time()
+    if bulk:
+        blogger_engine.AddLabelsToBlogposts(labels)
+    else:
+        for label in labels:
+            blogger_engine.AddLabelToBlogpost(*label)
+    timings.append(('labels', time.time() - started))
+    return timings
+
+
+def Main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--authors', type=int, default=1000)
+    parser.add_argument('--labels', type=int, default=100)
+    parser.add_argument('--oplog', action='store_true',
+                        help='Record mutations to an operation log.')
+    parser.add_argument('--durability', default=oplog.DURABILITY_OS,
+                        choices=oplog.DURABILITY_MODES)
+    arguments = parser.parse_args()
+
+    blogger_engine = engine.BloggerEngine()
+    directory = tempfile.mkdtemp()
+    try:
+        for bulk in (False, True):
+            ResetInstances()
+            log_path = os.path.join(directory, 'oplog%d' % bulk)
+            if arguments.oplog:
+                blogger_engine.OpenOperationLog(log_path,
+                                                arguments.durability)
+            timings = Run(blogger_engine, arguments, bulk)
+            records = 0
+            if arguments.oplog:
+                records = len(list(
+                    base_model.BaseModel.oplog.ReadRecords()))
+                blogger_engine.CloseOperationLog()
+
+            for name, seconds in timings:
+                print('%-6s %-10s %8.2f s %10.0f per second' % (
+                    'bulk' if bulk else 'single', name, seconds,
+                    arguments.count / seconds))
+            if arguments.oplog:
+                print('%-6s %d operation log records, %.2f MB' % (
+                    'bulk' if bulk else 'single', records,
+                    os.path.getsize(log_path) / 1e6))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    Main()
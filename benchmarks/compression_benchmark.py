@@ -0,0 +1,84 @@
+#!/usr/bin/python
+
+"""Compares bandwidth and CPU time of compressed responses.
+
+Usage:
+  python -m benchmarks.compression_benchmark [--levels 1,6,9] [--requests 10]
+
+For each route and compression level, reports the bytes sent and the
+server's CPU time per request, uncompressed, compressed on every request
+(with the compression cache disabled) and reused from the compression
+cache, as happens while the datastore is not modified.
+
+"""
+
+import argparse
+import random
+import time
+
+from bloggerengine import compression
+from bloggerengine import response_cache
+from bloggerengine import server
+
+ROUTES = (
+    '/blogpost/get_all',
+    '/author/get_all',
+    '/comment/get_all',
+    '/comment/get_all?normalize=1',
+)
+
+
+def TimeRequests(client, url, headers, requests):
+    size = len(client.get(url, headers=headers).get_data())
+    started = time.process_time()
+    for unused_x in range(requests):
+        client.get(url, headers=headers)
+    return (time.process_time() - started) / requests, size
+
+
+def Main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--blogposts', type=int, default=2000)
+    parser.add_argument('--authors', type=int, default=50)
+    parser.add_argument('--comments', type=int, default=5000)
+    parser.add_argument('--levels', default='1,6,9')
+    parser.add_argument('--encoding', default='gzip',
+                        choices=compression.ENCODINGS)
+    parser.add_argument('--requests', type=int, default=10)
+    arguments = parser.parse_args()
+
+    blogger_engine = server.blogger_engine
+    blogpost_ids = []
+    for index in range(arguments.blogposts):
+        blogpost = blogger_engine.SubmitBlogpost(
+            'author%d' % (index % arguments.authors), 'Headline %d' % index,
+            'Body.')
+        blogger_engine.AddLabelToBlogpost('label%d' % (index % 4),
+                                          blogpost.id)
+        blogpost_ids.append(blogpost.id)
+    for index in range(arguments.comments):
+        blogger_engine.SubmitComment(
+            'author%d' % (index % arguments.authors), 'Comment',
+            random.choice(blogpost_ids))
+
+    # Measure encoding rather than hits in the response cache.
+    server.response_cache = response_cache.ResponseCache(0)
+    client = server.app.test_client()
+    headers = {'Accept-Encoding': arguments.encoding}
+    for url in ROUTES:
+        seconds, size = TimeRequests(client, url, {}, arguments.requests)
+        print('%-42s %-12s %8.2f MB %8.2f ms CPU per request' % (
+            url, 'identity', size / 1e6, seconds * 1000))
+        for level in [int(level) for level in arguments.levels.split(',')]:
+            for name, max_bytes in (('level %d' % level, 0),
+                                    ('cached', 1 << 30)):
+                server.compression_cache = compression.CompressionCache(
+                    level, max_bytes)
+                seconds, size = TimeRequests(client, url, headers,
+                                             arguments.requests)
+                print('%-42s %-12s %8.2f MB %8.2f ms CPU per request' % (
+                    url, name, size / 1e6, seconds * 1000))
+
+
+if __name__ == '__main__':
+    Main()
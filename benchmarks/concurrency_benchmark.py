@@ -0,0 +1,109 @@
+#!/usr/bin/python
+
+"""Measures engine read throughput as reader threads are added.
+
+Usage:
+  python -m benchmarks.concurrency_benchmark [--threads 1,2,4,8] [--writers N]
+                                             [--hold-ms 5]
+
+Each reader repeatedly looks up a random blogpost and serializes it, while
+the optional writer threads keep submitting comments. CPython only runs one
+thread at a time, so pure-Python readers can at best hold their throughput
+as threads are added; the first table only shows that they never queue
+behind each other on the engine's locks.
+
+The second table is where locking per kind pays off. A holder thread keeps
+taking a write lock for hold-ms at a time, sleeping as a slow durable write
+would, then releasing it for as long. Readers are timed while it holds the
+Comment lock, which they do not need, and while it holds every kind's lock,
+as a single global mutex would. Sleeping releases the GIL, so in the first
+case reads overlap the held lock, and in the second they stall.
+
+"""
+
+import argparse
+import random
+import threading
+import time
+
+from bloggerengine import engine
+
+
+def RunReaders(blogger_engine, blogpost_ids, thread_count, writer_count,
+               seconds, hold_kinds=None, hold_seconds=0):
+    stopped = threading.Event()
+    counts = [0] * thread_count
+
+    def Read(index):
+        while not stopped.is_set():
+            blogger_engine.GetBlogpostById(
+                random.choice(blogpost_ids)).ToJson()
+            counts[index] += 1
+
+    def Write():
+        while not stopped.is_set():
+            blogger_engine.SubmitComment('writer', 'Comment',
+                                         random.choice(blogpost_ids))
+
+    def Hold():
+        while not stopped.is_set():
+            with blogger_engine.Writing(*hold_kinds):
+                time.sleep(hold_seconds)
+            time.sleep(hold_seconds)
+
+    threads = [threading.Thread(target=Read, args=(index,))
+               for index in range(thread_count)]
+    threads.extend(threading.Thread(target=Write)
+                   for unused_x in range(writer_count))
+    if hold_kinds is not None:
+        threads.append(threading.Thread(target=Hold))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stopped.set()
+    for thread in threads:
+        thread.join()
+
+    return sum(counts) / seconds
+
+
+def Main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--blogposts', type=int, default=10000)
+    parser.add_argument('--threads', default='1,2,4,8')
+    parser.add_argument('--writers', type=int, default=0)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--hold-ms', type=float, default=5.0,
+                        help='How long the holder keeps a write lock.')
+    arguments = parser.parse_args()
+
+    blogger_engine = engine.BloggerEngine()
+    blogpost_ids = [
+        blogger_engine.SubmitBlogpost('author%d' % (index % 100),
+                                      'Headline %d' % index, 'Body.').id
+        for index in range(arguments.blogposts)]
+    thread_counts = [int(count) for count in arguments.threads.split(',')]
+
+    baseline = None
+    for thread_count in thread_counts:
+        reads = RunReaders(blogger_engine, blogpost_ids, thread_count,
+                           arguments.writers, arguments.seconds)
+        baseline = baseline or reads
+        print('%2d reader threads: %10.0f reads/s (%.2fx)' % (
+            thread_count, reads, reads / baseline))
+
+    if not arguments.hold_ms:
+        return
+    print('')
+    for thread_count in thread_counts:
+        for name, kinds in (('Comment held', ('Comment',)),
+                            ('every kind held', ())):
+            reads = RunReaders(blogger_engine, blogpost_ids, thread_count,
+                               arguments.writers, arguments.seconds, kinds,
+                               arguments.hold_ms / 1000.0)
+            print('%2d reader threads, %-15s: %10.0f reads/s (%.2fx)' % (
+                thread_count, name, reads, reads / baseline))
+
+
+if __name__ == '__main__':
+    Main()
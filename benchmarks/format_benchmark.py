@@ -0,0 +1,90 @@
+#!/usr/bin/python
+
+"""Compares JSON, MessagePack and CBOR responses route by route.
+
+Usage:
+  python -m benchmarks.format_benchmark [--blogposts 2000] [--requests 20]
+
+For each route and format, reports the response size, the server's CPU
+time per request on warm caches, and the client's CPU time to decode the
+response. Formats whose library is not installed are skipped.
+
+"""
+
+import argparse
+import random
+import time
+
+from bloggerengine import formats
+from bloggerengine import response_cache
+from bloggerengine import server
+
+ROUTES = (
+    ('/blogpost/get_all', {}),
+    ('/blogpost/get_by_label', {'label_text': 'label0'}),
+    ('/comment/get_all', {}),
+    ('/comment/get_all', {'normalize': True}),
+    ('/author/get_all', {}),
+)
+
+
+def Main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--blogposts', type=int, default=2000)
+    parser.add_argument('--authors', type=int, default=50)
+    parser.add_argument('--comments', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=20)
+    arguments = parser.parse_args()
+
+    blogger_engine = server.blogger_engine
+    blogpost_ids = []
+    for index in range(arguments.blogposts):
+        blogpost = blogger_engine.SubmitBlogpost(
+            'author%d' % (index % arguments.authors), 'Headline %d' % index,
+            'Body.')
+        blogger_engine.AddLabelToBlogpost('label%d' % (index % 4),
+                                          blogpost.id)
+        blogpost_ids.append(blogpost.id)
+    for index in range(arguments.comments):
+        blogger_engine.SubmitComment(
+            'author%d' % (index % arguments.authors), 'Comment',
+            random.choice(blogpost_ids))
+
+    # Measure encoding rather than hits in the response cache.
+    server.response_cache = response_cache.ResponseCache(0)
+    client = server.app.test_client()
+    for url, post_data in ROUTES:
+        for data_format in formats.FORMATS:
+            if not data_format.available:
+                print('%s: %s is not installed' % (url, data_format.name))
+                continue
+
+            mimetype = data_format.mimetypes[0]
+            body = data_format.Encode(post_data)
+
+            def Request():
+                return client.post(url, data=body, content_type=mimetype,
+                                   headers={'Accept': mimetype}).get_data()
+
+            data = Request()
+            started = time.process_time()
+            for unused_x in range(arguments.requests):
+                Request()
+            encode_seconds = (
+                time.process_time() - started) / arguments.requests
+
+            started = time.process_time()
+            for unused_x in range(arguments.requests):
+                data_format.Decode(data)
+            decode_seconds = (
+                time.process_time() - started) / arguments.requests
+
+            print('%-24s %-10s %-7s %7.2f MB, %7.2f ms to encode, '
+                  '%7.2f ms to decode' % (
+                      url, 'normalized' if post_data.get('normalize') else '',
+                      data_format.name, len(data) / 1e6,
+                      encode_seconds * 1000, decode_seconds * 1000))
+
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+
+"""Measures repeated listings with and without the ToJson() cache.
+
+Usage:
+  python -m benchmarks.json_cache_benchmark [--authors 20] [--blogposts 200]
+
+Builds a graph of a few prolific authors, each with many blogposts and
+comments, then serializes every comment (as /comment/get_all does) several
+times in a row. Without the cache each comment re-lists its author's and
+blogpost author's activity; with it, repeated listings reuse the cached
+dictionaries. A comment is submitted between listings, so each one only
+rebuilds what that comment invalidated.
+
+"""
+
+import argparse
+import random
+import time
+
+from bloggerengine import base_model
+from bloggerengine import engine
+
+
+def TimeListings(blogger_engine, blogpost_ids, listings):
+    started = time.time()
+    for unused_x in range(listings):
+        for comment in blogger_engine.GetAllComments():
+            comment.ToJson()
+        blogger_engine.SubmitComment('author0', 'Another',
+                                     random.choice(blogpost_ids))
+    return (time.time() - started) / listings
+
+
+def Main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--authors', type=int, default=20)
+    parser.add_argument('--blogposts', type=int, default=200,
+                        help='Blogposts per author.')
+    parser.add_argument('--comments', type=int, default=5,
+                        help='Comments per blogpost.')
+    parser.add_argument('--listings', type=int, default=5)
+    arguments = parser.parse_args()
+
+    blogger_engine = engine.BloggerEngine()
+    blogpost_ids = []
+    for index in range(arguments.authors * arguments.blogposts):
+        blogpost = blogger_engine.SubmitBlogpost(
+            'author%d' % (index % arguments.authors),
+            'Headline %d' % index, 'Body.')
+        blogpost_ids.append(blogpost.id)
+        for unused_x in range(arguments.comments):
+            blogger_engine.SubmitComment(
+                'author%d' % random.randrange(arguments.authors), 'Comment',
+                blogpost.id)
+    print('%d authors, %d blogposts, %d comments' % (
+        arguments.authors, len(blogpost_ids),
+        len(blogger_engine.GetAllComments())))
+
+    for cache_json in (False, True):
+        base_model.BaseModel.cache_json = cache_json
+        for model_class in engine.MODEL_CLASSES.values():
+            model_class.ResetJsonCacheStats()
+        seconds = TimeListings(blogger_engine, blogpost_ids,
+                               arguments.listings)
+        print('cache %-5s: %8.1f ms per listing' % (
+            'on' if cache_json else 'off', seconds * 1000))
+
+    for kind, stats in sorted(blogger_engine.GetJsonCacheStats().items()):
+        if stats['hit_rate'] is not None:
+            print('  %-8s %9d hits %9d misses (%.1f%% hit rate)' % (
+                kind, stats['hits'], stats['misses'],
+                stats['hit_rate'] * 100))
+
+
+if __name__ == '__main__':
+    Main()
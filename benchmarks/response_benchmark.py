@@ -0,0 +1,85 @@
+#!/usr/bin/python
+
+"""Measures the CPU cost of list responses on warm serialization caches.
+
+Usage:
+  python -m benchmarks.response_benchmark [--blogposts 2000] [--requests 20]
+
+Requests /blogpost/get_all and /blogpost/get_by_label repeatedly through
+the Flask test client, with no caching, with only ToJson() dictionaries
+cached, and with pre-encoded JSON fragments cached as well. Then compares
+the size and cost of /comment/get_all with embedded and normalized models.
+
+"""
+
+import argparse
+import random
+import time
+
+from bloggerengine import base_model
+from bloggerengine import response_cache
+from bloggerengine import server
+
+MODES = (
+    ('uncached', False, False),
+    ('dicts cached', True, False),
+    ('fragments cached', True, True),
+)
+
+
+def TimeRequests(client, url, post_data, requests):
+    size = len(client.post(url, json=post_data).get_data())
+    started = time.process_time()
+    for unused_x in range(requests):
+        client.post(url, json=post_data)
+    return (time.process_time() - started) / requests, size
+
+
+def Main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--blogposts', type=int, default=2000)
+    parser.add_argument('--authors', type=int, default=50)
+    parser.add_argument('--comments', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=20)
+    arguments = parser.parse_args()
+
+    blogger_engine = server.blogger_engine
+    blogpost_ids = []
+    for index in range(arguments.blogposts):
+        blogpost = blogger_engine.SubmitBlogpost(
+            'author%d' % (index % arguments.authors), 'Headline %d' % index,
+            'Body.')
+        blogger_engine.AddLabelToBlogpost('label%d' % (index % 4),
+                                          blogpost.id)
+        blogpost_ids.append(blogpost.id)
+
+    # Measure encoding rather than hits in the response cache.
+    server.response_cache = response_cache.ResponseCache(0)
+    client = server.app.test_client()
+    for url, post_data in (('/blogpost/get_all', {}),
+                           ('/blogpost/get_by_label',
+                            {'label_text': 'label0'})):
+        baseline = None
+        for name, cache_json, cache_encoded_json in MODES:
+            base_model.BaseModel.cache_json = cache_json
+            base_model.BaseModel.cache_encoded_json = cache_encoded_json
+            seconds, unused_size = TimeRequests(client, url, post_data,
+                                                arguments.requests)
+            baseline = baseline or seconds
+            print('%-24s %-17s %8.2f ms CPU per request (%.1fx)' % (
+                url, name, seconds * 1000, baseline / seconds))
+
+    for index in range(arguments.comments):
+        blogger_engine.SubmitComment(
+            'author%d' % (index % arguments.authors), 'Comment',
+            random.choice(blogpost_ids))
+    for name, post_data in (('embedded', {}), ('normalized',
+                                               {'normalize': True})):
+        seconds, size = TimeRequests(client, '/comment/get_all', post_data,
+                                     arguments.requests)
+        print('/comment/get_all %-10s %8.2f ms CPU per request, %6.1f MB' % (
+            name, seconds * 1000, size / 1e6))
+
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+
+"""Compares snapshot load time against rebuilding via the engine or the log.
+
+Usage:
+  python -m benchmarks.snapshot_benchmark [--blogposts N] [--comments N]
+
+The defaults match the sizing target of 1M blogposts and 10M comments, which
+needs tens of gigabytes of RAM; pass smaller counts for a quick run.
+
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from bloggerengine import base_model
+from bloggerengine import engine
+from bloggerengine import oplog
+from bloggerengine import snapshot
+
+
+def ResetInstances():
+    for model_class in engine.MODEL_CLASSES.values():
+        model_class.instances.pop(model_class.__name__, None)
+    base_model.BaseModel.instances = {}
+
+
+def Populate(blogger_engine, blogposts, comments, authors, labels):
+    blogpost_ids = []
+    for index in range(blogposts):
+        blogpost = blogger_engine.SubmitBlogpost(
+            'author%d' % (index % authors), 'Headline %d' % index,
+            'Body of blogpost %d.' % index)
+        blogger_engine.AddLabelToBlogpost('label%d' % (index % labels),
+                                          blogpost.id)
+        blogpost_ids.append(blogpost.id)
+
+    for index in range(comments):
+        blogger_engine.SubmitComment('author%d' % random.randrange(authors),
+                                     'Comment %d' % index,
+                                     random.choice(blogpost_ids))
+
+
+def Main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--blogposts', type=int, default=1000000)
+    parser.add_argument('--comments', type=int, default=10000000)
+    parser.add_argument('--authors', type=int, default=10000)
+    parser.add_argument('--labels', type=int, default=1000)
+    arguments = parser.parse_args()
+
+    blogger_engine = engine.BloggerEngine()
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'snapshot')
+    log_path = os.path.join(directory, 'oplog')
+
+    start = time.time()
+    Populate(blogger_engine, arguments.blogposts, arguments.comments,
+             arguments.authors, arguments.labels)
+    rebuild_seconds = time.time() - start
+
+    ResetInstances()
+    blogger_engine.OpenOperationLog(log_path, oplog.DURABILITY_OS)
+    Populate(blogger_engine, arguments.blogposts, arguments.comments,
+             arguments.authors, arguments.labels)
+    blogger_engine.CloseOperationLog()
+
+    ResetInstances()
+    start = time.time()
+    blogger_engine.OpenOperationLog(log_path, oplog.DURABILITY_OS)
+    replay_seconds = time.time() - start
+    blogger_engine.CloseOperationLog()
+
+    start = time.time()
+    objects = blogger_engine.SaveSnapshot(path)
+    write_seconds = time.time() - start
+
+    ResetInstances()
+    start = time.time()
+    snapshot.LoadSnapshot(path, engine.MODEL_CLASSES)
+    load_seconds = time.time() - start
+
+    print('objects:                %d' % objects)
+    print('snapshot size:          %.1f MB' % (os.path.getsize(path) / 1e6))
+    print('rebuild via engine:     %.2f s' % rebuild_seconds)
+    print('operation log replay:   %.2f s' % replay_seconds)
+    print('snapshot write:         %.2f s' % write_seconds)
+    print('snapshot load:          %.2f s' % load_seconds)
+    print('speedup vs engine:      %.1fx' % (rebuild_seconds / load_seconds))
+    print('speedup vs log replay:  %.1fx' % (replay_seconds / load_seconds))
+
+    os.remove(path)
+    os.remove(log_path)
+    os.rmdir(directory)
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+
+"""Compares peak memory of streamed and unstreamed /blogpost/get_all.
+
+Usage:
+  python -m benchmarks.streaming_benchmark [--blogposts 10000,100000]
+
+For each datastore size, the full response is read through the test client
+while tracemalloc tracks the peak memory allocated on top of the datastore.
+Unstreamed responses grow with the number of blogposts; streamed ones should
+stay flat at about a chunk's worth.
+
+"""
+
+import argparse
+import tracemalloc
+
+from bloggerengine import author as author_model
+from bloggerengine import blogpost as blogpost_model
+from bloggerengine import response_cache
+from bloggerengine import server
+
+
+def MeasurePeak(client, url):
+    tracemalloc.start()
+    try:
+        size = 0
+        response = client.get(url)
+        for chunk in response.response:
+            size += len(chunk)
+        response.close()
+        return size, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def Main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--blogposts', default='10000,100000')
+    arguments = parser.parse_args()
+
+    # Measure encoding rather than hits in the response cache.
+    server.response_cache = response_cache.ResponseCache(0)
+    client = server.app.test_client()
+    for count in [int(count) for count in arguments.blogposts.split(',')]:
+        author_model.Author.instances = {}
+        blogpost_model.Blogpost.instances = {}
+        for index in range(count):
+            server.blogger_engine.SubmitBlogpost(
+                'author%d' % (index % 100), 'Headline %d' % index, 'Body.')
+
+        for label, url in (('jsonify', '/blogpost/get_all'),
+                           ('stream=json', '/blogpost/get_all?stream=json'),
+                           ('stream=ndjson',
+                            '/blogpost/get_all?stream=ndjson')):
+            size, peak = MeasurePeak(client, url)
+            print('%8d blogposts, %-13s: %6.1f MB sent, %7.1f MB peak' % (
+                count, label, size / 1e6, peak / 1e6))
+
+
+if __name__ == '__main__':
+    Main()
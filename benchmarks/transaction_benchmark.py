@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+"""Compares committing each engine call against grouping them in transactions.
+
+Usage:
+  python -m benchmarks.transaction_benchmark [--count 10000] [--group 100]
+                                             [--durability always]
+                                             [--sqlite]
+
+Runs count rounds of SubmitBlogpost(), SubmitComment(),
+AddLabelToBlogpost() and DeleteBlogpost(), first committing each call on
+its own, then grouping group rounds in each BloggerEngine.Transaction(),
+and reports the wall time of each. Mutations are persisted to an operation
+log, whose records are counted, or with --sqlite to a SQLite database.
+
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from bloggerengine import base_model
+from bloggerengine import engine
+from bloggerengine import oplog
+
+
+def ResetInstances():
+    for model_class in engine.MODEL_CLASSES.values():
+        model_class.instances.pop(model_class.__name__, None)
+    base_model.BaseModel.instances = {}
+
+
+def RunRound(blogger_engine, index):
+    blogpost = blogger_engine.SubmitBlogpost(
+        'author%d' % (index % 100), 'Headline %d' % index, 'Body.')
+    blogger_engine.SubmitComment('commenter', 'Comment %d' % index,
+                                 blogpost.id)
+    blogger_engine.AddLabelToBlogpost('label%d' % (index % 10), blogpost.id)
+    if index % 2:
+        blogger_engine.DeleteBlogpost(blogpost.id)
+
+
+def Run(blogger_engine, arguments, grouped):
+    started = time.time()
+    if grouped:
+        for start in range(0, arguments.count, arguments.group):
+            with blogger_engine.Transaction():
+                for index in range(start, min(start + arguments.group,
+                                              arguments.count)):
+                    RunRound(blogger_engine, index)
+    else:
+        for index in range(arguments.count):
+            RunRound(blogger_engine, index)
+    return time.time() - started
+
+
+def Main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--group', type=int, default=100)
+    parser.add_argument('--durability', default=oplog.DURABILITY_ALWAYS,
+                        choices=oplog.DURABILITY_MODES)
+    parser.add_argument('--sqlite', action='store_true',
+                        help='Store instances in SQLite instead.')
+    arguments = parser.parse_args()
+
+    blogger_engine = engine.BloggerEngine()
+    directory = tempfile.mkdtemp()
+    try:
+        for grouped in (False, True):
+            ResetInstances()
+            name = 'transaction' if grouped else 'single'
+            if arguments.sqlite:
+                blogger_engine.OpenSqliteStorage(
+                    os.path.join(directory, '%s.db' % name))
+            else:
+                blogger_engine.OpenOperationLog(
+                    os.path.join(directory, '%s.oplog' % name),
+                    arguments.durability)
+
+            seconds = Run(blogger_engine, arguments, grouped)
+            print('%-11s %8.2f s %10.0f rounds per second' % (
+                name, seconds, arguments.count / seconds))
+
+            if arguments.sqlite:
+                blogger_engine.CloseStorage()
+            else:
+                print('%-11s %d operation log records' % (name, len(list(
+                    base_model.BaseModel.oplog.ReadRecords()))))
+                blogger_engine.CloseOperationLog()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    Main()
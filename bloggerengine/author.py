@@ -1,10 +1,26 @@
 #!/usr/bin/python
 
 from bloggerengine import base_model
-from collections import OrderedDict
+from bloggerengine import storage
 
 
 class Author(base_model.BaseModel):
+    persisted_fields = ('username', 'storage_key')
+    relation_fields = ('comments', 'blogposts', 'removed_blogposts',
+                       'removed_comments')
+    json_fields = {
+        'username': lambda author: author.username,
+        'id': lambda author: author.storage_key,
+        'created_timestamp': lambda author: author.created_timestamp,
+        'comments': lambda author: [comment.id
+                                    for comment in author.GetComments()],
+        'blogposts': lambda author: [blogpost.id
+                                     for blogpost in author.GetBlogposts()],
+        'removed_blogposts': lambda author: [
+            blogpost.id for blogpost in author.removed_blogposts.values()],
+        'removed_comments': lambda author: [
+            comment.id for comment in author.removed_comments.values()]
+    }
 
     def __init__(self, username):
         """Constructor.
@@ -16,10 +32,10 @@ class Author(base_model.BaseModel):
         super(Author, self).__init__()
         self.username = username.lower()
         self.storage_key = self.username
-        self.comments = OrderedDict()
-        self.blogposts = OrderedDict()
-        self.removed_blogposts = OrderedDict()
-        self.removed_comments = OrderedDict()
+        self.comments = storage.VersionedCollection()
+        self.blogposts = storage.VersionedCollection()
+        self.removed_blogposts = storage.VersionedCollection()
+        self.removed_comments = storage.VersionedCollection()
 
     def AddBlogpost(self, blogpost):
         """Adds a blogpost to the author's dictionary of blogposts.
@@ -30,6 +46,7 @@ class Author(base_model.BaseModel):
         """
         if blogpost.id not in self.blogposts:
             self.blogposts[blogpost.id] = blogpost
+            self.RecordLink_('blogposts', blogpost.id, blogpost)
 
     def RemoveBlogpost(self, blogpost):
         """Removes a blogpost from the author's dictionary of blogposts.
@@ -40,7 +57,9 @@ class Author(base_model.BaseModel):
         """
         if blogpost.id in self.blogposts:
             self.removed_blogposts[blogpost.id] = blogpost
+            self.RecordLink_('removed_blogposts', blogpost.id, blogpost)
             del self.blogposts[blogpost.id]
+            self.RecordUnlink_('blogposts', blogpost.id)
 
     def AddComment(self, comment):
         """Adds a comment to the author's dictionary of comments.
@@ -51,6 +70,7 @@ class Author(base_model.BaseModel):
         """
         if comment.id not in self.comments:
             self.comments[comment.id] = comment
+            self.RecordLink_('comments', comment.id, comment)
 
     def RemoveComment(self, comment):
         """Removes a comment from the author's dictionary of blogposts.
@@ -61,7 +81,9 @@ class Author(base_model.BaseModel):
         """
         if comment.id in self.comments:
             self.removed_comments[comment.id] = comment
+            self.RecordLink_('removed_comments', comment.id, comment)
             del self.comments[comment.id]
+            self.RecordUnlink_('comments', comment.id)
 
     def GetBlogposts(self):
         """Gets all blog posts for this user.
@@ -98,24 +120,3 @@ class Author(base_model.BaseModel):
 
         """
         return list(self.removed_comments.values())
-
-    def ToJson(self):
-        """Converts this object into a dictionary suitable for serialization.
-
-        Returns:
-          A dictionary.
-
-        """
-        return {
-            'username': self.username,
-            'id': self.storage_key,
-            'created_timestamp': str(self.created_timestamp),
-            'comments': [comment.id for comment in self.GetComments()],
-            'blogposts': [blogpost.id for blogpost in self.GetBlogposts()],
-            'removed_blogposts': [blogpost.id
-                                  for blogpost in
-                                  self.removed_blogposts.values()],
-            'removed_comments': [comment.id
-                                 for comment in
-                                 self.removed_comments.values()]
-        }
@@ -1,31 +1,385 @@
 #!/usr/bin/python
 
+import contextlib
 import datetime
-from collections import OrderedDict
+import itertools
+import threading
+import time
+
+from bloggerengine import formats
+from bloggerengine import storage
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Ids are 64 bit numbers made of the milliseconds since ID_EPOCH, the node
+# id and a per-millisecond sequence, written as 16 hex digits so that they
+# sort by creation time as strings too.
+ID_EPOCH = datetime.datetime(2015, 1, 1)
+ID_EPOCH_MILLISECONDS = int((ID_EPOCH - EPOCH).total_seconds()) * 1000
+NODE_ID_BITS = 10
+SEQUENCE_BITS = 12
+MAX_NODE_ID = (1 << NODE_ID_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+ID_LENGTH = 16
+
+# Hands out collection versions. Each is unique, so concurrent bumps can
+# never leave a collection at a version it had before.
+COLLECTION_VERSIONS = itertools.count(1)
+
+# The operation log records and changed objects of each thread's
+# BaseModel.Batching() block, if it is in one.
+BATCH = threading.local()
+
+
+class IdGenerator(object):
+
+    def __init__(self, node_id=0):
+        """Generates unique, monotonically increasing, time-prefixed ids.
+
+        Args:
+          node_id: int; Tells apart processes generating ids concurrently,
+            from 0 to MAX_NODE_ID.
+
+        """
+        if not 0 <= node_id <= MAX_NODE_ID:
+            raise ValueError('Node id must be between 0 and %d: %s' %
+                             (MAX_NODE_ID, node_id))
+
+        self.node_id = node_id
+        self.lock = threading.Lock()
+        self.last_milliseconds = 0
+        self.sequence = 0
+
+    def NextId(self):
+        """Gets a new id, greater than any this generator returned before.
+
+        If the clock goes backwards, the last timestamp is reused. If a
+        millisecond's sequence runs out, the next millisecond is borrowed.
+
+        Returns:
+          The id as a string.
+
+        """
+        with self.lock:
+            milliseconds = max(int(time.time() * 1000),
+                               self.last_milliseconds)
+            if milliseconds == self.last_milliseconds:
+                self.sequence = (self.sequence + 1) & MAX_SEQUENCE
+                if not self.sequence:
+                    milliseconds += 1
+            else:
+                self.sequence = 0
+            self.last_milliseconds = milliseconds
+            return FormatId(milliseconds, self.node_id, self.sequence)
+
+    def Advance(self, model_ids):
+        """Makes later ids greater than existing ones, e.g. restored ones.
+
+        Otherwise, with the clock set back since they were generated, the
+        same ids could be generated again. The rest of the millisecond of
+        the greatest one is skipped, since it may come from another node.
+
+        Args:
+          model_ids: iterable; Ids as strings. Any not in the format this
+            generator uses are ignored.
+
+        """
+        value = None
+        for model_id in model_ids:
+            if len(model_id) != ID_LENGTH:
+                continue
+            try:
+                parsed = int(model_id, 16)
+            except ValueError:
+                continue
+            if value is None or parsed > value:
+                value = parsed
+        if value is None:
+            return
+
+        milliseconds = ((value >> (NODE_ID_BITS + SEQUENCE_BITS)) +
+                        ID_EPOCH_MILLISECONDS)
+        with self.lock:
+            if milliseconds >= self.last_milliseconds:
+                self.last_milliseconds = milliseconds
+                self.sequence = MAX_SEQUENCE
 
 
 class BaseModel(object):
     instances = {}
 
+    # Generates the ids of new instances.
+    id_generator = IdGenerator()
+
+    # The StorageBackend instances are stored in.
+    storage = storage.MemoryBackend()
+
+    # The OperationLog mutations are recorded to, if any.
+    oplog = None
+
+    # Scalar attributes, model references and relationship OrderedDicts
+    # that make up the persisted state of a model.
+    persisted_fields = ()
+    persisted_references = ()
+    relation_fields = ()
+
+    # Builds each ToJson() field from an instance, apart from the
+    # persisted_references, which are embedded with their own ToJson().
+    # Datetimes are given as strings, unless native ones are asked for.
+    json_fields = {}
+
+    # Whether ToJson() results are cached, and how often the cache of each
+    # model class was used. Cached results are shared, so must not be
+    # modified.
+    cache_json = True
+    json_cache_hits = 0
+    json_cache_misses = 0
+
+    # The same for ToEncodedJson() and ToEncoded() results.
+    cache_encoded_json = True
+    encoded_json_cache_hits = 0
+    encoded_json_cache_misses = 0
+
+    # Bumped whenever the serialized form of an instance may have changed.
+    version = 0
+    # Changed whenever an instance of the model class is stored, deleted
+    # or changed.
+    collection_version = 0
+    # Called with each instance that is stored, deleted or changed.
+    change_listeners = []
+    json_cache = None
+    encoded_json_cache = None
+    projected_json_cache = None
+    normalized_json_cache = None
+    # Maps each binary format's name to its last ToEncoded() result.
+    encoded_caches = None
+
     def __init__(self):
         """Base model class to inherit from, to avoid duplication."""
-        self.id = str(id(self))
+        self.id = self.id_generator.NextId()
         self.created_timestamp = datetime.datetime.utcnow()
 
         if self.__class__.__name__ not in self.instances:
-            self.instances[self.__class__.__name__] = OrderedDict()
+            self.instances[self.__class__.__name__] = (
+                storage.VersionedCollection())
 
     def put(self):
-        """Stores the object in the instances dictionary, if not present."""
-        storage_key = self.GetStorageKey_()
-        if storage_key not in self.instances[self.__class__.__name__]:
-            self.instances[self.__class__.__name__][storage_key] = self
+        """Stores the object in the storage backend, if not present."""
+        if self.storage.Put(self.__class__, self.GetStorageKey_(), self):
+            self.Changed_()
+            if self.oplog is not None:
+                self.LogOperation_('put', state=self.GetState_())
 
     def delete(self):
-        """Deletes the object from the instances dictionary, if present."""
-        storage_key = self.GetStorageKey_()
-        if storage_key in self.instances[self.__class__.__name__]:
-            del self.instances[self.__class__.__name__][storage_key]
+        """Deletes the object from the storage backend, if present."""
+        if self.storage.Delete(self.__class__, self.GetStorageKey_(), self):
+            self.Changed_()
+            self.LogOperation_('delete')
+
+    def ToJson(self, fields=None, normalized=False, native=False):
+        """Converts this object into a dictionary suitable for serialization.
+
+        The full dictionary is cached until this object, or one it
+        references, is modified.
+
+        Args:
+          fields: list; Only build these fields, e.g. ['id', 'author.id'].
+            Fields of referenced models are selected with dotted names, and
+            unknown names are ignored. Also accepts a dict returned by
+            ParseFields(). Builds every field if None.
+          normalized: bool; Whether to give referenced models by storage key
+            rather than embed them.
+          native: bool; Whether to keep timestamps as datetimes, for formats
+            that have them, rather than convert them to strings.
+
+        Returns:
+          A dictionary, which must not be modified.
+
+        """
+        if fields is not None or normalized or native:
+            if fields is not None and not isinstance(fields, dict):
+                fields = ParseFields(fields)
+            return self.BuildJson_(fields, normalized, native)
+
+        if not self.cache_json:
+            return self.BuildJson_()
+
+        version = self.JsonVersion_()
+        cached = self.json_cache
+        if cached is not None and cached[0] == version:
+            self.__class__.json_cache_hits += 1
+            return cached[1]
+
+        self.__class__.json_cache_misses += 1
+        result = self.BuildJson_()
+        self.json_cache = (version, result)
+        return result
+
+    def ToEncodedJson(self, fields=None, normalized=False):
+        """Gets ToJson() encoded as compact UTF-8 JSON, with sorted keys.
+
+        Like ToJson(), the encoding is cached until this object, or one it
+        references, is modified, so responses can be assembled from these
+        fragments without encoding them again. The last projection and
+        normalized encoding asked for are cached too, since clients tend to
+        ask for the same ones.
+
+        Args:
+          fields: list; Only encode these fields, as for ToJson().
+          normalized: bool; As for ToJson().
+
+        Returns:
+          A bytes string.
+
+        """
+        if not self.cache_encoded_json:
+            return EncodeJson(self.ToJson(fields, normalized))
+        if fields is not None and not isinstance(fields, dict):
+            fields = ParseFields(fields)
+
+        if normalized:
+            # Referenced models are only named, so they cannot change it.
+            version = (self.version,)
+            cached = self.normalized_json_cache
+        else:
+            version = self.JsonVersion_()
+            cached = (self.encoded_json_cache if fields is None else
+                      self.projected_json_cache)
+        if (cached is not None and cached[0] == version and
+                cached[2] == fields):
+            self.__class__.encoded_json_cache_hits += 1
+            return cached[1]
+
+        self.__class__.encoded_json_cache_misses += 1
+        result = EncodeJson(self.ToJson(fields, normalized))
+        if normalized:
+            self.normalized_json_cache = (version, result, fields)
+        elif fields is None:
+            self.encoded_json_cache = (version, result, None)
+        else:
+            self.projected_json_cache = (version, result, fields)
+        return result
+
+    def ToEncoded(self, data_format, fields=None, normalized=False):
+        """Gets ToJson() encoded in a format, with native timestamps.
+
+        JSON is encoded by ToEncodedJson(). For other formats, the last
+        encoding asked for is cached, like those of ToEncodedJson().
+
+        Args:
+          data_format: formats.Format; The format to encode in.
+          fields: list; Only encode these fields, as for ToJson().
+          normalized: bool; As for ToJson().
+
+        Returns:
+          A bytes string.
+
+        """
+        if data_format is formats.JSON:
+            return self.ToEncodedJson(fields, normalized)
+        if not self.cache_encoded_json:
+            return data_format.Encode(
+                self.ToJson(fields, normalized, native=True))
+        if fields is not None and not isinstance(fields, dict):
+            fields = ParseFields(fields)
+
+        version = (self.version,) if normalized else self.JsonVersion_()
+        if self.encoded_caches is None:
+            self.encoded_caches = {}
+        cached = self.encoded_caches.get(data_format.name)
+        if (cached is not None and cached[0] == version and
+                cached[2] == fields and cached[3] == normalized):
+            self.__class__.encoded_json_cache_hits += 1
+            return cached[1]
+
+        self.__class__.encoded_json_cache_misses += 1
+        result = data_format.Encode(
+            self.ToJson(fields, normalized, native=True))
+        self.encoded_caches[data_format.name] = (version, result, fields,
+                                                 normalized)
+        return result
+
+    def BuildJson_(self, fields=None, normalized=False, native=False):
+        """Builds the dictionary returned by ToJson().
+
+        Only the requested fields are computed, so references that are left
+        out are never serialized.
+
+        Args:
+          fields: dict; The fields to build, as returned by ParseFields(),
+            or None for all of them.
+          normalized: bool; Whether to give referenced models by storage
+            key.
+          native: bool; Whether to keep datetimes as they are.
+
+        Returns:
+          A dictionary.
+
+        """
+        result = {}
+        for field, build in self.json_fields.items():
+            if fields is None or field in fields:
+                value = build(self)
+                if not native and isinstance(value, datetime.datetime):
+                    value = str(value)
+                result[field] = value
+        for field in self.persisted_references:
+            if fields is not None and field not in fields:
+                continue
+            reference = getattr(self, field)
+            if normalized:
+                result[field] = reference.GetStorageKey_()
+            elif native:
+                result[field] = reference.ToJson(
+                    None if fields is None else fields[field], native=True)
+            elif fields is None:
+                result[field] = reference.ToJson()
+            else:
+                result[field] = reference.ToJson(fields[field])
+        return result
+
+    def JsonVersion_(self):
+        """Gets the version of this object's serialized form.
+
+        It changes whenever this object or any model it references changes,
+        so every model a ToJson() result embeds must be referenced through
+        persisted_references.
+
+        Returns:
+          A tuple of this object's version and that of its references.
+
+        """
+        version = (self.version,)
+        for field in self.persisted_references:
+            version += (getattr(self, field).JsonVersion_(),)
+        return version
+
+    def Changed_(self):
+        """Invalidates cached serializations of this object and its kind."""
+        self.version += 1
+        self.__class__.collection_version = next(COLLECTION_VERSIONS)
+        changed = getattr(BATCH, 'changed', None)
+        if changed is not None:
+            changed[id(self)] = self
+            return
+        for listener in self.change_listeners:
+            listener(self)
+
+    def GetRelated(self, field):
+        """Gets the models a reference or relationship dict points to.
+
+        Args:
+          field: string; One of persisted_references or relation_fields.
+
+        Returns:
+          A list of models, empty if there is no such field.
+
+        """
+        if field in self.persisted_references:
+            return [getattr(self, field)]
+        if field in self.relation_fields:
+            return list(getattr(self, field).values())
+        return []
 
     def GetStorageKey_(self):
         """Gets the storage key to use.
@@ -38,6 +392,195 @@ class BaseModel(object):
             return getattr(self, 'storage_key')
         return self.id
 
+    def RecordLink_(self, field, key, target):
+        """Records that a model was added to one of our relationship dicts.
+
+        Args:
+          field: string; The name of the relationship OrderedDict.
+          key: string; The key the target was stored under.
+          target: BaseModel; The model that was added.
+
+        """
+        self.Changed_()
+        self.storage.Link(self, field, key, target)
+        if self.oplog is not None:
+            self.LogOperation_('link', field=field, key=key,
+                               target=[target.__class__.__name__, target.id])
+
+    def RecordUnlink_(self, field, key):
+        """Records that a key was removed from one of our relationship dicts.
+
+        Args:
+          field: string; The name of the relationship OrderedDict.
+          key: string; The key that was removed.
+
+        """
+        self.Changed_()
+        self.storage.Unlink(self, field, key)
+        if self.oplog is not None:
+            self.LogOperation_('unlink', field=field, key=key)
+
+    def LogOperation_(self, operation, **fields):
+        """Appends an operation on this object to the operation log, if any.
+
+        Args:
+          operation: string; The operation name, e.g. 'put' or 'link'.
+          **fields: Any additional fields to store in the record.
+
+        """
+        if self.oplog is None:
+            return
+
+        record = {
+            'op': operation,
+            'kind': self.__class__.__name__,
+            'id': self.id
+        }
+        record.update(fields)
+        records = getattr(BATCH, 'records', None)
+        if records is not None:
+            records.append(record)
+        else:
+            self.oplog.Append(record)
+
+    def GetState_(self):
+        """Gets the persisted state of this object.
+
+        Returns:
+          A dictionary of scalar fields, with references stored as
+          [kind, id] pairs.
+
+        """
+        state = {
+            'created_timestamp': TimestampToMicroseconds(
+                self.created_timestamp)
+        }
+        for field in self.persisted_fields:
+            state[field] = getattr(self, field)
+        for field in self.persisted_references:
+            reference = getattr(self, field)
+            state[field] = [reference.__class__.__name__, reference.id]
+        return state
+
+    def SetState_(self, state, resolve):
+        """Restores the persisted state of this object.
+
+        Args:
+          state: dict; A dictionary as returned by GetState_().
+          resolve: callable; Takes a kind and an id, returns the model.
+
+        """
+        # Loading an object does not change the datastore, so only this
+        # object's serializations are invalidated.
+        self.version += 1
+        self.created_timestamp = MicrosecondsToTimestamp(
+            state['created_timestamp'])
+        for field in self.persisted_fields:
+            setattr(self, field, state[field])
+        for field in self.persisted_references:
+            setattr(self, field, resolve(*state[field]))
+
+    @classmethod
+    def CreateEmpty_(cls, model_id):
+        """Creates an instance without running the constructor.
+
+        Used when restoring objects, since the constructors have side effects
+        on related models.
+
+        Args:
+          model_id: string; The id of the instance.
+
+        Returns:
+          An instance with only the id and empty relationship dicts set.
+
+        """
+        instance = cls.__new__(cls)
+        instance.id = model_id
+        for field in cls.relation_fields:
+            setattr(instance, field, storage.VersionedCollection())
+        return instance
+
+    @classmethod
+    @contextlib.contextmanager
+    def Batching(cls, atomic=False):
+        """Persists the mutations this thread makes in a block together.
+
+        Their operation log records are appended as a single 'batch'
+        record when the block ends, the storage backend may group its
+        writes, e.g. in one transaction, and change_listeners hear of each
+        changed object once. Nested blocks join the outermost one, and are
+        only atomic if it is.
+
+        If atomic and the block raises, every relation dict and instances
+        collection it changed is restored from an undo log, nothing is
+        logged or persisted, and the exception propagates. The caller must
+        hold locks that keep other threads from mutating what the block
+        does.
+
+        Args:
+          atomic: bool; Whether to roll back the block if it raises.
+
+        """
+        if getattr(BATCH, 'records', None) is not None:
+            yield
+            return
+
+        BATCH.records = []
+        BATCH.changed = {}
+        undo_log = storage.UndoLog.Begin() if atomic else None
+        committed = False
+        try:
+            with cls.storage.Batching(atomic):
+                yield
+            committed = True
+        finally:
+            records, changed = BATCH.records, BATCH.changed
+            BATCH.records = BATCH.changed = None
+            if undo_log is not None:
+                if committed:
+                    undo_log.Commit()
+                else:
+                    undo_log.Rollback()
+                    records = None
+            if records and cls.oplog is not None:
+                cls.oplog.AppendBatch(records)
+            for instance in changed.values():
+                if undo_log is not None and not committed:
+                    # Rolled back, so invalidate what was cached meanwhile.
+                    instance.Changed_()
+                else:
+                    for listener in instance.change_listeners:
+                        listener(instance)
+
+    @classmethod
+    def GetJsonCacheStats(cls):
+        """Gets how well the ToJson() cache of this model class is doing.
+
+        Returns:
+          A dictionary of hits, misses and hit_rate of ToJson(), with None
+          for hit_rate if it has not been called, and the same for
+          ToEncodedJson() as encoded_hits, encoded_misses and
+          encoded_hit_rate.
+
+        """
+        stats = {}
+        for prefix in ('', 'encoded_'):
+            hits = getattr(cls, prefix + 'json_cache_hits')
+            misses = getattr(cls, prefix + 'json_cache_misses')
+            stats[prefix + 'hits'] = hits
+            stats[prefix + 'misses'] = misses
+            stats[prefix + 'hit_rate'] = (
+                float(hits) / (hits + misses) if hits + misses else None)
+        return stats
+
+    @classmethod
+    def ResetJsonCacheStats(cls):
+        """Zeroes the ToJson() and ToEncodedJson() cache counters."""
+        cls.json_cache_hits = 0
+        cls.json_cache_misses = 0
+        cls.encoded_json_cache_hits = 0
+        cls.encoded_json_cache_misses = 0
+
     @classmethod
     def GetAll(cls):
         """Gets all stored instances of this object.
@@ -46,7 +589,34 @@ class BaseModel(object):
           A list of object instances, if found. Otherwise, an empty list.
 
         """
-        return list(cls.instances.get(cls.__name__, {}).values())
+        return cls.storage.GetAll(cls)
+
+    @classmethod
+    def GetSnapshot(cls):
+        """Gets an immutable, point-in-time view of all stored instances.
+
+        Returns:
+          A CollectionSnapshot, which is safe to read without locks.
+
+        """
+        return cls.storage.Snapshot(cls)
+
+    @classmethod
+    def GetRange(cls, start=None, stop=None):
+        """Gets stored instances by storage key range, in storage key order.
+
+        Blogposts and comments are stored by id, so this seeks by creation
+        time, e.g. with start=IdFromTimestamp(timestamp).
+
+        Args:
+          start: string; The first storage key to include, if any.
+          stop: string; The storage key to stop before, if any.
+
+        Returns:
+          A list of object instances.
+
+        """
+        return cls.GetSnapshot().GetRange(start, stop)
 
     @classmethod
     def GetByStorageKey(cls, storage_key):
@@ -56,4 +626,95 @@ class BaseModel(object):
           A specific model instance, if found. Otherwise, None.
 
         """
-        return cls.instances.get(cls.__name__, {}).get(storage_key, None)
+        return cls.storage.Get(cls, storage_key)
+
+    @classmethod
+    def GetByStorageKeys(cls, storage_keys):
+        """Gets several instances of this object at once.
+
+        Args:
+          storage_keys: list; The storage keys to look up.
+
+        Returns:
+          A list of model instances, in the order of the keys, with None for
+          each key not found.
+
+        """
+        return cls.storage.GetMany(cls, storage_keys)
+
+
+def ParseFields(names):
+    """Parses the field names given to ToJson() into a tree.
+
+    Args:
+      names: list; Field names, with dotted names for the fields of
+        referenced models, e.g. ['id', 'author.username'].
+
+    Returns:
+      A dict mapping each field name to None to include it whole, or to a
+      dict of the fields to include from the model it references.
+
+    """
+    nested = {}
+    for name in names:
+        field, unused_dot, rest = name.partition('.')
+        if not rest:
+            nested[field] = None
+        elif nested.get(field, ()) is not None:
+            nested.setdefault(field, []).append(rest)
+    return dict((field, rest if rest is None else ParseFields(rest))
+                for field, rest in nested.items())
+
+
+def EncodeJson(value):
+    """Encodes a value as compact UTF-8 JSON, with sorted keys.
+
+    Returns:
+      A bytes string.
+
+    """
+    return formats.JSON.Encode(value)
+
+
+def TimestampToMicroseconds(timestamp):
+    """Converts a naive UTC datetime into microseconds since the epoch."""
+    delta = timestamp - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def MicrosecondsToTimestamp(microseconds):
+    """Converts microseconds since the epoch into a naive UTC datetime."""
+    return EPOCH + datetime.timedelta(microseconds=microseconds)
+
+
+def FormatId(milliseconds, node_id, sequence):
+    """Packs the parts of an id into its string form."""
+    return '%016x' % (
+        ((milliseconds - ID_EPOCH_MILLISECONDS) <<
+         (NODE_ID_BITS + SEQUENCE_BITS)) |
+        (node_id << SEQUENCE_BITS) | sequence)
+
+
+def IdFromTimestamp(timestamp):
+    """Gets the smallest id that can be generated at a given time.
+
+    Args:
+      timestamp: datetime; A naive UTC datetime.
+
+    Returns:
+      The id as a string.
+
+    """
+    return FormatId(TimestampToMicroseconds(timestamp) // 1000, 0, 0)
+
+
+def TimestampFromId(model_id):
+    """Gets the time an id was generated at, to the millisecond.
+
+    Returns:
+      A naive UTC datetime.
+
+    """
+    milliseconds = ((int(model_id, 16) >> (NODE_ID_BITS + SEQUENCE_BITS)) +
+                    ID_EPOCH_MILLISECONDS)
+    return MicrosecondsToTimestamp(milliseconds * 1000)
@@ -0,0 +1,306 @@
+#!/usr/bin/python
+
+import errno
+import fcntl
+import os
+import struct
+import threading
+import time
+
+from bloggerengine import base_model
+from bloggerengine import engine
+from bloggerengine import snapshot
+from bloggerengine import storage
+
+# Messages sent from the snapshot child to the parent over a pipe.
+MESSAGE = struct.Struct('<BQQ')
+MESSAGE_PROGRESS = 1
+MESSAGE_COPY_ON_WRITE = 2
+
+STATE_IDLE = 'idle'
+STATE_RUNNING = 'running'
+STATE_SUCCEEDED = 'succeeded'
+STATE_FAILED = 'failed'
+
+SCHEDULER_POLL_SECONDS = 1.0
+
+
+class BackgroundSnapshotter(object):
+
+    def __init__(self, model_classes, path, interval_seconds=None,
+                 mutation_threshold=None):
+        """Constructor.
+
+        Args:
+          model_classes: dict; Maps model class names to model classes.
+          path: string; The path snapshots are written to.
+          interval_seconds: int; Take a snapshot this often, if set.
+          mutation_threshold: int; Take a snapshot after this many operation
+            log records, if set.
+
+        """
+        self.model_classes = model_classes
+        self.path = path
+        self.interval_seconds = interval_seconds
+        self.mutation_threshold = mutation_threshold
+
+        self.lock = threading.Lock()
+        self.state = STATE_IDLE
+        self.pid = None
+        self.pipe = None
+        self.buffer = b''
+        self.started = None
+        self.finished = None
+        self.objects_written = 0
+        self.objects_total = 0
+        self.copy_on_write_bytes = None
+        self.snapshots_taken = 0
+        self.last_success = None
+        self.last_start = time.time()
+        self.records_at_last_start = self.GetRecordsWritten_()
+
+        self.scheduler = None
+        self.stopped = threading.Event()
+
+    def GetRecordsWritten_(self):
+        """Gets how many records the operation log has seen, if one is open."""
+        operation_log = base_model.BaseModel.oplog
+        if operation_log is None:
+            return 0
+        return operation_log.records_written
+
+    def Start(self):
+        """Forks a child process that writes a snapshot.
+
+        The child walks its copy-on-write view of the datastore, so the parent
+        keeps serving requests. Only the fork itself holds the engine's write
+        locks on every kind, the operation log lock and every collection
+        lock. That way the child's view is consistent, with no mutation
+        half done and no lock held by a thread it does not inherit, and the
+        recorded log offset matches it.
+
+        Returns:
+          True if a snapshot was started, False if one is already running.
+
+        """
+        with self.lock:
+            self.Poll_()
+            if self.state == STATE_RUNNING:
+                return False
+
+            read_fd, write_fd = os.pipe()
+            with engine.BloggerEngine().Writing():
+                operation_log = base_model.BaseModel.oplog
+                if operation_log is not None:
+                    with operation_log.lock, storage.LockingCollections():
+                        operation_log.log_file.flush()
+                        generation = operation_log.generation
+                        offset = operation_log.log_file.tell()
+                        pid = self.Fork_(read_fd, write_fd, generation,
+                                         offset)
+                else:
+                    with storage.LockingCollections():
+                        pid = self.Fork_(read_fd, write_fd, 0, 0)
+
+            os.close(write_fd)
+            flags = fcntl.fcntl(read_fd, fcntl.F_GETFL)
+            fcntl.fcntl(read_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+            self.state = STATE_RUNNING
+            self.pid = pid
+            self.pipe = read_fd
+            self.buffer = b''
+            self.started = time.time()
+            self.finished = None
+            self.objects_written = 0
+            self.objects_total = 0
+            self.copy_on_write_bytes = None
+            self.last_start = self.started
+            self.records_at_last_start = self.GetRecordsWritten_()
+            return True
+
+    def Fork_(self, read_fd, write_fd, generation, offset):
+        """Forks, running the child without releasing any lock it inherited.
+
+        Returns:
+          The child's pid, in the parent.
+
+        """
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            self.RunChild_(write_fd, generation, offset)
+        return pid
+
+    def RunChild_(self, write_fd, generation, offset):
+        """Writes the snapshot in the forked child, then exits."""
+        status = 1
+        try:
+            dirty_before = GetPrivateDirtyBytes()
+
+            def Progress(written, total):
+                os.write(write_fd, MESSAGE.pack(MESSAGE_PROGRESS, written,
+                                                total))
+
+            writer = snapshot.SnapshotWriter(self.model_classes, Progress)
+            writer.Write(self.path, generation, offset)
+
+            dirty_after = GetPrivateDirtyBytes()
+            if dirty_before is not None and dirty_after is not None:
+                os.write(write_fd, MESSAGE.pack(
+                    MESSAGE_COPY_ON_WRITE,
+                    max(dirty_after - dirty_before, 0), 0))
+            status = 0
+        finally:
+            os._exit(status)
+
+    def Poll_(self):
+        """Reads progress from and reaps a running child. Lock must be held."""
+        if self.state != STATE_RUNNING:
+            return
+
+        self.ReadMessages_()
+
+        pid, status = os.waitpid(self.pid, os.WNOHANG)
+        if pid == 0:
+            return
+
+        self.ReadMessages_()
+        os.close(self.pipe)
+        self.pipe = None
+        self.pid = None
+        self.finished = time.time()
+        if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+            self.state = STATE_SUCCEEDED
+            self.snapshots_taken += 1
+            self.last_success = self.finished
+        else:
+            self.state = STATE_FAILED
+
+    def ReadMessages_(self):
+        """Drains any complete messages from the child's pipe."""
+        while True:
+            try:
+                chunk = os.read(self.pipe, 4096)
+            except OSError as error:
+                if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not chunk:
+                break
+            self.buffer += chunk
+
+        while len(self.buffer) >= MESSAGE.size:
+            message_type, first, second = MESSAGE.unpack_from(self.buffer)
+            self.buffer = self.buffer[MESSAGE.size:]
+            if message_type == MESSAGE_PROGRESS:
+                self.objects_written = first
+                self.objects_total = second
+            elif message_type == MESSAGE_COPY_ON_WRITE:
+                self.copy_on_write_bytes = first
+
+    def Wait(self, timeout=None):
+        """Waits for a running snapshot to finish.
+
+        Args:
+          timeout: float; The number of seconds to wait, forever if None.
+
+        Returns:
+          The status, as returned by GetStatus().
+
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            status = self.GetStatus()
+            if status['state'] != STATE_RUNNING:
+                return status
+            if deadline is not None and time.time() >= deadline:
+                return status
+            time.sleep(0.01)
+
+    def GetStatus(self):
+        """Gets the progress of the current or last snapshot.
+
+        Returns:
+          A dictionary suitable for serialization.
+
+        """
+        with self.lock:
+            self.Poll_()
+
+            if self.started is None:
+                duration = None
+            else:
+                duration = (self.finished or time.time()) - self.started
+
+            return {
+                'state': self.state,
+                'path': self.path,
+                'pid': self.pid,
+                'started': self.started,
+                'duration_seconds': duration,
+                'objects_written': self.objects_written,
+                'objects_total': self.objects_total,
+                'copy_on_write_bytes': self.copy_on_write_bytes,
+                'snapshots_taken': self.snapshots_taken,
+                'last_success': self.last_success,
+                'interval_seconds': self.interval_seconds,
+                'mutation_threshold': self.mutation_threshold,
+                'mutations_since_start': (self.GetRecordsWritten_() -
+                                          self.records_at_last_start)
+            }
+
+    def IsDue(self):
+        """Checks whether the schedule calls for a new snapshot.
+
+        Returns:
+          True if the interval has elapsed or enough mutations were logged.
+
+        """
+        if (self.interval_seconds is not None and
+                time.time() - self.last_start >= self.interval_seconds):
+            return True
+
+        mutations = self.GetRecordsWritten_() - self.records_at_last_start
+        return (self.mutation_threshold is not None and
+                mutations >= self.mutation_threshold)
+
+    def StartScheduler(self):
+        """Starts a thread that takes snapshots whenever IsDue()."""
+        if self.scheduler is not None:
+            return
+
+        self.stopped.clear()
+        self.scheduler = threading.Thread(target=self.SchedulerLoop_)
+        self.scheduler.daemon = True
+        self.scheduler.start()
+
+    def StopScheduler(self):
+        """Stops the scheduler thread, leaving any running snapshot alone."""
+        if self.scheduler is None:
+            return
+
+        self.stopped.set()
+        self.scheduler.join()
+        self.scheduler = None
+
+    def SchedulerLoop_(self):
+        while not self.stopped.wait(SCHEDULER_POLL_SECONDS):
+            if self.GetStatus()['state'] != STATE_RUNNING and self.IsDue():
+                self.Start()
+
+
+def GetPrivateDirtyBytes():
+    """Gets this process' private dirty memory, i.e. its copied-on-write pages.
+
+    Returns:
+      The number of bytes, or None where /proc is unavailable.
+
+    """
+    try:
+        with open('/proc/self/smaps_rollup') as smaps:
+            for line in smaps:
+                if line.startswith('Private_Dirty:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        return None
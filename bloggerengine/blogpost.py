@@ -1,10 +1,23 @@
 #!/usr/bin/python
 
-from collections import OrderedDict
 from bloggerengine import base_model
+from bloggerengine import storage
 
 
 class Blogpost(base_model.BaseModel):
+    persisted_fields = ('headline', 'body')
+    persisted_references = ('author',)
+    relation_fields = ('comments', 'labels')
+    json_fields = {
+        'headline': lambda blogpost: blogpost.headline,
+        'body': lambda blogpost: blogpost.body,
+        'id': lambda blogpost: blogpost.id,
+        'created_timestamp': lambda blogpost: blogpost.created_timestamp,
+        'labels': lambda blogpost: [label.label
+                                    for label in blogpost.GetLabels()],
+        'comments': lambda blogpost: [comment.id
+                                      for comment in blogpost.GetComments()]
+    }
 
     def __init__(self, author, headline, body):
         """Constructor."""
@@ -16,8 +29,8 @@ class Blogpost(base_model.BaseModel):
         self.headline = headline
         self.body = body
 
-        self.comments = OrderedDict()
-        self.labels = OrderedDict()
+        self.comments = storage.VersionedCollection()
+        self.labels = storage.VersionedCollection()
 
     def AddComment(self, comment):
         """Adds a comment to this blog post.
@@ -28,6 +41,7 @@ class Blogpost(base_model.BaseModel):
         """
         if comment.id not in self.comments:
             self.comments[comment.id] = comment
+            self.RecordLink_('comments', comment.id, comment)
 
     def RemoveComment(self, comment):
         """Removes a comment from this blog post.
@@ -38,6 +52,7 @@ class Blogpost(base_model.BaseModel):
         """
         if comment.id in self.comments:
             del self.comments[comment.id]
+            self.RecordUnlink_('comments', comment.id)
             comment.RemoveFromBlogpost()
 
     def AddLabel(self, label):
@@ -48,8 +63,9 @@ class Blogpost(base_model.BaseModel):
 
         """
         if label.label not in self.labels:
-            label.AddToBlogpost(self)
             self.labels[label.label] = label
+            self.RecordLink_('labels', label.label, label)
+            label.AddToBlogpost(self)
 
     def RemoveLabel(self, label):
         """Removes a label from this blog post.
@@ -60,6 +76,7 @@ class Blogpost(base_model.BaseModel):
         """
         if label.label in self.labels:
             del self.labels[label.label]
+            self.RecordUnlink_('labels', label.label)
             label.RemoveFromBlogpost(self)
 
     def GetComments(self):
@@ -79,20 +96,3 @@ class Blogpost(base_model.BaseModel):
 
         """
         return list(self.labels.values())
-
-    def ToJson(self):
-        """Converts this object into a dictionary suitable for serialization.
-
-        Returns:
-          A dictionary.
-
-        """
-        return {
-            'author': self.author.ToJson(),
-            'headline': self.headline,
-            'body': self.body,
-            'id': self.id,
-            'created_timestamp': str(self.created_timestamp),
-            'labels': [label.label for label in self.GetLabels()],
-            'comments': [comment.id for comment in self.GetComments()]
-        }
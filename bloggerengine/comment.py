@@ -4,6 +4,13 @@ from bloggerengine import base_model
 
 
 class Comment(base_model.BaseModel):
+    persisted_fields = ('comment_text',)
+    persisted_references = ('author', 'blogpost')
+    json_fields = {
+        'created_timestamp': lambda comment: comment.created_timestamp,
+        'comment_text': lambda comment: comment.comment_text,
+        'id': lambda comment: comment.id
+    }
 
     def __init__(self, author, blogpost, comment_text):
         """Constructor.
@@ -27,18 +34,3 @@ class Comment(base_model.BaseModel):
         """Removes this comment from the attached blogpost."""
         self.author.RemoveComment(self)
         self.blogpost.RemoveComment(self)
-
-    def ToJson(self):
-        """Converts this object into a dictionary suitable for serialization.
-
-        Returns:
-          A dictionary.
-
-        """
-        return {
-            'author': self.author.ToJson(),
-            'blogpost': self.blogpost.ToJson(),
-            'created_timestamp': str(self.created_timestamp),
-            'comment_text': self.comment_text,
-            'id': self.id
-        }
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+
+# Content codings responses can be compressed with, the preferred first.
+ENCODINGS = ('gzip', 'deflate')
+
+# zlib window bits giving each coding's header and trailer. HTTP's deflate
+# is the zlib format, not a raw deflate stream.
+WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+DEFAULT_LEVEL = 6
+DEFAULT_MIN_BYTES = 1024
+DEFAULT_CACHE_BYTES = 32 * 1024 * 1024
+
+
+def Compress(data, encoding, level=DEFAULT_LEVEL):
+    """Compresses a bytes string with a content coding.
+
+    Args:
+      data: bytes; The data to compress.
+      encoding: string; One of ENCODINGS.
+      level: int; The zlib compression level, from 1 to 9.
+
+    Returns:
+      The compressed bytes.
+
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, WBITS[encoding])
+    return compressor.compress(data) + compressor.flush()
+
+
+def CompressChunks(chunks, encoding, level=DEFAULT_LEVEL):
+    """Compresses an iterable of bytes strings as they are produced.
+
+    Args:
+      chunks: iterable; The bytes strings to compress, in order.
+      encoding: string; One of ENCODINGS.
+      level: int; The zlib compression level, from 1 to 9.
+
+    Yields:
+      Compressed bytes strings, which together make a single stream.
+
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, WBITS[encoding])
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class CompressionCache(object):
+
+    """Keeps compressed payloads, so unchanged ones are not compressed again.
+
+    Payloads are looked up by their digest, so a payload is reused for any
+    request producing the same bytes, and a changed payload, whichever
+    model changed it, is never mistaken for an old one. The least recently
+    used payloads are evicted once the compressed bytes kept exceed
+    max_bytes.
+
+    Attributes:
+      level: int; The zlib compression level, from 1 to 9.
+      max_bytes: int; The most compressed bytes to keep. 0 disables the
+        cache.
+      hits: int; How many payloads were found in the cache.
+      misses: int; How many payloads had to be compressed.
+
+    """
+
+    def __init__(self, level=DEFAULT_LEVEL, max_bytes=DEFAULT_CACHE_BYTES):
+        self.level = level
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def Compress(self, data, encoding):
+        """Compresses a payload, or gets it from the cache.
+
+        Args:
+          data: bytes; The payload.
+          encoding: string; One of ENCODINGS.
+
+        Returns:
+          The compressed bytes.
+
+        """
+        key = (encoding, len(data), hashlib.sha1(data).digest())
+        with self.lock:
+            compressed = self.entries.get(key)
+            if compressed is not None:
+                # Reinserted as most recently used; Python 2's OrderedDict
+                # has no move_to_end().
+                self.entries[key] = self.entries.pop(key)
+                self.hits += 1
+                return compressed
+            self.misses += 1
+
+        compressed = Compress(data, encoding, self.level)
+        if len(compressed) > self.max_bytes:
+            return compressed
+
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = compressed
+                self.size += len(compressed)
+            while self.size > self.max_bytes:
+                unused_key, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+        return compressed
+
+    def GetStats(self):
+        """Gets the cache's hits, misses, hit rate, entries and size."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else None,
+                'entries': len(self.entries),
+                'bytes': self.size,
+            }
@@ -1,15 +1,242 @@
 #/usr/bin/python
 
+import contextlib
+import os
+
 from bloggerengine import author as author_model
+from bloggerengine import base_model
 from bloggerengine import blogpost as blogpost_model
 from bloggerengine import comment as comment_model
 from bloggerengine import label as label_model
+from bloggerengine import locking
+from bloggerengine import oplog
+from bloggerengine import pagination
+from bloggerengine import snapshot
+from bloggerengine import storage
+
+MODEL_CLASSES = dict((model_class.__name__, model_class)
+                     for model_class in (author_model.Author,
+                                         blogpost_model.Blogpost,
+                                         comment_model.Comment,
+                                         label_model.Label))
 
 
 class BloggerEngine(object):
 
-    """BloggerEngine interface."""
+    """BloggerEngine interface.
+
+    Every method locks the model kinds it touches, so the engine can be
+    shared by the threads of a threaded server: lookups run concurrently,
+    while mutations of a kind wait for its readers and exclude each other.
+    The GetAll methods read an immutable snapshot instead, without locks.
+
+    """
+
+    # Shared by all engines, since they share the model instances.
+    locks = locking.LockManager(MODEL_CLASSES)
+
+    def Reading(self, *kinds):
+        """Holds read locks, e.g. to serialize several results consistently.
+
+        Args:
+          *kinds: The model kinds to lock. Defaults to all of them.
+
+        Returns:
+          A context manager.
+
+        """
+        return self.locks.Locking(reads=kinds or MODEL_CLASSES)
+
+    def Writing(self, *kinds):
+        """Holds write locks, e.g. to group several mutations.
+
+        Args:
+          *kinds: The model kinds to lock. Defaults to all of them.
+
+        Returns:
+          A context manager.
+
+        """
+        return self.locks.Locking(writes=kinds or MODEL_CLASSES)
+
+    @contextlib.contextmanager
+    def Transaction(self):
+        """Runs a block of operations as one atomic, exclusive section.
+
+        Holds write locks on every kind for the whole block, so no other
+        thread reads its intermediate states: the GetAll methods keep
+        seeing the data from before it until it ends. Its mutations are
+        logged and persisted together when it ends. If it raises, every
+        change it made is rolled back from an undo log, nothing is logged
+        or persisted, and the exception propagates.
+
+        """
+        with self.Writing(), base_model.BaseModel.Batching(atomic=True):
+            yield
+
+    def OpenOperationLog(self, path, durability=oplog.DURABILITY_ALWAYS,
+                         group_commit_ms=oplog.DEFAULT_GROUP_COMMIT_MS,
+                         snapshot_path=None):
+        """Restores the datastore from an operation log and starts logging.
+
+        If a snapshot of the same log exists, it is loaded and only the tail
+        of the log it does not cover is replayed. Otherwise every record in
+        the log is replayed. All further mutations are appended to the log.
+
+        Args:
+          path: string; The path of the log file, created if missing.
+          durability: string; One of oplog.DURABILITY_MODES.
+          group_commit_ms: int; The fsync interval for oplog.DURABILITY_GROUP.
+          snapshot_path: string; The path of a snapshot to start from.
+
+        Returns:
+          The opened OperationLog.
+
+        """
+        self.CloseOperationLog()
+
+        operation_log = oplog.OperationLog(path, durability, group_commit_ms)
+
+        registry = None
+        start = None
+        if snapshot_path and os.path.exists(snapshot_path):
+            registry, generation, offset = snapshot.LoadSnapshot(
+                snapshot_path, MODEL_CLASSES)
+            if generation == operation_log.generation:
+                start = offset
+            else:
+                # The snapshot belongs to another log; replay all of this one.
+                for model_class in MODEL_CLASSES.values():
+                    model_class.instances.pop(model_class.__name__, None)
+                registry = None
+
+        registry = operation_log.Replay(MODEL_CLASSES, start, registry)
+        # New ids must not repeat restored ones, even if the clock is behind.
+        base_model.BaseModel.id_generator.Advance(
+            model_id for unused_kind, model_id in registry)
+        base_model.BaseModel.oplog = operation_log
+        return operation_log
+
+    def CloseOperationLog(self):
+        """Flushes and detaches the operation log, if one is open."""
+        operation_log = base_model.BaseModel.oplog
+        base_model.BaseModel.oplog = None
+        if operation_log is not None:
+            operation_log.Close()
+
+    def CompactOperationLog(self):
+        """Rewrites the operation log down to the live datastore.
+
+        Writers wait while the live data is walked, but not while the log
+        is synced and swapped in.
+
+        Returns:
+          A (bytes before, bytes after) tuple, or None if no log is open.
+
+        """
+        operation_log = base_model.BaseModel.oplog
+        if operation_log is None:
+            return None
+
+        return operation_log.Compact(MODEL_CLASSES, self.Reading)
+
+    def GetJsonCacheStats(self):
+        """Gets how often each model kind's ToJson() cache was used.
+
+        Returns:
+          A dict mapping each model kind to a dict of hits, misses and
+          hit_rate.
+
+        """
+        return dict((kind, model_class.GetJsonCacheStats())
+                    for kind, model_class in MODEL_CLASSES.items())
+
+    def GetCollectionVersions(self, *kinds):
+        """Gets the collection versions of model kinds.
+
+        A kind's collection version changes whenever any of its instances
+        is stored, deleted or changed, so equal versions mean unchanged
+        collections.
+
+        Args:
+          *kinds: string; The model kinds. Defaults to every kind.
+
+        Returns:
+          A tuple of the versions, in the order of kinds, or sorted by kind
+          if none are given.
+
+        """
+        kinds = kinds or sorted(MODEL_CLASSES)
+        return tuple(MODEL_CLASSES[kind].collection_version for kind in kinds)
+
+    @locking.Reads('Author', 'Blogpost', 'Comment', 'Label')
+    def SaveSnapshot(self, path):
+        """Writes a binary snapshot of the whole datastore.
+
+        The snapshot records how much of the operation log it covers, so that
+        OpenOperationLog() only needs to replay the records after it.
+
+        Args:
+          path: string; The path of the snapshot file.
+
+        Returns:
+          The number of objects written.
+
+        """
+        generation = 0
+        offset = 0
+        operation_log = base_model.BaseModel.oplog
+        if operation_log is not None:
+            generation = operation_log.generation
+            offset = operation_log.Tell()
+
+        writer = snapshot.SnapshotWriter(MODEL_CLASSES)
+        return writer.Write(path, generation, offset)
+
+    def OpenSqliteStorage(self, path):
+        """Stores the datastore in a SQLite database instead of in memory.
+
+        The operation log and snapshots only cover the in-memory storage, and
+        are not needed with SQLite, which is durable by itself.
+
+        Args:
+          path: string; The path of the database, created if missing.
+
+        Returns:
+          The opened SqliteBackend.
+
+        """
+        self.CloseStorage()
+        backend = storage.SqliteBackend(path, MODEL_CLASSES)
+        base_model.BaseModel.storage = backend
+        return backend
+
+    def CloseStorage(self):
+        """Closes the SQLite database, if open, and goes back to memory."""
+        backend = base_model.BaseModel.storage
+        base_model.BaseModel.storage = storage.MemoryBackend()
+        if isinstance(backend, storage.SqliteBackend):
+            backend.Close()
+
+    def GetSnapshot(self, *kinds):
+        """Gets a consistent, immutable view of the datastore.
 
+        The locks are only held while the current version of each kind is
+        grabbed, so long-running readers of the view never block writers.
+
+        Args:
+          *kinds: The model kinds to include. Defaults to all of them.
+
+        Returns:
+          A dict mapping each model kind to a CollectionSnapshot.
+
+        """
+        kinds = kinds or MODEL_CLASSES
+        with self.Reading(*kinds):
+            return dict((kind, MODEL_CLASSES[kind].GetSnapshot())
+                        for kind in kinds)
+
+    @locking.Writes('Author', 'Blogpost')
     def SubmitBlogpost(self, username, headline, body):
         """Submits a blog post.
 
@@ -29,6 +256,35 @@ class BloggerEngine(object):
 
         return post
 
+    @locking.Writes('Author', 'Blogpost')
+    def SubmitBlogposts(self, blogposts):
+        """Submits many blog posts, persisted together.
+
+        Each distinct author is looked up, or created, once.
+
+        Args:
+          blogposts: iterable; (username, headline, body) tuples.
+
+        Returns:
+          A list of the Blogpost instances, in order.
+
+        """
+        authors = {}
+        posts = []
+        with base_model.BaseModel.Batching():
+            for username, headline, body in blogposts:
+                author = authors.get(username)
+                if author is None:
+                    author = authors[username] = self.GetOrInsertAuthor(
+                        username)
+
+                post = blogpost_model.Blogpost(author, headline, body)
+                post.put()
+                posts.append(post)
+
+        return posts
+
+    @locking.Writes('Blogpost', 'Label')
     def AddLabelToBlogpost(self, label_text, blogpost_id):
         """Adds a label to a given blog post.
 
@@ -53,6 +309,48 @@ class BloggerEngine(object):
         label.AddToBlogpost(post)
         return label
 
+    @locking.Writes('Blogpost', 'Label')
+    def AddLabelsToBlogposts(self, labels):
+        """Adds many labels to blog posts, persisted together.
+
+        Each distinct label and blog post is looked up once, and each
+        missing label is created once.
+
+        Args:
+          labels: iterable; (label_text, blogpost_id) tuples.
+
+        Returns:
+          A list of the Label instances, in order, with None for each blog
+          post not found.
+
+        """
+        posts = {}
+        found_labels = {}
+        results = []
+        with base_model.BaseModel.Batching():
+            for label_text, blogpost_id in labels:
+                if blogpost_id not in posts:
+                    posts[blogpost_id] = (
+                        blogpost_model.Blogpost.GetByStorageKey(blogpost_id))
+                post = posts[blogpost_id]
+                if not post:
+                    results.append(None)
+                    continue
+
+                label = found_labels.get(label_text)
+                if label is None:
+                    label = label_model.Label.GetByStorageKey(label_text)
+                    if not label:
+                        label = label_model.Label(label_text)
+                        label.put()
+                    found_labels[label_text] = label
+
+                post.AddLabel(label)
+                results.append(label)
+
+        return results
+
+    @locking.Writes('Author', 'Blogpost', 'Comment')
     def SubmitComment(self, username, comment_text, blogpost_id):
         """Submits a comment.
 
@@ -72,11 +370,54 @@ class BloggerEngine(object):
 
         return comment
 
-    def GetCommentsByBlogpost(self, blogpost_id):
+    @locking.Writes('Author', 'Blogpost', 'Comment')
+    def SubmitComments(self, comments):
+        """Submits many comments, persisted together.
+
+        Each distinct author and blog post is looked up once, and each
+        missing author is created once.
+
+        Args:
+          comments: iterable; (username, comment_text, blogpost_id) tuples.
+
+        Returns:
+          A list of the Comment instances, in order, with None for each
+          blog post not found.
+
+        """
+        authors = {}
+        posts = {}
+        results = []
+        with base_model.BaseModel.Batching():
+            for username, comment_text, blogpost_id in comments:
+                if blogpost_id not in posts:
+                    posts[blogpost_id] = (
+                        blogpost_model.Blogpost.GetByStorageKey(blogpost_id))
+                post = posts[blogpost_id]
+                if not post:
+                    results.append(None)
+                    continue
+
+                author = authors.get(username)
+                if author is None:
+                    author = authors[username] = self.GetOrInsertAuthor(
+                        username)
+
+                comment = comment_model.Comment(author, post, comment_text)
+                comment.put()
+                results.append(comment)
+
+        return results
+
+    @locking.Reads('Blogpost', 'Comment')
+    def GetCommentsByBlogpost(self, blogpost_id, limit=None, cursor=None):
         """Gets all comments for a given blogpost.
 
         Args:
           blogpost_id: string; The blogpost ID to retrieve comments from.
+          limit: int; Return a pagination.Page of at most this many,
+            ordered by id.
+          cursor: string; Continue from the next_cursor of a previous Page.
 
         Returns:
           A list of comments associated with this blogpost.
@@ -84,13 +425,19 @@ class BloggerEngine(object):
         """
         blogpost = blogpost_model.Blogpost.GetByStorageKey(blogpost_id)
         if blogpost:
-            return blogpost.GetComments()
+            if limit is None and cursor is None:
+                return blogpost.GetComments()
+            return pagination.Paginate(blogpost.comments, limit, cursor)
 
-    def GetLabelsByBlogpost(self, blogpost_id):
+    @locking.Reads('Blogpost', 'Label')
+    def GetLabelsByBlogpost(self, blogpost_id, limit=None, cursor=None):
         """Gets all labels associated with a given blogpost.
 
         Args:
           blogpost_id: string; The blogpost ID to retrieve labels from,
+          limit: int; Return a pagination.Page of at most this many,
+            ordered by label text.
+          cursor: string; Continue from the next_cursor of a previous Page.
 
         Returns:
           A list of labels associated with this blogpost.
@@ -98,8 +445,11 @@ class BloggerEngine(object):
         """
         blogpost = blogpost_model.Blogpost.GetByStorageKey(blogpost_id)
         if blogpost:
-            return blogpost.GetLabels()
+            if limit is None and cursor is None:
+                return blogpost.GetLabels()
+            return pagination.Paginate(blogpost.labels, limit, cursor)
 
+    @locking.Reads('Blogpost', 'Comment')
     def GetCommentsOnBlogpostFilteredByUser(self, username, blogpost_id):
         """Gets all comments on a given blogpost, filtered by a username.
 
@@ -116,11 +466,15 @@ class BloggerEngine(object):
                     for comment in comments
                     if comment.author.username == username]
 
-    def GetCommentsByUsername(self, username):
+    @locking.Reads('Author', 'Comment')
+    def GetCommentsByUsername(self, username, limit=None, cursor=None):
         """Gets all comments for a given username.
 
         Args:
           username: string; A string representing the comment author's username.
+          limit: int; Return a pagination.Page of at most this many,
+            ordered by id.
+          cursor: string; Continue from the next_cursor of a previous Page.
 
         Returns:
           A list of that user's comments, if the author is found.
@@ -128,8 +482,11 @@ class BloggerEngine(object):
         """
         author = author_model.Author.GetByStorageKey(username)
         if author:
-            return author.GetComments()
+            if limit is None and cursor is None:
+                return author.GetComments()
+            return pagination.Paginate(author.comments, limit, cursor)
 
+    @locking.Reads('Comment')
     def GetCommentById(self, comment_id):
         """Gets a comment from a given comment_id.
 
@@ -142,19 +499,41 @@ class BloggerEngine(object):
         """
         return comment_model.Comment.GetByStorageKey(comment_id)
 
-    def GetBlogpostsByUsername(self, username):
+    @locking.Reads('Comment')
+    def GetCommentsByIds(self, comment_ids):
+        """Gets several comments by id at once.
+
+        Args:
+          comment_ids: list; The comment ids to get.
+
+        Returns:
+          A list of comments, in the order of the ids, with None for each
+          comment not found.
+
+        """
+        return comment_model.Comment.GetByStorageKeys(comment_ids)
+
+    @locking.Reads('Author', 'Blogpost')
+    def GetBlogpostsByUsername(self, username, limit=None, cursor=None):
         """Gets all blog posts for a given username.
 
         Args:
           username: string; A string representing the blogpost author's username.
+          limit: int; Return a pagination.Page of at most this many,
+            ordered by id.
+          cursor: string; Continue from the next_cursor of a previous Page.
+
         Returns:
           A list of the given user's blogposts.
 
         """
         author = author_model.Author.GetByStorageKey(username)
         if author:
-            return author.GetBlogposts()
+            if limit is None and cursor is None:
+                return author.GetBlogposts()
+            return pagination.Paginate(author.blogposts, limit, cursor)
 
+    @locking.Reads('Blogpost')
     def GetBlogpostById(self, blogpost_id):
         """Gets a specific blogpost by ID.
 
@@ -167,11 +546,29 @@ class BloggerEngine(object):
         """
         return blogpost_model.Blogpost.GetByStorageKey(blogpost_id)
 
-    def GetBlogpostsByLabel(self, label_text):
+    @locking.Reads('Blogpost')
+    def GetBlogpostsByIds(self, blogpost_ids):
+        """Gets several blogposts by id at once.
+
+        Args:
+          blogpost_ids: list; The blogpost IDs to retrieve.
+
+        Returns:
+          A list of blogposts, in the order of the ids, with None for each
+          blogpost not found.
+
+        """
+        return blogpost_model.Blogpost.GetByStorageKeys(blogpost_ids)
+
+    @locking.Reads('Blogpost', 'Label')
+    def GetBlogpostsByLabel(self, label_text, limit=None, cursor=None):
         """Gets all blogposts with a given label attached to them.
 
         Args:
           label_text: string; The label text to query for.
+          limit: int; Return a pagination.Page of at most this many,
+            ordered by id.
+          cursor: string; Continue from the next_cursor of a previous Page.
 
         Returns:
           The requested blogposts or None, if not found.
@@ -179,17 +576,28 @@ class BloggerEngine(object):
         """
         label = label_model.Label.GetByStorageKey(label_text)
         if label:
-            return label.GetBlogposts()
+            if limit is None and cursor is None:
+                return label.GetBlogposts()
+            return pagination.Paginate(label.blogposts, limit, cursor)
 
-    def GetAllBlogposts(self):
+    def GetAllBlogposts(self, limit=None, cursor=None):
         """Gets all blog posts.
 
+        Args:
+          limit: int; Return a pagination.Page of at most this many,
+            ordered by id.
+          cursor: string; Continue from the next_cursor of a previous Page.
+
         Returns:
           A list of blog posts.
 
         """
-        return blogpost_model.Blogpost.GetAll()
+        if limit is None and cursor is None:
+            return blogpost_model.Blogpost.GetAll()
+        return pagination.Paginate(blogpost_model.Blogpost.GetSnapshot(),
+                                   limit, cursor)
 
+    @locking.Reads('Author')
     def GetAuthorByUsername(self, username):
         """Gets an author object by username.
 
@@ -202,6 +610,21 @@ class BloggerEngine(object):
         """
         return author_model.Author.GetByStorageKey(username)
 
+    @locking.Reads('Author')
+    def GetAuthorsByUsernames(self, usernames):
+        """Gets several authors by username at once.
+
+        Args:
+          usernames: list; The usernames to look up.
+
+        Returns:
+          A list of authors, in the order of the usernames, with None for
+          each author not found.
+
+        """
+        return author_model.Author.GetByStorageKeys(usernames)
+
+    @locking.Writes('Blogpost', 'Label')
     def RemoveLabelFromBlogpost(self, label_text, blogpost_id):
         """Removes a label from a given blogpost.
 
@@ -217,6 +640,7 @@ class BloggerEngine(object):
             blogpost.RemoveLabel(label)
             return (label, blogpost)
 
+    @locking.Writes('Author', 'Blogpost', 'Comment')
     def RemoveCommentFromBlogpost(self, comment_id):
         """Removes a given comment from a blogpost.
 
@@ -231,8 +655,9 @@ class BloggerEngine(object):
         comment.RemoveFromBlogpost()
         return comment
 
+    @locking.Writes('Blogpost', 'Label')
     def DeleteLabel(self, label_text):
-        """Removes a label from all blogposts and deletes it.
+        """Removes a label from all blogposts and deletes it, atomically.
 
         Args:
           label_text: string; The label to delete.
@@ -242,15 +667,17 @@ class BloggerEngine(object):
         if not label:
             return None
 
-        for blogpost in label.GetBlogposts():
-            blogpost.RemoveLabel(label)
-            label.RemoveFromBlogpost(blogpost)
+        with base_model.BaseModel.Batching(atomic=True):
+            for blogpost in label.GetBlogposts():
+                blogpost.RemoveLabel(label)
+                label.RemoveFromBlogpost(blogpost)
 
-        label.delete()
+            label.delete()
         return label
 
+    @locking.Writes('Author', 'Blogpost', 'Comment', 'Label')
     def DeleteBlogpost(self, blogpost_id):
-        """Removes a blogpost from the datastore and associated comments.
+        """Removes a blogpost and its comments from the datastore, atomically.
 
         Args:
           blogpost_id: string; The blogpost ID to delete.
@@ -263,25 +690,35 @@ class BloggerEngine(object):
         if not blogpost:
             return None
 
-        blogpost.author.RemoveBlogpost(blogpost)
-        for comment in blogpost.GetComments():
-            comment.RemoveFromBlogpost()
+        with base_model.BaseModel.Batching(atomic=True):
+            blogpost.author.RemoveBlogpost(blogpost)
+            for comment in blogpost.GetComments():
+                comment.RemoveFromBlogpost()
 
-        for label in blogpost.GetLabels():
-            label.RemoveFromBlogpost(blogpost)
+            for label in blogpost.GetLabels():
+                label.RemoveFromBlogpost(blogpost)
 
-        blogpost.delete()
+            blogpost.delete()
         return blogpost
 
-    def GetAllLabels(self):
+    def GetAllLabels(self, limit=None, cursor=None):
         """Gets all labels.
 
+        Args:
+          limit: int; Return a pagination.Page of at most this many,
+            ordered by label text.
+          cursor: string; Continue from the next_cursor of a previous Page.
+
         Returns:
           A list of all label instances.
 
         """
-        return label_model.Label.GetAll()
+        if limit is None and cursor is None:
+            return label_model.Label.GetAll()
+        return pagination.Paginate(label_model.Label.GetSnapshot(),
+                                   limit, cursor)
 
+    @locking.Writes('Label')
     def GetOrInsertLabel(self, label_text):
         """Gets or inserts a label.
 
@@ -298,6 +735,7 @@ class BloggerEngine(object):
             label.put()
         return label
 
+    @locking.Reads('Label')
     def GetLabel(self, label_text):
         """Gets a label by it's label text.
 
@@ -310,6 +748,21 @@ class BloggerEngine(object):
         """
         return label_model.Label.GetByStorageKey(label_text)
 
+    @locking.Reads('Label')
+    def GetLabelsByText(self, label_texts):
+        """Gets several labels by their label text at once.
+
+        Args:
+          label_texts: list; The label texts to get.
+
+        Returns:
+          A list of labels, in the order of the texts, with None for each
+          label not found.
+
+        """
+        return label_model.Label.GetByStorageKeys(label_texts)
+
+    @locking.Writes('Author')
     def GetOrInsertAuthor(self, username):
         """Gets or inserts an Author object by username.
 
@@ -328,20 +781,36 @@ class BloggerEngine(object):
         author.put()
         return author
 
-    def GetAllAuthors(self):
+    def GetAllAuthors(self, limit=None, cursor=None):
         """Gets all authors.
 
+        Args:
+          limit: int; Return a pagination.Page of at most this many,
+            ordered by username.
+          cursor: string; Continue from the next_cursor of a previous Page.
+
         Returns:
           A list of all author instances.
 
         """
-        return author_model.Author.GetAll()
+        if limit is None and cursor is None:
+            return author_model.Author.GetAll()
+        return pagination.Paginate(author_model.Author.GetSnapshot(),
+                                   limit, cursor)
 
-    def GetAllComments(self):
+    def GetAllComments(self, limit=None, cursor=None):
         """Gets all comments.
 
+        Args:
+          limit: int; Return a pagination.Page of at most this many,
+            ordered by id.
+          cursor: string; Continue from the next_cursor of a previous Page.
+
         Returns:
           A list of all comment instances.
 
         """
-        return comment_model.Comment.GetAll()
+        if limit is None and cursor is None:
+            return comment_model.Comment.GetAll()
+        return pagination.Paginate(comment_model.Comment.GetSnapshot(),
+                                   limit, cursor)
@@ -0,0 +1,213 @@
+#!/usr/bin/python
+
+import datetime
+import json
+import struct
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Utc_(datetime.tzinfo):
+
+    """UTC, for Pythons without datetime.timezone."""
+
+    def utcoffset(self, unused_value):
+        return datetime.timedelta(0)
+
+    def dst(self, unused_value):
+        return datetime.timedelta(0)
+
+    def tzname(self, unused_value):
+        return 'UTC'
+
+
+try:
+    UTC = datetime.timezone.utc
+except AttributeError:
+    UTC = Utc_()
+
+# Encodes JSON as served, compact and with sorted keys like jsonify.
+JSON_ENCODER = json.JSONEncoder(sort_keys=True, separators=(',', ':'))
+
+
+class Format(object):
+
+    """A format requests and responses can be serialized in.
+
+    Responses are assembled from encoded parts: a map or array is its
+    start, then its items joined by separator, then its end. Map items are
+    an encoded key, key_separator and an encoded value.
+
+    Attributes:
+      name: string; Short name of the format.
+      mimetypes: tuple; The mimetypes it is known by, the one it is sent
+        with first.
+      available: bool; Whether the library it needs is installed.
+
+    """
+
+    name = None
+    mimetypes = ()
+    available = True
+    separator = b''
+    key_separator = b''
+    map_end = b''
+    array_end = b''
+    # Appended to whole responses.
+    trailer = b''
+
+    def Encode(self, value):
+        """Encodes a value, with datetimes as the format's timestamps.
+
+        Returns:
+          A bytes string.
+
+        """
+        raise NotImplementedError
+
+    def Decode(self, data):
+        """Decodes a bytes string.
+
+        Raises:
+          ValueError: If the data is not valid.
+
+        """
+        raise NotImplementedError
+
+    def MapStart(self, count):
+        """Gets the bytes starting a map of count items."""
+        raise NotImplementedError
+
+    def ArrayStart(self, count):
+        """Gets the bytes starting an array of count items."""
+        raise NotImplementedError
+
+
+class JsonFormat(Format):
+
+    """JSON, which has no timestamps, so they are sent as strings."""
+
+    name = 'json'
+    mimetypes = ('application/json',)
+    separator = b','
+    key_separator = b':'
+    map_end = b'}'
+    array_end = b']'
+    trailer = b'\n'
+
+    def Encode(self, value):
+        return JSON_ENCODER.encode(value).encode('utf-8')
+
+    def Decode(self, data):
+        try:
+            return json.loads(data.decode('utf-8'))
+        except UnicodeDecodeError as error:
+            raise ValueError(str(error))
+
+    def MapStart(self, count):
+        return b'{'
+
+    def ArrayStart(self, count):
+        return b'['
+
+
+class MessagePackFormat(Format):
+
+    """MessagePack, with timestamps as the timestamp extension type."""
+
+    name = 'msgpack'
+    mimetypes = ('application/msgpack', 'application/x-msgpack',
+                 'application/vnd.msgpack')
+    available = msgpack is not None
+
+    def Encode(self, value):
+        return msgpack.packb(value, use_bin_type=True,
+                             default=EncodeMessagePackTimestamp_)
+
+    def Decode(self, data):
+        try:
+            return msgpack.unpackb(data, raw=False, timestamp=3)
+        except (TypeError, msgpack.UnpackException) as error:
+            raise ValueError(str(error))
+
+    def MapStart(self, count):
+        if count < 16:
+            return struct.pack('>B', 0x80 | count)
+        if count < 0x10000:
+            return struct.pack('>BH', 0xde, count)
+        return struct.pack('>BI', 0xdf, count)
+
+    def ArrayStart(self, count):
+        if count < 16:
+            return struct.pack('>B', 0x90 | count)
+        if count < 0x10000:
+            return struct.pack('>BH', 0xdc, count)
+        return struct.pack('>BI', 0xdd, count)
+
+
+class CborFormat(Format):
+
+    """CBOR, with timestamps as epoch-based date/times (tag 1)."""
+
+    name = 'cbor'
+    mimetypes = ('application/cbor',)
+    available = cbor2 is not None
+
+    def Encode(self, value):
+        return cbor2.dumps(value, timezone=UTC, datetime_as_timestamp=True)
+
+    def Decode(self, data):
+        try:
+            return cbor2.loads(data)
+        except cbor2.CBORDecodeError as error:
+            raise ValueError(str(error))
+
+    def MapStart(self, count):
+        return EncodeCborHead_(5, count)
+
+    def ArrayStart(self, count):
+        return EncodeCborHead_(4, count)
+
+
+def EncodeMessagePackTimestamp_(value):
+    """Encodes the naive UTC datetimes msgpack cannot encode by itself."""
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=UTC)
+        return msgpack.Timestamp.from_datetime(value)
+    raise TypeError('Cannot serialize %r' % (value,))
+
+
+def EncodeCborHead_(major_type, count):
+    """Encodes the head of a CBOR data item with a length argument."""
+    major_type <<= 5
+    if count < 24:
+        return struct.pack('>B', major_type | count)
+    if count < 0x100:
+        return struct.pack('>BB', major_type | 24, count)
+    if count < 0x10000:
+        return struct.pack('>BH', major_type | 25, count)
+    if count < 0x100000000:
+        return struct.pack('>BI', major_type | 26, count)
+    return struct.pack('>BQ', major_type | 27, count)
+
+
+JSON = JsonFormat()
+MESSAGEPACK = MessagePackFormat()
+CBOR = CborFormat()
+
+FORMATS = (JSON, MESSAGEPACK, CBOR)
+
+# Every known mimetype, JSON's first so it wins ties.
+MIMETYPES = [mimetype for data_format in FORMATS
+             for mimetype in data_format.mimetypes]
+BY_MIMETYPE = dict((mimetype, data_format) for data_format in FORMATS
+                   for mimetype in data_format.mimetypes)
@@ -1,10 +1,19 @@
 #!/usr/bin/python
 
-from collections import OrderedDict
 from bloggerengine import base_model
+from bloggerengine import storage
 
 
 class Label(base_model.BaseModel):
+    persisted_fields = ('label', 'storage_key')
+    relation_fields = ('blogposts',)
+    json_fields = {
+        'label': lambda label: label.label,
+        'id': lambda label: label.storage_key,
+        'created_timestamp': lambda label: label.created_timestamp,
+        'blogposts': lambda label: [blogpost.id
+                                    for blogpost in label.GetBlogposts()]
+    }
 
     def __init__(self, label_text):
         """Constructor.
@@ -16,7 +25,7 @@ class Label(base_model.BaseModel):
         super(Label, self).__init__()
         self.label = label_text.lower()
         self.storage_key = self.label
-        self.blogposts = OrderedDict()
+        self.blogposts = storage.VersionedCollection()
 
     def AddToBlogpost(self, blogpost):
         """Adds this label to a given blogpost.
@@ -27,6 +36,7 @@ class Label(base_model.BaseModel):
         """
         if blogpost.id not in self.blogposts:
             self.blogposts[blogpost.id] = blogpost
+            self.RecordLink_('blogposts', blogpost.id, blogpost)
             blogpost.AddLabel(self)
 
     def RemoveFromBlogpost(self, blogpost):
@@ -38,6 +48,7 @@ class Label(base_model.BaseModel):
         """
         if blogpost.id in self.blogposts:
             del self.blogposts[blogpost.id]
+            self.RecordUnlink_('blogposts', blogpost.id)
             blogpost.RemoveLabel(self)
 
     def GetBlogposts(self):
@@ -48,17 +59,3 @@ class Label(base_model.BaseModel):
 
         """
         return list(self.blogposts.values())
-
-    def ToJson(self):
-        """Converts this object into a dictionary suitable for serialization.
-
-        Returns:
-          A dictionary.
-
-        """
-        return {
-            'label': self.label,
-            'id': self.storage_key,
-            'created_timestamp': str(self.created_timestamp),
-            'blogposts': [blogpost.id for blogpost in self.GetBlogposts()]
-        }
@@ -0,0 +1,163 @@
+#!/usr/bin/python
+
+import contextlib
+import functools
+import threading
+
+try:
+    from thread import get_ident
+except ImportError:
+    from threading import get_ident
+
+
+class ReaderWriterLock(object):
+
+    """A lock that is shared by readers and exclusive to a writer.
+
+    Both modes are reentrant for the thread holding them, and a writer may
+    also take the read lock. Upgrading a read lock to a write lock would
+    deadlock two upgrading readers, so it raises instead. Waiting writers
+    keep new readers out, so a steady stream of readers cannot starve them.
+
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = {}
+        self.writer = None
+        self.write_count = 0
+        self.waiting_writers = 0
+
+    def AcquireRead(self):
+        me = get_ident()
+        with self.condition:
+            if self.writer == me or me in self.readers:
+                self.readers[me] = self.readers.get(me, 0) + 1
+                return
+
+            while self.writer is not None or self.waiting_writers:
+                self.condition.wait()
+            self.readers[me] = 1
+
+    def ReleaseRead(self):
+        me = get_ident()
+        with self.condition:
+            count = self.readers.get(me)
+            if not count:
+                raise RuntimeError('Read lock released but not held')
+
+            if count == 1:
+                del self.readers[me]
+                if not self.readers:
+                    self.condition.notify_all()
+            else:
+                self.readers[me] = count - 1
+
+    def AcquireWrite(self):
+        me = get_ident()
+        with self.condition:
+            if self.writer == me:
+                self.write_count += 1
+                return
+            if me in self.readers:
+                raise RuntimeError(
+                    'Cannot upgrade a read lock to a write lock')
+
+            self.waiting_writers += 1
+            try:
+                while self.writer is not None or self.readers:
+                    self.condition.wait()
+            finally:
+                self.waiting_writers -= 1
+            self.writer = me
+            self.write_count = 1
+
+    def ReleaseWrite(self):
+        with self.condition:
+            if self.writer != get_ident():
+                raise RuntimeError('Write lock released but not held')
+
+            self.write_count -= 1
+            if not self.write_count:
+                self.writer = None
+                self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def Reading(self):
+        self.AcquireRead()
+        try:
+            yield
+        finally:
+            self.ReleaseRead()
+
+    @contextlib.contextmanager
+    def Writing(self):
+        self.AcquireWrite()
+        try:
+            yield
+        finally:
+            self.ReleaseWrite()
+
+
+class LockManager(object):
+
+    def __init__(self, kinds):
+        """Keeps a ReaderWriterLock per model kind.
+
+        Locks are always taken in sorted kind order, so operations that lock
+        several kinds cannot deadlock each other. Nested operations should
+        only lock kinds their caller already holds.
+
+        Args:
+          kinds: iterable; The model kind names.
+
+        """
+        self.locks = dict((kind, ReaderWriterLock()) for kind in kinds)
+
+    @contextlib.contextmanager
+    def Locking(self, reads=(), writes=()):
+        """Holds read locks on some kinds and write locks on others.
+
+        Args:
+          reads: iterable; The kinds to lock for reading.
+          writes: iterable; The kinds to lock for writing, which need not be
+            repeated in reads.
+
+        """
+        writes = set(writes)
+        held = []
+        try:
+            for kind in sorted(set(reads) | writes):
+                lock = self.locks[kind]
+                if kind in writes:
+                    lock.AcquireWrite()
+                    held.append(lock.ReleaseWrite)
+                else:
+                    lock.AcquireRead()
+                    held.append(lock.ReleaseRead)
+            yield
+        finally:
+            for release in reversed(held):
+                release()
+
+
+def Reads(*kinds):
+    """Decorates a BloggerEngine method to hold read locks on kinds."""
+    def Decorator(method):
+        @functools.wraps(method)
+        def Wrapper(self, *args, **kwargs):
+            with self.locks.Locking(reads=kinds):
+                return method(self, *args, **kwargs)
+        return Wrapper
+    return Decorator
+
+
+def Writes(*kinds):
+    """Decorates a BloggerEngine method to hold write locks on kinds."""
+    def Decorator(method):
+        @functools.wraps(method)
+        def Wrapper(self, *args, **kwargs):
+            with self.locks.Locking(writes=kinds):
+                return method(self, *args, **kwargs)
+        return Wrapper
+    return Decorator
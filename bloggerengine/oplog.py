@@ -0,0 +1,440 @@
+#!/usr/bin/python
+
+import contextlib
+import gc
+import json
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+from bloggerengine import snapshot
+from bloggerengine import storage
+
+# fsync after every record; nothing acknowledged is ever lost.
+DURABILITY_ALWAYS = 'always'
+# fsync at most once every group_commit_ms; a crash loses at most that window.
+DURABILITY_GROUP = 'group'
+# Hand records to the OS without fsync; survives process but not OS crashes.
+DURABILITY_OS = 'os'
+
+DURABILITY_MODES = (DURABILITY_ALWAYS, DURABILITY_GROUP, DURABILITY_OS)
+
+DEFAULT_GROUP_COMMIT_MS = 10
+
+MAGIC = b'BEOPLOG1'
+
+# Magic bytes followed by the log generation, a random number identifying
+# this log file so snapshots of other logs are never applied to it.
+FILE_HEADER = struct.Struct('>8sQ')
+
+# Payload length followed by the CRC32 of the payload.
+RECORD_HEADER = struct.Struct('>II')
+
+
+class OperationLog(object):
+
+    def __init__(self, path, durability=DURABILITY_ALWAYS,
+                 group_commit_ms=DEFAULT_GROUP_COMMIT_MS):
+        """Constructor.
+
+        Opens the log at path, creating it if necessary. A torn record at the
+        end of the log, e.g. from a crash mid-write, is truncated away.
+
+        Args:
+          path: string; The path of the log file.
+          durability: string; One of DURABILITY_MODES.
+          group_commit_ms: int; The fsync interval for DURABILITY_GROUP.
+
+        """
+        if durability not in DURABILITY_MODES:
+            raise ValueError('Unknown durability mode: %s' % durability)
+
+        self.path = path
+        self.durability = durability
+        self.group_commit_ms = group_commit_ms
+        self.lock = threading.Lock()
+        self.records_written = 0
+        self.dirty = False
+        self.closed = False
+        self.last_sync = time.time()
+        self.generation = None
+        self.log_file = self.Open_()
+
+        self.sync_thread = None
+        if durability == DURABILITY_GROUP:
+            self.sync_thread = threading.Thread(target=self.GroupCommitLoop_)
+            self.sync_thread.daemon = True
+            self.sync_thread.start()
+
+    def Open_(self):
+        """Opens the log file for appending, writing a header if it is new.
+
+        Returns:
+          A file object positioned at the end of the last valid record.
+
+        """
+        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+            with open(self.path, 'wb') as log_file:
+                log_file.write(FILE_HEADER.pack(MAGIC, NewGeneration()))
+                log_file.flush()
+                os.fsync(log_file.fileno())
+
+        with open(self.path, 'rb') as log_file:
+            self.generation = self.ReadHeader_(log_file)
+
+        valid_end = FILE_HEADER.size
+        for valid_end, unused_payload in self.ReadPayloads_():
+            pass
+
+        if os.path.getsize(self.path) > valid_end:
+            with open(self.path, 'r+b') as log_file:
+                log_file.truncate(valid_end)
+
+        return open(self.path, 'ab')
+
+    def ReadHeader_(self, log_file):
+        """Reads and validates the file header.
+
+        Args:
+          log_file: file; A log file positioned at the start.
+
+        Returns:
+          The log generation.
+
+        """
+        header = log_file.read(FILE_HEADER.size)
+        if len(header) != FILE_HEADER.size:
+            raise ValueError('Truncated operation log header: %s' % self.path)
+
+        magic, generation = FILE_HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError('Not an operation log: %s' % self.path)
+        return generation
+
+    def Append(self, record):
+        """Appends a record to the log, honoring the durability mode.
+
+        Args:
+          record: dict; A JSON serializable record.
+
+        """
+        self.Write_(EncodeRecord(record), 1)
+
+    def AppendBatch(self, records):
+        """Appends several records at once, as a single 'batch' record.
+
+        The batch is written, synced and, after a crash, recovered or lost
+        as a whole.
+
+        Args:
+          records: list; JSON serializable records.
+
+        """
+        self.Write_(EncodeRecord({'op': 'batch', 'records': records}),
+                    len(records))
+
+    def Write_(self, frame, count):
+        """Writes a framed record, honoring the durability mode.
+
+        Args:
+          frame: bytes; The encoded record.
+          count: int; How many mutations it records.
+
+        """
+        with self.lock:
+            self.log_file.write(frame)
+            self.records_written += count
+
+            if self.durability == DURABILITY_ALWAYS:
+                self.Sync_()
+            elif self.durability == DURABILITY_OS:
+                self.log_file.flush()
+            else:
+                self.dirty = True
+                elapsed_ms = (time.time() - self.last_sync) * 1000
+                if elapsed_ms >= self.group_commit_ms:
+                    self.Sync_()
+
+    def Sync_(self):
+        """Flushes and fsyncs the log. The lock must be held."""
+        self.log_file.flush()
+        os.fsync(self.log_file.fileno())
+        self.dirty = False
+        self.last_sync = time.time()
+
+    def GroupCommitLoop_(self):
+        """Periodically fsyncs pending records in DURABILITY_GROUP mode."""
+        while not self.closed:
+            time.sleep(self.group_commit_ms / 1000.0)
+            with self.lock:
+                if self.dirty and not self.closed:
+                    self.Sync_()
+
+    def Flush(self):
+        """Forces all appended records to disk."""
+        with self.lock:
+            self.Sync_()
+
+    def Tell(self):
+        """Gets the current end of the log.
+
+        Returns:
+          The byte offset just past the last appended record.
+
+        """
+        with self.lock:
+            self.log_file.flush()
+            return self.log_file.tell()
+
+    def Close(self):
+        """Flushes and closes the log."""
+        with self.lock:
+            if self.closed:
+                return
+            self.Sync_()
+            self.closed = True
+            self.log_file.close()
+
+    def Compact(self, model_classes, reading=None):
+        """Rewrites the log down to the records needed for the live data.
+
+        The live object graph is written to a new log, holding the read
+        locks reading() gives so it stays still, while the log itself stays
+        open for appends. The records appended meanwhile are then copied
+        over and the new log atomically renamed into place under the lock.
+        Records are idempotent, so any overlap between the two is harmless.
+
+        The compacted log gets a new generation, so snapshots of the old log
+        are no longer applied to it.
+
+        Args:
+          model_classes: dict; Maps model class names to model classes.
+          reading: callable; Gets a context manager holding read locks on
+            every kind, e.g. BloggerEngine.Reading. None if the caller keeps
+            the graph still itself.
+
+        Returns:
+          A (bytes before, bytes after) tuple.
+
+        """
+        temporary_path = self.path + '.compact'
+
+        with open(temporary_path, 'wb') as compacted_file:
+            compacted_file.write(FILE_HEADER.pack(MAGIC, NewGeneration()))
+            with (reading or NotLocking_)():
+                start = self.Tell()
+                for record in CompactRecords(model_classes):
+                    compacted_file.write(EncodeRecord(record))
+
+            with self.lock:
+                self.log_file.flush()
+                size_before = self.log_file.tell()
+                with open(self.path, 'rb') as log_file:
+                    log_file.seek(start)
+                    tail = log_file.read(size_before - start)
+                compacted_file.write(tail)
+                compacted_file.flush()
+                os.fsync(compacted_file.fileno())
+
+                os.rename(temporary_path, self.path)
+                self.log_file.close()
+                self.log_file = open(self.path, 'ab')
+                self.dirty = False
+                with open(self.path, 'rb') as log_file:
+                    self.generation = self.ReadHeader_(log_file)
+                size_after = self.log_file.tell()
+
+        return size_before, size_after
+
+    def ReadRecords(self, start=None):
+        """Reads records from the log.
+
+        Reading stops at the first truncated or corrupt record.
+
+        Args:
+          start: int; The byte offset to start reading from, defaults to the
+            first record.
+
+        Yields:
+          Each record, as a dictionary.
+
+        """
+        for unused_offset, payload in self.ReadPayloads_(start):
+            yield json.loads(payload.decode('utf-8'))
+
+    def ReadPayloads_(self, start=None):
+        """Reads the raw payload of each valid record in the log.
+
+        Args:
+          start: int; The byte offset to start reading from.
+
+        Yields:
+          (offset, payload) tuples, where offset is just past the record.
+
+        """
+        with open(self.path, 'rb') as log_file:
+            log_file.seek(start or FILE_HEADER.size)
+            offset = log_file.tell()
+            while True:
+                header = log_file.read(RECORD_HEADER.size)
+                if len(header) != RECORD_HEADER.size:
+                    return
+
+                length, checksum = RECORD_HEADER.unpack(header)
+                payload = log_file.read(length)
+                if len(payload) != length:
+                    return
+                if zlib.crc32(payload) & 0xffffffff != checksum:
+                    return
+
+                offset += RECORD_HEADER.size + length
+                yield offset, payload
+
+    def Replay(self, model_classes, start=None, registry=None):
+        """Rebuilds the object graph by applying every record in the log.
+
+        Args:
+          model_classes: dict; Maps model class names to model classes.
+          start: int; The byte offset to start replaying from.
+          registry: dict; Objects already restored, keyed by (kind, id).
+
+        Returns:
+          The registry of every object seen, keyed by (kind, id).
+
+        """
+        if registry is None:
+            registry = {}
+
+        # As with snapshot loading, the cyclic collector would only rescan
+        # the ever-growing set of restored objects.
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for record in self.ReadRecords(start):
+                ApplyRecord(record, model_classes, registry)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+        return registry
+
+
+def EncodeRecord(record):
+    """Encodes and frames a record.
+
+    Args:
+      record: dict; A JSON serializable record.
+
+    Returns:
+      The length and checksum header followed by the JSON payload, as bytes.
+
+    """
+    payload = json.dumps(record, separators=(',', ':'),
+                         sort_keys=True).encode('utf-8')
+    return RECORD_HEADER.pack(len(payload),
+                              zlib.crc32(payload) & 0xffffffff) + payload
+
+
+@contextlib.contextmanager
+def NotLocking_():
+    """Stands in for a reading() context manager when none is given."""
+    yield
+
+
+def CompactRecords(model_classes):
+    """Generates the minimal records that rebuild the live object graph.
+
+    Stored objects get a 'put', in datastore order. Objects only reachable
+    through relationships, like removed blogposts, get a 'define', which
+    restores them without storing them. Relationship dicts are then rebuilt
+    in order with 'link' records.
+
+    Args:
+      model_classes: dict; Maps model class names to model classes.
+
+    Yields:
+      Records, as dictionaries.
+
+    """
+    collected = snapshot.CollectObjects(model_classes)
+    for kind, (objects, stored_count) in collected.items():
+        for position, instance in enumerate(objects):
+            yield {
+                'op': 'put' if position < stored_count else 'define',
+                'kind': kind,
+                'id': instance.id,
+                'state': instance.GetState_()
+            }
+
+    for kind, (objects, unused_stored_count) in collected.items():
+        for instance in objects:
+            for field in instance.relation_fields:
+                for key, target in getattr(instance, field).items():
+                    yield {
+                        'op': 'link',
+                        'kind': kind,
+                        'id': instance.id,
+                        'field': field,
+                        'key': key,
+                        'target': [target.__class__.__name__, target.id]
+                    }
+
+
+def NewGeneration():
+    """Picks a new, random log generation."""
+    return random.SystemRandom().getrandbits(63)
+
+
+def ApplyRecord(record, model_classes, registry):
+    """Applies a single log record to the in-memory object graph.
+
+    Relationship dicts are modified directly rather than through the model
+    methods, since each side of a relationship is logged separately.
+
+    Args:
+      record: dict; The record to apply.
+      model_classes: dict; Maps model class names to model classes.
+      registry: dict; Objects restored so far, keyed by (kind, id).
+
+    """
+    def Resolve(kind, model_id):
+        key = (kind, model_id)
+        if key not in registry:
+            registry[key] = model_classes[kind].CreateEmpty_(model_id)
+        return registry[key]
+
+    operation = record['op']
+    if operation == 'batch':
+        for batched_record in record['records']:
+            ApplyRecord(batched_record, model_classes, registry)
+        return
+
+    model_class = model_classes[record['kind']]
+    instances = model_class.instances.setdefault(
+        model_class.__name__, storage.VersionedCollection())
+    instance = Resolve(record['kind'], record['id'])
+
+    if operation == 'put':
+        if (hasattr(instance, 'created_timestamp') and
+                instances.get(instance.GetStorageKey_()) is not instance):
+            # A deleted object whose id has since been reused.
+            instance = model_class.CreateEmpty_(record['id'])
+            registry[(record['kind'], record['id'])] = instance
+        instance.SetState_(record['state'], Resolve)
+        instances[instance.GetStorageKey_()] = instance
+    elif operation == 'define':
+        instance.SetState_(record['state'], Resolve)
+    elif operation == 'delete':
+        if instances.get(instance.GetStorageKey_()) is instance:
+            del instances[instance.GetStorageKey_()]
+    elif operation == 'link':
+        getattr(instance, record['field'])[record['key']] = Resolve(
+            *record['target'])
+        instance.Changed_()
+    elif operation == 'unlink':
+        getattr(instance, record['field']).pop(record['key'], None)
+        instance.Changed_()
+    else:
+        raise ValueError('Unknown operation: %s' % operation)
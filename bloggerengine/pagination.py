@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+import base64
+import binascii
+import re
+
+from bloggerengine import storage
+
+CURSOR_PATTERN = re.compile(r'^[A-Za-z0-9_-]*$')
+
+# The largest page the server hands out, whatever limit is asked for.
+MAX_PAGE_SIZE = 1000
+
+
+class Page(list):
+
+    """A list of results, with the cursor of the page after it.
+
+    Attributes:
+      next_cursor: string; Pass it back to get the next page, None if this
+        is the last one.
+
+    """
+
+    def __init__(self, results, next_cursor=None):
+        super(Page, self).__init__(results)
+        self.next_cursor = next_cursor
+
+
+def EncodeCursor(storage_key):
+    """Encodes the storage key a page ended at into an opaque cursor."""
+    return base64.urlsafe_b64encode(
+        storage_key.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def DecodeCursor(cursor):
+    """Decodes a cursor made by EncodeCursor.
+
+    Raises:
+      ValueError: If the cursor is not valid.
+
+    """
+    try:
+        if not CURSOR_PATTERN.match(cursor):
+            raise ValueError('Invalid cursor: %r' % (cursor,))
+        padding = '=' * (-len(cursor) % 4)
+        return base64.urlsafe_b64decode(
+            (cursor + padding).encode('ascii')).decode('utf-8')
+    except (AttributeError, TypeError, UnicodeError, binascii.Error):
+        raise ValueError('Invalid cursor: %r' % (cursor,))
+
+
+def Paginate(collection, limit, cursor=None):
+    """Gets a page of a collection, ordered by storage key.
+
+    The page is read from an immutable snapshot, and cursors hold the last
+    storage key rather than an offset, so pages neither skip nor repeat
+    results when other requests write in between. A page of a
+    VersionedCollection or CollectionSnapshot is read by seeking straight
+    to the cursor. Any other mapping is copied into a snapshot first, which
+    costs O(collection).
+
+    For blogposts and comments, storage key order is creation order.
+
+    Args:
+      collection: VersionedCollection, CollectionSnapshot or any other
+        mapping of storage keys to instances.
+      limit: int; The most results to return, at least 1. None for all of
+        them.
+      cursor: string; The next_cursor of the previous page, if any.
+
+    Returns:
+      A Page.
+
+    Raises:
+      ValueError: If the limit or the cursor is not valid.
+
+    """
+    if limit is not None and limit < 1:
+        raise ValueError('Invalid limit: %r' % (limit,))
+
+    if isinstance(collection, storage.VersionedCollection):
+        collection = collection.Snapshot()
+    elif not isinstance(collection, storage.CollectionSnapshot):
+        collection = storage.CollectionSnapshot.FromItems(
+            list(collection.items()))
+
+    start = None if cursor is None else DecodeCursor(cursor)
+    results = []
+    last_key = None
+    for storage_key, sequence in collection.by_key.Items(start):
+        if storage_key == start:
+            continue
+        if len(results) == limit:
+            return Page(results, EncodeCursor(last_key))
+        results.append(collection.by_sequence.Get(sequence))
+        last_key = storage_key
+    return Page(results)
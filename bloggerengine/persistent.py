@@ -0,0 +1,269 @@
+#!/usr/bin/python
+
+import bisect
+
+# Most keys a node holds before it is split.
+MAX_NODE_SIZE = 64
+# How full nodes are when built from sorted items.
+BUILD_NODE_SIZE = 48
+
+
+class Node(object):
+
+    """A node of a PersistentMap.
+
+    Leaves hold sorted keys and their values. Internal nodes hold their
+    children and the first key of each child. Nodes are never modified once
+    they are part of a map.
+
+    """
+
+    __slots__ = ('keys', 'values', 'children', 'size')
+
+    def __init__(self, keys, values=None, children=None, size=None):
+        self.keys = keys
+        self.values = values
+        self.children = children
+        self.size = len(keys) if size is None else size
+
+
+class PersistentMap(object):
+
+    """An immutable sorted map with structural sharing.
+
+    Insert() and Remove() return a new map that shares all but the nodes on
+    the path to the changed key with the old one, so old versions stay valid
+    and cheap to keep. It is a B+ tree with wide nodes, so lookups and
+    updates only touch a few nodes and iterating copies whole leaves.
+
+    """
+
+    __slots__ = ('root',)
+
+    def __init__(self, root=None):
+        self.root = root
+
+    @classmethod
+    def FromSortedItems(cls, keys, values):
+        """Builds a map in linear time.
+
+        Args:
+          keys: list; The keys, sorted and unique.
+          values: list; The value of each key.
+
+        Returns:
+          A PersistentMap.
+
+        """
+        if not keys:
+            return cls()
+
+        nodes = [Node(tuple(keys[start:start + BUILD_NODE_SIZE]),
+                      tuple(values[start:start + BUILD_NODE_SIZE]))
+                 for start in range(0, len(keys), BUILD_NODE_SIZE)]
+        while len(nodes) > 1:
+            nodes = [MakeInternal(nodes[start:start + BUILD_NODE_SIZE])
+                     for start in range(0, len(nodes), BUILD_NODE_SIZE)]
+        return cls(nodes[0])
+
+    def __len__(self):
+        return 0 if self.root is None else self.root.size
+
+    def __contains__(self, key):
+        return self.Get(key, Missing) is not Missing
+
+    def __iter__(self):
+        for leaf in self.Leaves_():
+            for key in leaf.keys:
+                yield key
+
+    def Get(self, key, default=None):
+        """Gets the value of a key, or default if it is not in the map."""
+        node = self.root
+        if node is None:
+            return default
+
+        while node.children is not None:
+            node = node.children[max(bisect.bisect_right(node.keys, key) - 1,
+                                     0)]
+        index = bisect.bisect_left(node.keys, key)
+        if index < len(node.keys) and node.keys[index] == key:
+            return node.values[index]
+        return default
+
+    def Insert(self, key, value):
+        """Gets a map with key set to value."""
+        if self.root is None:
+            return PersistentMap(Node((key,), (value,)))
+
+        nodes = InsertInto(self.root, key, value)
+        if len(nodes) == 1:
+            return PersistentMap(nodes[0])
+        return PersistentMap(MakeInternal(nodes))
+
+    def Remove(self, key):
+        """Gets a map without key. Missing keys are ignored."""
+        if self.root is None:
+            return self
+
+        root = RemoveFrom(self.root, key)
+        while (root is not None and root.children is not None and
+               len(root.children) == 1):
+            root = root.children[0]
+        return PersistentMap(root)
+
+    def Values(self):
+        """Gets all values, ordered by key.
+
+        Returns:
+          A list.
+
+        """
+        values = []
+        for leaf in self.Leaves_():
+            values.extend(leaf.values)
+        return values
+
+    def IterValues(self):
+        """Iterates over the values in key order, without copying them."""
+        for leaf in self.Leaves_():
+            for value in leaf.values:
+                yield value
+
+    def Items(self, start=None):
+        """Iterates over (key, value) pairs in key order.
+
+        Args:
+          start: The first key to include. Starts at the smallest if None.
+
+        """
+        node = self.root
+        if node is None:
+            return
+
+        # Seek down to the leaf holding start, remembering the way back up.
+        stack = []
+        while node.children is not None:
+            index = 0
+            if start is not None:
+                index = max(bisect.bisect_right(node.keys, start) - 1, 0)
+            stack.append((node, index))
+            node = node.children[index]
+
+        index = 0
+        if start is not None:
+            index = bisect.bisect_left(node.keys, start)
+        while True:
+            for position in range(index, len(node.keys)):
+                yield node.keys[position], node.values[position]
+
+            # Climb to the next child to the right, then down its left edge.
+            while stack and stack[-1][1] + 1 >= len(stack[-1][0].children):
+                stack.pop()
+            if not stack:
+                return
+            parent, child_index = stack.pop()
+            stack.append((parent, child_index + 1))
+            node = parent.children[child_index + 1]
+            while node.children is not None:
+                stack.append((node, 0))
+                node = node.children[0]
+            index = 0
+
+    def Leaves_(self):
+        """Yields the leaves in key order."""
+        if self.root is None:
+            return
+
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.children is None:
+                yield node
+            else:
+                stack.extend(reversed(node.children))
+
+
+# Marks a missing key, since None is a valid value.
+Missing = object()
+
+
+def MakeInternal(children):
+    """Builds an internal node over a list of children."""
+    return Node(tuple(child.keys[0] for child in children),
+                children=tuple(children),
+                size=sum(child.size for child in children))
+
+
+def SplitIfFull(node):
+    """Splits a node in two if it has grown too large.
+
+    Returns:
+      A tuple of one or two nodes.
+
+    """
+    if len(node.keys) <= MAX_NODE_SIZE:
+        return (node,)
+
+    middle = len(node.keys) // 2
+    if node.children is None:
+        return (Node(node.keys[:middle], node.values[:middle]),
+                Node(node.keys[middle:], node.values[middle:]))
+    return (MakeInternal(node.children[:middle]),
+            MakeInternal(node.children[middle:]))
+
+
+def InsertInto(node, key, value):
+    """Inserts into the subtree under node, copying the path to the key.
+
+    Returns:
+      A tuple of the one or two nodes that replace node.
+
+    """
+    keys = node.keys
+    if node.children is None:
+        index = bisect.bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            return (Node(keys, node.values[:index] + (value,) +
+                         node.values[index + 1:]),)
+        return SplitIfFull(Node(keys[:index] + (key,) + keys[index:],
+                                node.values[:index] + (value,) +
+                                node.values[index:]))
+
+    index = max(bisect.bisect_right(keys, key) - 1, 0)
+    children = (node.children[:index] +
+                InsertInto(node.children[index], key, value) +
+                node.children[index + 1:])
+    return SplitIfFull(MakeInternal(children))
+
+
+def RemoveFrom(node, key):
+    """Removes from the subtree under node, copying the path to the key.
+
+    Nodes are not merged when they shrink; empty ones are dropped.
+
+    Returns:
+      The node that replaces node, or None if it is now empty.
+
+    """
+    keys = node.keys
+    if node.children is None:
+        index = bisect.bisect_left(keys, key)
+        if index == len(keys) or keys[index] != key:
+            return node
+        if len(keys) == 1:
+            return None
+        return Node(keys[:index] + keys[index + 1:],
+                    node.values[:index] + node.values[index + 1:])
+
+    index = max(bisect.bisect_right(keys, key) - 1, 0)
+    child = RemoveFrom(node.children[index], key)
+    if child is node.children[index]:
+        return node
+
+    children = node.children[:index] + node.children[index + 1:]
+    if child is not None:
+        children = node.children[:index] + (child,) + node.children[index + 1:]
+    if not children:
+        return None
+    return MakeInternal(children)
@@ -0,0 +1,150 @@
+#!/usr/bin/python
+
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# A rough count of the bytes an entry takes besides its value, for the
+# entry itself and its tags.
+ENTRY_OVERHEAD = 256
+TAG_OVERHEAD = 96
+
+
+class ResponseCache(object):
+
+    """A least recently used cache of responses, invalidated by tags.
+
+    Each entry is tagged with the keys of whatever it was built from, and
+    Invalidate() evicts every entry holding one of the given tags. Entries
+    are also evicted, least recently used first, to keep the bytes they
+    take under max_bytes.
+
+    A response built while another thread invalidates entries may be
+    stale, so Put() only stores it if nothing was invalidated since the
+    generation its builder got from Get().
+
+    Attributes:
+      max_bytes: int; The most bytes entries may take. 0 disables the
+        cache.
+      hits: int; How many lookups found an entry.
+      misses: int; How many lookups found none.
+      evictions: int; How many entries were evicted to stay under
+        max_bytes.
+      invalidations: int; How many entries were evicted by Invalidate().
+
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.tags = {}
+        self.size = 0
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def Get(self, key):
+        """Looks up an entry.
+
+        Args:
+          key: hashable; The key the entry was stored under.
+
+        Returns:
+          A (value, generation) tuple. The value is None if there is no
+          entry; the generation is passed back to Put() to store one.
+
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, self.generation
+            # Reinserted as most recently used; Python 2's OrderedDict has
+            # no move_to_end().
+            self.entries[key] = self.entries.pop(key)
+            self.hits += 1
+            return entry[0], self.generation
+
+    def Put(self, key, value, size, tags, generation):
+        """Stores an entry, unless entries were invalidated since Get().
+
+        Args:
+          key: hashable; The key to store the entry under.
+          value: object; The entry.
+          size: int; The bytes the value takes.
+          tags: iterable; The tags to invalidate the entry by.
+          generation: int; The generation Get() returned for the key.
+
+        Returns:
+          True if the entry was stored.
+
+        """
+        tags = frozenset(tags)
+        size += ENTRY_OVERHEAD + TAG_OVERHEAD * len(tags)
+        if size > self.max_bytes:
+            return False
+
+        with self.lock:
+            if generation != self.generation:
+                return False
+            if key in self.entries:
+                self.Remove_(key)
+            self.entries[key] = (value, size, tags)
+            self.size += size
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+            while self.size > self.max_bytes:
+                self.Remove_(next(iter(self.entries)))
+                self.evictions += 1
+            return True
+
+    def Invalidate(self, tags):
+        """Evicts every entry tagged with any of the tags.
+
+        Args:
+          tags: iterable; The tags whose entries are out of date.
+
+        """
+        with self.lock:
+            self.generation += 1
+            for tag in tags:
+                for key in list(self.tags.get(tag, ())):
+                    self.Remove_(key)
+                    self.invalidations += 1
+
+    def Clear(self):
+        """Evicts every entry."""
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.tags.clear()
+            self.size = 0
+
+    def GetStats(self):
+        """Gets the cache's counters, hit rate, entries and size."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+            }
+
+    def Remove_(self, key):
+        """Removes an entry and its tags. Must hold the lock."""
+        unused_value, size, tags = self.entries.pop(key)
+        self.size -= size
+        for tag in tags:
+            keys = self.tags[tag]
+            keys.discard(key)
+            if not keys:
+                del self.tags[tag]
@@ -1,12 +1,928 @@
 #!/usr/bin/python
 
+import functools
+import hashlib
+import os
+
+from bloggerengine import base_model
+from bloggerengine import bgsave
+from bloggerengine import compression
 from bloggerengine import engine
-from flask import Flask, abort, json, jsonify, request
+from bloggerengine import formats
+from bloggerengine import oplog
+from bloggerengine import pagination
+from bloggerengine import response_cache as response_cache_module
+from bloggerengine import single_flight as single_flight_module
+from flask import Flask, Response, abort, g, jsonify, request
+from werkzeug.exceptions import HTTPException
 
 app = Flask('BloggerEngine')
 
 blogger_engine = engine.BloggerEngine()
 
+# Set BLOGGERENGINE_OPLOG to persist the datastore across restarts.
+OPLOG_PATH = os.environ.get('BLOGGERENGINE_OPLOG')
+OPLOG_DURABILITY = os.environ.get('BLOGGERENGINE_OPLOG_DURABILITY',
+                                  oplog.DURABILITY_ALWAYS)
+OPLOG_GROUP_COMMIT_MS = int(os.environ.get(
+    'BLOGGERENGINE_OPLOG_GROUP_COMMIT_MS', oplog.DEFAULT_GROUP_COMMIT_MS))
+SNAPSHOT_PATH = os.environ.get('BLOGGERENGINE_SNAPSHOT')
+SNAPSHOT_INTERVAL_SECONDS = os.environ.get(
+    'BLOGGERENGINE_SNAPSHOT_INTERVAL_SECONDS')
+SNAPSHOT_MUTATIONS = os.environ.get('BLOGGERENGINE_SNAPSHOT_MUTATIONS')
+# Set BLOGGERENGINE_SQLITE to keep the datastore in SQLite instead.
+SQLITE_PATH = os.environ.get('BLOGGERENGINE_SQLITE')
+# Give each server process sharing a datastore its own
+# BLOGGERENGINE_NODE_ID, so that they never generate the same id.
+NODE_ID = int(os.environ.get('BLOGGERENGINE_NODE_ID', 0))
+
+# Responses of at least BLOGGERENGINE_COMPRESSION_MIN_BYTES are compressed
+# at BLOGGERENGINE_COMPRESSION_LEVEL for clients accepting gzip or deflate,
+# keeping up to BLOGGERENGINE_COMPRESSION_CACHE_BYTES of compressed
+# payloads to reuse; 0 disables the cache.
+COMPRESSION_MIN_BYTES = int(os.environ.get(
+    'BLOGGERENGINE_COMPRESSION_MIN_BYTES', compression.DEFAULT_MIN_BYTES))
+COMPRESSION_LEVEL = int(os.environ.get(
+    'BLOGGERENGINE_COMPRESSION_LEVEL', compression.DEFAULT_LEVEL))
+COMPRESSION_CACHE_BYTES = int(os.environ.get(
+    'BLOGGERENGINE_COMPRESSION_CACHE_BYTES',
+    compression.DEFAULT_CACHE_BYTES))
+
+# Up to BLOGGERENGINE_RESPONSE_CACHE_BYTES of read route responses are
+# kept until a model they depend on changes; 0 disables the cache.
+RESPONSE_CACHE_BYTES = int(os.environ.get(
+    'BLOGGERENGINE_RESPONSE_CACHE_BYTES',
+    response_cache_module.DEFAULT_MAX_BYTES))
+
+# A /batch request may hold at most BLOGGERENGINE_BATCH_MAX_OPERATIONS
+# operations, since the engine is locked while they run.
+BATCH_MAX_OPERATIONS = int(os.environ.get(
+    'BLOGGERENGINE_BATCH_MAX_OPERATIONS', 1000))
+
+base_model.BaseModel.id_generator = base_model.IdGenerator(NODE_ID)
+
+compression_cache = compression.CompressionCache(COMPRESSION_LEVEL,
+                                                 COMPRESSION_CACHE_BYTES)
+
+# Streamed responses are sent in chunks of about this many bytes.
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_MIMETYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+# The kinds whose changes can alter the serialized form of each kind's
+# models, which embed the models they reference.
+SERIALIZED_KINDS = {
+    'Author': ('Author',),
+    'Blogpost': ('Author', 'Blogpost'),
+    'Comment': ('Author', 'Blogpost', 'Comment'),
+    'Label': ('Label',),
+}
+
+# The model kind each lookup argument of the read routes names.
+LOOKUP_ARGUMENTS = {
+    'blogpost_id': 'blogpost',
+    'comment_id': 'comment',
+    'label_text': 'label',
+    'username': 'author',
+}
+
+# The model kind each list of lookups of the multi-get routes names.
+MULTI_LOOKUP_ARGUMENTS = {
+    'blogpost_ids': 'blogpost',
+    'comment_ids': 'comment',
+    'label_texts': 'label',
+    'usernames': 'author',
+}
+
+# Mixed into ETags, since collection versions restart with the process.
+ETAG_SALT = os.urandom(8)
+
+# Decoded request strings are unicode on Python 2.
+STRING_TYPES = (str, type(u''))
+
+# How many seconds browsers (BLOGGERENGINE_CACHE_MAX_AGE) and shared caches
+# such as CDNs (BLOGGERENGINE_CACHE_SHARED_MAX_AGE) may reuse GET responses
+# of read routes without revalidating them. Shared caches can be purged by
+# the keys in the Surrogate-Key header instead.
+CACHE_MAX_AGE = int(os.environ.get('BLOGGERENGINE_CACHE_MAX_AGE', 0))
+CACHE_SHARED_MAX_AGE = int(os.environ.get(
+    'BLOGGERENGINE_CACHE_SHARED_MAX_AGE', 60))
+
+background_snapshotter = None
+if SNAPSHOT_PATH:
+    background_snapshotter = bgsave.BackgroundSnapshotter(
+        engine.MODEL_CLASSES, SNAPSHOT_PATH,
+        SNAPSHOT_INTERVAL_SECONDS and int(SNAPSHOT_INTERVAL_SECONDS),
+        SNAPSHOT_MUTATIONS and int(SNAPSHOT_MUTATIONS))
+
+response_cache = response_cache_module.ResponseCache(RESPONSE_CACHE_BYTES)
+single_flight = single_flight_module.SingleFlight()
+
+
+def invalidate_responses(instance):
+    """Evicts the cached responses a changed model may have altered.
+
+    Args:
+      instance: BaseModel; The model that was stored, deleted or changed.
+
+    """
+    kind = instance.__class__.__name__.lower()
+    response_cache.Invalidate(
+        ['%s/%s' % (kind, instance.GetStorageKey_()), kind + 's'])
+
+base_model.BaseModel.change_listeners.append(invalidate_responses)
+
+
+def get_page_arguments(request_arguments):
+    """Reads the optional limit and cursor arguments of list methods.
+
+    Args:
+      request_arguments: dict; The JSON request arguments. The query string
+        is used for GET requests without any.
+
+    Returns:
+      A (limit, cursor) tuple, both None unless a page was asked for. The
+      limit is capped at pagination.MAX_PAGE_SIZE.
+
+    """
+    if request_arguments is None:
+        request_arguments = request.args
+
+    limit = request_arguments.get('limit')
+    cursor = request_arguments.get('cursor')
+    if limit is None and cursor is None:
+        return None, None
+
+    if cursor is not None:
+        try:
+            pagination.DecodeCursor(cursor)
+        except ValueError:
+            abort(400)
+
+    if limit is None:
+        return pagination.MAX_PAGE_SIZE, cursor
+
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        abort(400)
+    if limit < 1:
+        abort(400)
+    return min(limit, pagination.MAX_PAGE_SIZE), cursor
+
+
+def add_next_cursor(response, results):
+    """Adds the next page's cursor to a response, if results is a Page.
+
+    Args:
+      response: dict; The response to send.
+      results: list; The results in the response.
+
+    Returns:
+      The response.
+
+    """
+    if isinstance(results, pagination.Page):
+        response['next_cursor'] = results.next_cursor
+    return response
+
+
+def get_stream_format(request_arguments):
+    """Reads the optional stream argument of get_all methods.
+
+    Clients can also ask for NDJSON with an Accept: application/x-ndjson
+    header. A stream holds every result, so it cannot be paginated, and it
+    is sent as it is encoded, so it cannot be normalized.
+
+    Args:
+      request_arguments: dict; The JSON request arguments. The query string
+        is used for GET requests without any.
+
+    Returns:
+      'json', 'ndjson', or None if the response should not be streamed.
+
+    """
+    if request_arguments is None:
+        request_arguments = request.args
+
+    stream_format = request_arguments.get('stream')
+    if stream_format is None:
+        if (request.accept_mimetypes.best ==
+                STREAM_MIMETYPES['ndjson']):
+            stream_format = 'ndjson'
+        else:
+            return None
+
+    if stream_format not in STREAM_MIMETYPES:
+        abort(400)
+    if (request_arguments.get('limit') is not None or
+            request_arguments.get('cursor') is not None or
+            get_normalized()):
+        abort(400)
+    return stream_format
+
+
+def get_request_body(silent=False):
+    """Decodes the request body, in the format its Content-Type names.
+
+    Bodies in JSON, or with an unknown Content-Type, are read by Flask's
+    get_json(). MessagePack and CBOR bodies are decoded with their
+    timestamps as datetimes.
+
+    Args:
+      silent: bool; Return None rather than abort if the body is not valid.
+
+    Returns:
+      The decoded body.
+
+    """
+    data_format = formats.BY_MIMETYPE.get(request.mimetype)
+    if data_format is None or data_format is formats.JSON:
+        return request.get_json(silent=silent)
+
+    if not data_format.available:
+        abort(415)
+    try:
+        return data_format.Decode(request.get_data())
+    except ValueError:
+        if silent:
+            return None
+        abort(400)
+
+
+def get_response_format():
+    """Picks the format of the response from the Accept header.
+
+    Returns:
+      A formats.Format, JSON unless the client prefers another one. Aborts
+      with 406 if the formats it accepts need libraries that are not
+      installed.
+
+    """
+    accept = request.accept_mimetypes
+    mimetype = accept.best_match(formats.MIMETYPES)
+    if mimetype is None:
+        return formats.JSON
+
+    data_format = formats.BY_MIMETYPE[mimetype]
+    if data_format.available:
+        return data_format
+    mimetype = accept.best_match([
+        mimetype for mimetype in formats.MIMETYPES
+        if formats.BY_MIMETYPE[mimetype].available])
+    if mimetype is None:
+        abort(406)
+    return formats.BY_MIMETYPE[mimetype]
+
+
+def get_read_arguments(**path_arguments):
+    """Gets the arguments of a route that only reads.
+
+    Read routes take their arguments from the request body of POST
+    requests, or from the path and query string of their GET variants,
+    which HTTP caches can store.
+
+    Args:
+      **path_arguments: The arguments in the URL path, None for POST.
+
+    Returns:
+      A dict of the arguments.
+
+    """
+    if request.method != 'GET':
+        return get_request_body()
+
+    request_arguments = request.args.to_dict()
+    request_arguments.update(path_arguments)
+    return request_arguments
+
+
+def get_request_arguments():
+    """Gets the request body arguments, or the query string without any."""
+    request_arguments = get_request_body(silent=True)
+    if not isinstance(request_arguments, dict):
+        return request.args
+    return request_arguments
+
+
+def get_names_argument(name):
+    """Reads an optional list of names, such as the fields argument.
+
+    Args:
+      name: string; The request argument. Its value is a list or, in a
+        query string, a comma separated string.
+
+    Returns:
+      A list of names, or None if the argument is not set.
+
+    """
+    names = get_request_arguments().get(name)
+    if names is None:
+        return None
+
+    try:
+        if not isinstance(names, list):
+            names = names.split(',')
+        if not all(name.strip('.') for name in names):
+            abort(400)
+    except AttributeError:
+        abort(400)
+    return names
+
+
+def get_fields():
+    """Reads the optional fields argument, which every route accepts.
+
+    It lists the fields to include of each model in the response, e.g.
+    ['id', 'headline', 'author.username'] or, in a query string,
+    'id,headline,author.username'.
+
+    Returns:
+      A dict as returned by base_model.ParseFields(), or None to include
+      every field.
+
+    """
+    fields = get_names_argument('fields')
+    if fields is None:
+        return None
+    return base_model.ParseFields(fields)
+
+
+def get_include():
+    """Reads the optional include argument, which every route accepts.
+
+    It lists related models to send along with those in the response, e.g.
+    ['comments', 'labels', 'comments.author'] for a blogpost.
+
+    Returns:
+      A dict mapping each relation to include to a dict of the relations
+      to include from its models, or None if nothing is included.
+
+    """
+    include = get_names_argument('include')
+    if include is None:
+        return None
+
+    tree = {}
+    for path in include:
+        node = tree
+        for field in path.split('.'):
+            if field:
+                node = node.setdefault(field, {})
+    return tree
+
+
+def get_included(instances, include):
+    """Resolves the models an include argument names.
+
+    Args:
+      instances: list; The models in the response.
+      include: dict; As returned by get_include().
+
+    Returns:
+      A list of the related models, each once.
+
+    """
+    seen = set()
+    # Models whose relations were already followed, by include subtree, so
+    # a model shared by many others is only expanded once.
+    expanded = set()
+    included = []
+    pending = [(instance, include) for instance in instances]
+    while pending:
+        instance, include = pending.pop()
+        for field in include:
+            for related in instance.GetRelated(field):
+                key = (related.__class__, related.GetStorageKey_())
+                if key not in seen:
+                    seen.add(key)
+                    included.append(related)
+                subtree = include[field]
+                if subtree and (key, id(subtree)) not in expanded:
+                    expanded.add((key, id(subtree)))
+                    pending.append((related, subtree))
+    return included
+
+
+def get_normalized(default=False):
+    """Reads the optional normalize argument, which every route accepts.
+
+    Args:
+      default: bool; Whether to normalize if the argument is not set.
+
+    Returns:
+      True if models should be given by id, and serialized once each in a
+      top-level entities dictionary.
+
+    """
+    normalize = get_request_arguments().get('normalize', default)
+    if normalize in (True, 'true', '1'):
+        return True
+    if normalize in (False, None, 'false', '0'):
+        return False
+    abort(400)
+
+
+def add_entity(entities, instance, fields):
+    """Adds a model, and the models it references, to a normalized response.
+
+    Args:
+      entities: dict; Maps each model class to a dict of storage keys to
+        (model, fields) pairs.
+      instance: BaseModel; The model to add.
+      fields: dict; The fields to serialize, from get_fields(). Referenced
+        models are only added if their field is.
+
+    Returns:
+      The storage key of the model.
+
+    """
+    storage_key = instance.GetStorageKey_()
+    pending = [(instance, storage_key, fields)]
+    while pending:
+        instance, key, fields = pending.pop()
+        kind_entities = entities.setdefault(instance.__class__, {})
+        if key in kind_entities:
+            continue
+
+        kind_entities[key] = (instance, fields)
+        for field in instance.persisted_references:
+            if fields is None or field in fields:
+                reference = getattr(instance, field)
+                pending.append((reference, reference.GetStorageKey_(),
+                                None if fields is None else fields[field]))
+    return storage_key
+
+
+def append_entities(parts, data_format, entities, normalized):
+    """Appends a dictionary of models by kind and storage key to a response.
+
+    Args:
+      parts: list; The bytes the response is assembled from.
+      data_format: formats.Format; The format of the response.
+      entities: dict; Maps each model class to a dict of storage keys to
+        (model, fields) pairs, as built by add_entity().
+      normalized: bool; Whether to give referenced models by storage key.
+
+    """
+    kinds = sorted((model_class.__name__.lower() + 's', model_class)
+                   for model_class in entities)
+    parts.append(data_format.MapStart(len(kinds)))
+    for index, (kind, model_class) in enumerate(kinds):
+        kind_entities = entities[model_class]
+        if index:
+            parts.append(data_format.separator)
+        parts.append(data_format.Encode(kind) + data_format.key_separator)
+        parts.append(data_format.MapStart(len(kind_entities)))
+        for position, storage_key in enumerate(sorted(kind_entities)):
+            instance, fields = kind_entities[storage_key]
+            if position:
+                parts.append(data_format.separator)
+            parts.append(data_format.Encode(storage_key) +
+                         data_format.key_separator)
+            parts.append(instance.ToEncoded(data_format, fields,
+                                            normalized=normalized))
+        parts.append(data_format.map_end)
+    parts.append(data_format.map_end)
+
+
+def jsonify_models(response, normalize=False):
+    """Sends a response like jsonify, reusing the encoding of its models.
+
+    The response is sent in the format the Accept header asks for, JSON by
+    default. Models, and lists of them, are copied from their cached
+    ToEncoded() fragments rather than run through the encoder again.
+    If the request has a fields argument, only those fields of each model
+    are serialized. If it has a normalize argument, models are given by id
+    and serialized once each in the top-level entities dictionary, with
+    the models they reference also given by id. If it has an include
+    argument, the related models it names are sent once each in the
+    top-level included dictionary, or with the entities if normalized.
+    Models then give the models they reference by id too, and those are
+    sent once each in the included dictionary as well.
+
+    Args:
+      response: dict; The response to send. Values can be models, lists of
+        models, in which None stands for a model not found, or anything
+        else jsonify accepts.
+      normalize: bool; Whether to normalize the response if the request
+        has no normalize argument.
+
+    Returns:
+      A Response.
+
+    """
+    data_format = get_response_format()
+    fields = get_fields()
+    include = get_include()
+    entities = {} if get_normalized(normalize) else None
+    included = {} if include and entities is None else None
+    instances = []
+    g.response_models = instances
+    g.response_has_lists = any(value is None or isinstance(value, list)
+                               for value in response.values())
+
+    def encode(instance):
+        instances.append(instance)
+        if entities is not None:
+            return data_format.Encode(add_entity(entities, instance, fields))
+        if included is None:
+            return instance.ToEncoded(data_format, fields)
+        for field in instance.persisted_references:
+            if fields is None or field in fields:
+                add_entity(included, getattr(instance, field),
+                           None if fields is None else fields[field])
+        return instance.ToEncoded(data_format, fields, normalized=True)
+
+    def append_key(key):
+        if len(parts) > 1:
+            parts.append(data_format.separator)
+        parts.append(data_format.Encode(key) + data_format.key_separator)
+
+    # Models are encoded under read locks, so none of their relation dicts
+    # changes meanwhile.
+    with blogger_engine.Reading():
+        # Included models go in the entities when normalized.
+        parts = [data_format.MapStart(
+            len(response) + bool(include or entities is not None))]
+        for key in sorted(response):
+            value = response[key]
+            append_key(key)
+            if isinstance(value, base_model.BaseModel):
+                parts.append(encode(value))
+            elif (isinstance(value, list) and
+                  any(isinstance(instance, base_model.BaseModel)
+                      for instance in value)):
+                parts.append(data_format.ArrayStart(len(value)))
+                for index, instance in enumerate(value):
+                    if index:
+                        parts.append(data_format.separator)
+                    if instance is None:
+                        parts.append(data_format.Encode(None))
+                    else:
+                        parts.append(encode(instance))
+                parts.append(data_format.array_end)
+            else:
+                parts.append(data_format.Encode(value))
+
+        if include:
+            related = get_included(instances, include)
+            g.response_models = instances + related
+            for instance in related:
+                add_entity(included if entities is None else entities,
+                           instance, fields)
+            if entities is None:
+                for instance in instances:
+                    included.get(instance.__class__, {}).pop(
+                        instance.GetStorageKey_(), None)
+                included = dict((model_class, kind_included)
+                                for model_class, kind_included
+                                in included.items() if kind_included)
+                append_key('included')
+                append_entities(parts, data_format, included, normalized=True)
+
+        if entities is not None:
+            append_key('entities')
+            append_entities(parts, data_format, entities, normalized=True)
+    parts.append(data_format.map_end + data_format.trailer)
+    result = Response(b''.join(parts), mimetype=data_format.mimetypes[0])
+    result.vary.add('Accept')
+    return result
+
+
+def stream_response(name, instances, stream_format):
+    """Sends instances as they are encoded, rather than all at once.
+
+    Only one chunk of encoded instances is held in memory at a time, so
+    memory use does not grow with the number of instances. Like
+    jsonify_models(), it honors the fields argument. Each instance is
+    encoded under read locks, so it never shows the intermediate state of
+    a transaction; the models it embeds are as of when it is encoded.
+
+    Args:
+      name: string; The key of the list in a JSON response.
+      instances: iterable; The instances to send.
+      stream_format: string; 'json' for the same object as an unstreamed
+        response, or 'ndjson' for one instance per line.
+
+    Returns:
+      A streamed Response.
+
+    """
+    fields = get_fields()
+
+    def generate():
+        chunk = []
+        size = 0
+        if stream_format == 'json':
+            chunk.append(b'{"' + name.encode('utf-8') + b'":[')
+        for index, instance in enumerate(instances):
+            with blogger_engine.Reading():
+                record = instance.ToEncodedJson(fields)
+            if stream_format == 'ndjson':
+                record += b'\n'
+            elif index:
+                record = b',' + record
+            chunk.append(record)
+            size += len(record)
+            if size >= STREAM_CHUNK_SIZE:
+                yield b''.join(chunk)
+                chunk = []
+                size = 0
+        if stream_format == 'json':
+            chunk.append(b']}')
+        if chunk:
+            yield b''.join(chunk)
+
+    return Response(generate(), mimetype=STREAM_MIMETYPES[stream_format])
+
+
+def get_etag(kinds):
+    """Derives a route's ETag from the request and the collection versions.
+
+    Args:
+      kinds: list; The model kinds the route returns. With an include
+        argument, every kind is taken into account.
+
+    Returns:
+      The ETag, which changes whenever the response may have changed.
+
+    """
+    if get_names_argument('include') is None:
+        kinds = sorted(set(dependency for kind in kinds
+                           for dependency in SERIALIZED_KINDS[kind]))
+    else:
+        kinds = ()
+    key = (ETAG_SALT, request.full_path, request.get_data(),
+           request.headers.get('Accept'),
+           blogger_engine.GetCollectionVersions(*kinds))
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+def get_surrogate_keys(kinds):
+    """Lists the keys a shared cache can purge a response by.
+
+    A model is keyed by its kind and storage key, e.g. 'blogpost/<id>', and
+    a kind's collection by its plural, e.g. 'blogposts'. Responses holding
+    a single model, and those it embeds or includes, are keyed by them.
+    Lists, missing models and streams are keyed by the collections of the
+    kinds the route returns, since any write to those kinds may change
+    them. Writes should purge the keys of the models they change and the
+    collections of their kinds.
+
+    Args:
+      kinds: list; The model kinds the route returns.
+
+    Returns:
+      A space separated string of keys.
+
+    """
+    models = g.get('response_models')
+    if models is None or g.get('response_has_lists'):
+        if get_names_argument('include') is not None:
+            kinds = SERIALIZED_KINDS
+        kinds = set(dependency for kind in kinds
+                    for dependency in SERIALIZED_KINDS[kind])
+        return ' '.join(sorted(kind.lower() + 's' for kind in kinds))
+
+    keys = set()
+    models = list(models)
+    while models:
+        instance = models.pop()
+        key = '%s/%s' % (instance.__class__.__name__.lower(),
+                         instance.GetStorageKey_())
+        if key not in keys:
+            keys.add(key)
+            models.extend(getattr(instance, field)
+                          for field in instance.persisted_references)
+    return ' '.join(sorted(keys))
+
+
+def get_response_cache_key():
+    """Gets the key of the request's response in response_cache.
+
+    Returns:
+      The key, or None if the request's arguments cannot be keyed.
+
+    """
+    arguments = dict(request.view_args or {})
+    if request.method == 'GET':
+        arguments.update(request.args.to_dict())
+    else:
+        request_arguments = get_request_body(silent=True)
+        if not isinstance(request_arguments, dict):
+            return None
+        arguments.update(request_arguments)
+
+    try:
+        encoded_arguments = base_model.EncodeJson(arguments)
+    except (TypeError, ValueError):
+        return None
+    return (request.endpoint, encoded_arguments,
+            request.headers.get('Accept'))
+
+
+def get_response_tags(kinds):
+    """Lists the tags to invalidate the request's cached response by.
+
+    They are the keys of every model in the response and those they
+    embed, as in get_surrogate_keys(), and of the models the request looks
+    up, such as 'author/<username>' for a username argument or each of
+    the usernames argument, whether found or not. Responses of routes
+    that look nothing up list whole collections, so are tagged with the
+    collections of their kinds.
+
+    Args:
+      kinds: list; The model kinds the route returns.
+
+    Returns:
+      A set of tags.
+
+    """
+    request_arguments = get_read_arguments(**(request.view_args or {}))
+    tags = set()
+    for name, kind in LOOKUP_ARGUMENTS.items():
+        value = request_arguments.get(name)
+        if value is not None:
+            tags.add('%s/%s' % (kind, value))
+    for name, kind in MULTI_LOOKUP_ARGUMENTS.items():
+        tags.update('%s/%s' % (kind, value)
+                    for value in get_names_argument(name) or ())
+    if not tags:
+        tags.update(kind.lower() + 's' for kind in kinds)
+
+    models = list(g.get('response_models') or ())
+    while models:
+        instance = models.pop()
+        tag = '%s/%s' % (instance.__class__.__name__.lower(),
+                         instance.GetStorageKey_())
+        if tag not in tags:
+            tags.add(tag)
+            models.extend(getattr(instance, field)
+                          for field in instance.persisted_references)
+    return tags
+
+
+def build_response(route, kinds, args, kwargs, key, generation):
+    """Runs a read route, and stores its response in response_cache.
+
+    Args:
+      route: callable; The route function.
+      kinds: list; The model kinds the route returns.
+      args: tuple; The route's positional arguments.
+      kwargs: dict; The route's keyword arguments.
+      key: tuple; The response's get_response_cache_key(), or None.
+      generation: int; The generation response_cache.Get() returned.
+
+    Returns:
+      A (Response, surrogate keys, value) tuple. The value is the (data,
+      mimetype, surrogate keys) tuple other requests can be answered with,
+      or None for errors and streamed responses.
+
+    """
+    response = app.make_response(route(*args, **kwargs))
+    surrogate_keys = get_surrogate_keys(kinds)
+    if (response.status_code != 200 or response.is_streamed or
+            g.get('response_models') is None):
+        return response, surrogate_keys, None
+
+    data = response.get_data()
+    value = (data, response.mimetype, surrogate_keys)
+    if key is not None:
+        response_cache.Put(key, value, len(data) + len(surrogate_keys),
+                           get_response_tags(kinds), generation)
+    return response, surrogate_keys, value
+
+
+def run_cached(route, kinds, args, kwargs):
+    """Runs a read route, or gets its response from response_cache.
+
+    Identical requests arriving while the route runs wait for it through
+    single_flight and are answered with the same response. Requests are
+    only coalesced with one started since the last invalidation, so none
+    is answered with models older than when it arrived.
+
+    Args:
+      route: callable; The route function.
+      kinds: list; The model kinds the route returns.
+      args: tuple; The route's positional arguments.
+      kwargs: dict; The route's keyword arguments.
+
+    Returns:
+      A (Response, surrogate keys) tuple.
+
+    """
+    key = get_response_cache_key()
+    if key is None:
+        response, surrogate_keys, unused_value = build_response(
+            route, kinds, args, kwargs, None, None)
+        return response, surrogate_keys
+
+    value, generation = response_cache.Get(key)
+    if value is None:
+        result, shared = single_flight.Do(
+            (key, generation),
+            functools.partial(build_response, route, kinds, args, kwargs,
+                              key, generation))
+        response, surrogate_keys, value = result
+        if not shared:
+            return response, surrogate_keys
+        if value is None:
+            response, surrogate_keys, unused_value = build_response(
+                route, kinds, args, kwargs, key, generation)
+            return response, surrogate_keys
+
+    data, mimetype, surrogate_keys = value
+    return Response(data, mimetype=mimetype), surrogate_keys
+
+
+def conditional(*kinds):
+    """Tags a route's responses with an ETag, and answers If-None-Match.
+
+    Matching requests are answered with 304 Not Modified before the route
+    runs, so polling an unchanged route serializes nothing. Other
+    responses are kept in response_cache until the models they depend on
+    change. Only use it on routes that do not modify the datastore. GET
+    responses can be stored by HTTP caches, as Cache-Control says, and
+    carry a Surrogate-Key header to purge them by.
+
+    Args:
+      *kinds: string; The model kinds the route returns.
+
+    Returns:
+      A decorator for route functions.
+
+    """
+    def decorator(route):
+
+        @functools.wraps(route)
+        def wrapper(*args, **kwargs):
+            if g.get('conditional'):
+                # Another conditional route is calling this one.
+                return route(*args, **kwargs)
+            g.conditional = True
+
+            etag = get_etag(kinds)
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response, surrogate_keys = run_cached(route, kinds, args,
+                                                      kwargs)
+                if response.status_code != 200:
+                    return response
+                if request.method == 'GET':
+                    response.headers['Surrogate-Key'] = surrogate_keys
+            response.set_etag(etag, weak=True)
+            response.vary.add('Accept')
+            if request.method == 'GET':
+                response.cache_control.public = True
+                response.cache_control.max_age = CACHE_MAX_AGE
+                response.cache_control.s_maxage = CACHE_SHARED_MAX_AGE
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+@app.after_request
+def compress_response(response):
+    """Compresses responses for clients whose Accept-Encoding allows it.
+
+    Payloads are compressed through compression_cache, so an unchanged
+    payload is not compressed again. Streamed responses are compressed
+    chunk by chunk as they are sent, and are not cached.
+
+    Args:
+      response: Response; The response to send.
+
+    Returns:
+      The response, compressed if it should be.
+
+    """
+    if (response.status_code != 200 or
+            'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(compression.ENCODINGS)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compression.CompressChunks(
+            response.response, encoding, compression_cache.level)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESSION_MIN_BYTES:
+            return response
+        response.set_data(compression_cache.Compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
 
 """Author methods."""
 
@@ -22,18 +938,20 @@ def author_create():
       A dictionary containing the new Author.
 
     """
-    request_arguments = request.get_json()
+    request_arguments = get_request_body()
     username = request_arguments.get('username')
     if not username:
         abort(400)
 
-    return jsonify({
-        'author': blogger_engine.GetOrInsertAuthor(username).ToJson()
+    return jsonify_models({
+        'author': blogger_engine.GetOrInsertAuthor(username)
     })
 
 
 @app.route('/author/get_by_username', methods=['POST'])
-def author_get_by_username():
+@app.route('/authors/<username>', methods=['GET'])
+@conditional('Author')
+def author_get_by_username(username=None):
     """Gets an author by their username.
 
     Request Args:
@@ -43,60 +961,85 @@ def author_get_by_username():
       A dictionary with the retrieved author, if found.
 
     """
-    request_arguments = request.get_json()
+    request_arguments = get_read_arguments(username=username)
     username = request_arguments.get('username')
     if not username:
         abort(400)
 
     author = blogger_engine.GetAuthorByUsername(username)
     if author:
-        return jsonify({
-            'author': author.ToJson()
+        return jsonify_models({
+            'author': author
         })
 
-    return jsonify({
+    return jsonify_models({
         'author': None
     })
 
 
+@app.route('/author/get_by_usernames', methods=['GET', 'POST'])
+@conditional('Author')
+def author_get_by_usernames():
+    """Gets several authors by username at once.
+
+    Request Args:
+      usernames: list; The usernames to look up, or in a query string a
+        comma separated string.
+
+    Returns:
+      A dictionary of the authors, in the order of the usernames, with
+      null for each author not found.
+
+    """
+    usernames = get_names_argument('usernames')
+    if usernames is None:
+        abort(400)
+
+    return jsonify_models({
+        'authors': blogger_engine.GetAuthorsByUsernames(usernames)
+    })
+
+
 @app.route('/author/get_all_blogposts', methods=['POST'])
-def author_get_all_blogposts():
+@app.route('/authors/<username>/blogposts', methods=['GET'])
+@conditional('Author', 'Blogpost')
+def author_get_all_blogposts(username=None):
     """Gets all blogposts for a given author.
 
     Request Args:
       username: string; The author username to retrieve blogposts.
+      limit: int; Return at most this many results, and a next_cursor.
+      cursor: string; The next_cursor of the previous page.
 
     Returns:
       A dictionary of the the author's blogposts, if found.
 
     """
-    request_arguments = request.get_json()
+    request_arguments = get_read_arguments(username=username)
     username = request_arguments.get('username')
     if not username:
         abort(400)
+    limit, cursor = get_page_arguments(request_arguments)
 
     author = blogger_engine.GetAuthorByUsername(username)
     if author:
-        if author.GetBlogposts():
-            return jsonify({
-                'blogposts': [blogpost.ToJson()
-                              for blogpost in author.GetBlogposts()],
-                'author': author.ToJson()
-            })
-        else:
-            return jsonify({
-                'blogposts': [],
-                'author': author.ToJson()
-            })
-
-    return jsonify({
+        blogposts = blogger_engine.GetBlogpostsByUsername(username, limit,
+                                                          cursor)
+        return jsonify_models(add_next_cursor({
+            'blogposts': blogposts,
+            'author': author
+        }, blogposts))
+
+    return jsonify_models({
         'blogposts': [],
         'author': None
     })
 
 
 @app.route('/author/get_all_removed_blogposts', methods=['POST'])
-def author_get_all_removed_blogposts():
+@app.route('/authors/<username>/removed_blogposts', methods=['GET'])
+@conditional('Author', 'Blogpost')
+def author_get_all_removed_blogposts(username=None):
     """Gets all remobved blogposts associated with an author.
 
     Request Args:
@@ -106,72 +1049,64 @@ def author_get_all_removed_blogposts():
       A dictionary of removed blogposts, if found.
 
     """
-    request_arguments = request.get_json()
+    request_arguments = get_read_arguments(username=username)
     username = request_arguments.get('username')
     if not username:
         abort(400)
 
     author = blogger_engine.GetAuthorByUsername(username)
     if author:
-        author_json = author.ToJson()
-        if author.GetRemovedBlogposts():
-            return jsonify({
-                'removed_blogposts': [blogpost.ToJson()
-                                      for blogpost in
-                                      author.GetRemovedBlogposts()],
-                'author': author_json
-            })
-        else:
-            return jsonify({
-                'removed_blogposts': [],
-                'author': author_json
-            })
+        return jsonify_models({
+            'removed_blogposts': author.GetRemovedBlogposts(),
+            'author': author
+        })
 
-    return jsonify({
+    return jsonify_models({
         'author': None,
         'removed_blogposts': []
     })
 
 
 @app.route('/author/get_all_comments', methods=['POST'])
-def author_get_all_comments():
+@app.route('/authors/<username>/comments', methods=['GET'])
+@conditional('Author', 'Comment')
+def author_get_all_comments(username=None):
     """Gets all comments from a given author.
 
     Request Args:
       username: string; The author username to retrieve comments.
+      limit: int; Return at most this many results, and a next_cursor.
+      cursor: string; The next_cursor of the previous page.
 
     Returns:
       A dictionary of comments, if found.
 
     """
-    request_arguments = request.get_json()
+    request_arguments = get_read_arguments(username=username)
     username = request_arguments.get('username')
     if not username:
         abort(400)
+    limit, cursor = get_page_arguments(request_arguments)
 
     author = blogger_engine.GetAuthorByUsername(username)
     if author:
-        author_json = author.ToJson()
-        if author.GetComments():
-            return jsonify({
-                'comments': [comment.ToJson()
-                             for comment in author.GetComments()],
-                'author': author_json
-            })
-        else:
-            return jsonify({
-                'comments': [],
-                'author': author_json
-            })
-
-    return jsonify({
+        comments = blogger_engine.GetCommentsByUsername(username, limit,
+                                                        cursor)
+        return jsonify_models(add_next_cursor({
+            'comments': comments,
+            'author': author
+        }, comments))
+
+    return jsonify_models({
         'comments': [],
         'author': None
     })
 
 
 @app.route('/author/get_all_removed_comments', methods=['POST'])
-def author_get_all_removed_comments():
+@app.route('/authors/<username>/removed_comments', methods=['GET'])
+@conditional('Author', 'Comment')
+def author_get_all_removed_comments(username=None):
     """Gets all removed comments from an author.
 
     Request Args:
@@ -181,50 +1116,50 @@ def author_get_all_removed_comments():
       A dictionary of removed comments, if found.
 
     """
-    request_arguments = request.get_json()
+    request_arguments = get_read_arguments(username=username)
     username = request_arguments.get('username')
     if not username:
         abort(400)
 
     author = blogger_engine.GetAuthorByUsername(username)
     if author:
-        author_json = author.ToJson()
-        if author.GetRemovedComments():
-            return jsonify({
-                'removed_comments': [comment.ToJson()
-                                     for comment in
-                                     author.GetRemovedComments()],
-                'author': author_json
-            })
-        else:
-            return jsonify({
-                'removed_comments': [],
-                'author': author_json
-            })
+        return jsonify_models({
+            'removed_comments': author.GetRemovedComments(),
+            'author': author
+        })
 
-    return jsonify({
+    return jsonify_models({
         'removed_comments': [],
         'author': None
     })
 
 
 @app.route('/author/get_all', methods=['GET', 'POST'])
+@conditional('Author')
 def author_get_all():
     """Get all authors.
 
+    Request Args:
+      limit: int; Return at most this many results, and a next_cursor.
+      cursor: string; The next_cursor of the previous page.
+      stream: string; 'json' or 'ndjson' to stream every result.
+
     Returns:
       A dictionary of all authors in the datastore.
 
     """
-    authors = blogger_engine.GetAllAuthors()
-    if authors:
-        return jsonify({
-            'authors': [author.ToJson() for author in authors]
-        })
-
-    return jsonify({
-        'authors': []
-    })
+    request_arguments = get_request_body(silent=True)
+    stream_format = get_stream_format(request_arguments)
+    if stream_format:
+        snapshot = blogger_engine.GetSnapshot('Author')['Author']
+        return stream_response('authors', snapshot.Iterate(),
+                               stream_format)
+
+    limit, cursor = get_page_arguments(request_arguments)
+    authors = blogger_engine.GetAllAuthors(limit, cursor)
+    return jsonify_models(add_next_cursor({
+        'authors': authors
+    }, authors))
 
 """Blogpost methods."""
 
@@ -242,7 +1177,7 @@ def blogpost_create():
       A dictionary containing the new blogpost and author.
 
     """
-    request_arguments = request.get_json()
+    request_arguments = get_request_body()
 
     username = request_arguments.get('username')
     headline = request_arguments.get('headline')
@@ -251,11 +1186,11 @@ def blogpost_create():
     if not username and not headline and not body:
         abort(400)
 
-    return jsonify({
+    return jsonify_models({
         'blogpost': blogger_engine.SubmitBlogpost(username,
                                                   headline,
-                                                  body).ToJson(),
-        'author': blogger_engine.GetAuthorByUsername(username).ToJson()
+                                                  body),
+        'author': blogger_engine.GetAuthorByUsername(username)
     })
 
 
@@ -271,7 +1206,7 @@ def blogpost_add_label():
       A dictionary containing the new label and the affected blogpost.
 
     """
-    request_arguments = request.get_json()
+    request_arguments = get_request_body()
 
     label_text = request_arguments.get('label_text')
     blogpost_id = request_arguments.get('blogpost_id')
@@ -283,12 +1218,12 @@ def blogpost_add_label():
     blogpost = blogger_engine.GetBlogpostById(blogpost_id)
 
     if label and blogpost:
-        return jsonify({
-            'label': label.ToJson(),
-            'blogpost': blogpost.ToJson()
+        return jsonify_models({
+            'label': label,
+            'blogpost': blogpost
         })
 
-    return jsonify({
+    return jsonify_models({
         'label': None,
         'blogpost': None
     })
@@ -306,7 +1241,7 @@ def blogpost_remove_label():
       A dictionary containing the affected blogpost and label.
 
     """
-    request_arguments = request.get_json()
+    request_arguments = get_request_body()
     label_text = request_arguments.get('label_text')
     blogpost_id = request_arguments.get('blogpost_id')
 
@@ -319,24 +1254,24 @@ def blogpost_remove_label():
     if blogpost and label:
         result = blogger_engine.RemoveLabelFromBlogpost(label_text,
                                                         blogpost_id)
-        return jsonify({
-            'label': label.ToJson(),
-            'blogpost': blogpost.ToJson()
+        return jsonify_models({
+            'label': label,
+            'blogpost': blogpost
         })
 
     if blogpost and not label:
-        return jsonify({
+        return jsonify_models({
             'label': None,
-            'blogpost': blogpost.ToJson()
+            'blogpost': blogpost
         })
 
     if label and not blogpost:
-        return jsonify({
-            'label': label.ToJson(),
+        return jsonify_models({
+            'label': label,
             'blogpost': None
         })
 
-    return jsonify({
+    return jsonify_models({
         'label': None,
         'blogpost': None
     })
@@ -355,7 +1290,7 @@ def blogpost_add_comment():
       A dictionary containing the comment and affected blogpost.
 
     """
-    request_arguments = request.get_json()
+    request_arguments = get_request_body()
 
     username = request_arguments.get('username')
     comment_text = request_arguments.get('comment_text')
@@ -366,16 +1301,9 @@ def blogpost_add_comment():
 
     comment = blogger_engine.SubmitComment(username, comment_text,
                                            blogpost_id)
-    if comment:
-        blogpost_json = comment.blogpost.ToJson()
-        comment_json = comment.ToJson()
-    else:
-        blogpost_json = None
-        comment_json = None
-
-    return jsonify({
-        'comment': comment_json,
-        'blogpost': blogpost_json,
+    return jsonify_models({
+        'comment': comment,
+        'blogpost': comment and comment.blogpost,
     })
 
 
@@ -390,7 +1318,7 @@ def blogpost_remove_comment():
       A dictionary containing the removed comment and affected blogpost.
 
     """
-    request_arguments = request.get_json()
+    request_arguments = get_request_body()
     comment_id = request_arguments.get('comment_id')
 
     if not comment_id:
@@ -400,19 +1328,21 @@ def blogpost_remove_comment():
     if comment:
         removed_comment = blogger_engine.RemoveCommentFromBlogpost(
             comment.id)
-        return jsonify({
-            'removed_comment': removed_comment.ToJson(),
-            'blogpost': removed_comment.blogpost.ToJson()
+        return jsonify_models({
+            'removed_comment': removed_comment,
+            'blogpost': removed_comment.blogpost
         })
 
-    return jsonify({
+    return jsonify_models({
         'removed_comment': None,
         'blogpost': None
     })
 
 
 @app.route('/blogpost/get_by_id', methods=['POST'])
-def blogpost_get_by_id():
+@app.route('/blogposts/<blogpost_id>', methods=['GET'])
+@conditional('Blogpost')
+def blogpost_get_by_id(blogpost_id=None):
     """Gets a blogpost from it's ID.
 
     Request Args:
@@ -422,7 +1352,7 @@ def blogpost_get_by_id():
       A dictionary containing the blogpost, if found.
 
     """
-    request_arguments = request.get_json()
+    request_arguments = get_read_arguments(blogpost_id=blogpost_id)
     blogpost_id = request_arguments.get('blogpost_id')
 
     if not blogpost_id:
@@ -430,55 +1360,83 @@ def blogpost_get_by_id():
 
     blogpost = blogger_engine.GetBlogpostById(blogpost_id)
     if blogpost:
-        return jsonify({
-            'blogpost': blogpost.ToJson()
+        return jsonify_models({
+            'blogpost': blogpost
         })
 
-    return jsonify({
+    return jsonify_models({
         'blogpost': None
     })
 
 
+@app.route('/blogpost/get_by_ids', methods=['GET', 'POST'])
+@conditional('Blogpost')
+def blogpost_get_by_ids():
+    """Gets several blogposts by id at once.
+
+    Blogposts are normalized unless normalize is false, so an author of
+    several of them is serialized once.
+
+    Request Args:
+      blogpost_ids: list; The blogpost IDs, or in a query string a comma
+        separated string.
+
+    Returns:
+      A dictionary of the blogposts, in the order of the ids, with null for
+      each blogpost not found.
+
+    """
+    blogpost_ids = get_names_argument('blogpost_ids')
+    if blogpost_ids is None:
+        abort(400)
+
+    return jsonify_models({
+        'blogposts': blogger_engine.GetBlogpostsByIds(blogpost_ids)
+    }, normalize=True)
+
+
 @app.route('/blogpost/get_all_comments', methods=['POST'])
-def blogpost_get_all_comments():
+@app.route('/blogposts/<blogpost_id>/comments', methods=['GET'])
+@conditional('Blogpost', 'Comment')
+def blogpost_get_all_comments(blogpost_id=None):
     """Get all comments associated with a blogpost.
 
     Request Args:
       blogpost_id: string; The blogpost to retrieve comments from.
+      limit: int; Return at most this many results, and a next_cursor.
+      cursor: string; The next_cursor of the previous page.
 
     Returns:
       A dictionary containing the retrieved comments and the blogpost.
 
     """
-    request_arguments = request.get_json()
+    request_arguments = get_read_arguments(blogpost_id=blogpost_id)
 
     blogpost_id = request_arguments.get('blogpost_id')
 
     if not blogpost_id:
         abort(400)
+    limit, cursor = get_page_arguments(request_arguments)
 
     blogpost = blogger_engine.GetBlogpostById(blogpost_id)
-    comments = blogger_engine.GetCommentsByBlogpost(blogpost_id)
-    if blogpost and comments:
-        return jsonify({
-            'comments': [comment.ToJson() for comment in comments],
-            'blogpost': blogpost.ToJson()
-        })
-
+    comments = blogger_engine.GetCommentsByBlogpost(blogpost_id, limit,
+                                                    cursor)
     if blogpost:
-        return jsonify({
-            'comments': [],
-            'blogpost': blogpost.ToJson()
-        })
+        return jsonify_models(add_next_cursor({
+            'comments': comments,
+            'blogpost': blogpost
+        }, comments))
 
-    return jsonify({
+    return jsonify_models({
         'comments': [],
         'blogpost': None
     })
 
 
 @app.route('/blogpost/get_all_labels', methods=['POST'])
-def blogpost_get_all_labels():
+@app.route('/blogposts/<blogpost_id>/labels', methods=['GET'])
+@conditional('Blogpost', 'Label')
+def blogpost_get_all_labels(blogpost_id=None):
     """Gets all labels associated with a blogpost.
 
     Request Args:
@@ -488,7 +1446,7 @@ def blogpost_get_all_labels():
       A dictionary containing the blogpost and labels found.
 
     """
-    request_arguments = request.get_json()
+    request_arguments = get_read_arguments(blogpost_id=blogpost_id)
 
     blogpost_id = request_arguments.get('blogpost_id')
     if not blogpost_id:
@@ -496,61 +1454,70 @@ def blogpost_get_all_labels():
 
     labels = blogger_engine.GetLabelsByBlogpost(blogpost_id)
     if labels:
-        return jsonify({
-            'blogpost': blogger_engine.GetBlogpostById(blogpost_id).ToJson(),
-            'labels': [label.ToJson() for label in labels]
+        return jsonify_models({
+            'blogpost': blogger_engine.GetBlogpostById(blogpost_id),
+            'labels': labels
         })
 
-    return jsonify({
+    return jsonify_models({
         'blogpost': None,
         'labels': []
     })
 
 
 @app.route('/blogpost/get_by_label', methods=['POST'])
-def blogpost_get_by_label():
+@app.route('/labels/<label_text>/blogposts', methods=['GET'])
+@conditional('Blogpost', 'Label')
+def blogpost_get_by_label(label_text=None):
     """Gets all blogposts associated with a given label.
 
     Request Args:
       label_text: string; The label to query for.
+      limit: int; Return at most this many results, and a next_cursor.
+      cursor: string; The next_cursor of the previous page.
 
     Returns:
       A dictionary containing the blogposts, if found.
 
     """
-    request_arguments = request.get_json()
+    request_arguments = get_read_arguments(label_text=label_text)
     label_text = request_arguments.get('label_text')
     if not label_text:
         abort(400)
+    limit, cursor = get_page_arguments(request_arguments)
 
-    blogposts = blogger_engine.GetBlogpostsByLabel(label_text)
-    if blogposts:
-        return jsonify({
-            'blogposts': [blogpost.ToJson() for blogpost in blogposts]
-        })
-
-    return jsonify({
-        'blogposts': []
-    })
+    blogposts = blogger_engine.GetBlogpostsByLabel(label_text, limit, cursor)
+    return jsonify_models(add_next_cursor({
+        'blogposts': blogposts or []
+    }, blogposts))
 
 
 @app.route('/blogpost/get_all', methods=['GET', 'POST'])
+@conditional('Blogpost')
 def blogpost_get_all():
     """Retrieves all blogposts from the datastore.
 
+    Request Args:
+      limit: int; Return at most this many results, and a next_cursor.
+      cursor: string; The next_cursor of the previous page.
+      stream: string; 'json' or 'ndjson' to stream every result.
+
     Returns:
       A dictionary containing all blogposts.
 
     """
-    blogposts = blogger_engine.GetAllBlogposts()
-    if blogposts:
-        return jsonify({
-            'blogposts': [blogpost.ToJson() for blogpost in blogposts]
-        })
+    request_arguments = get_request_body(silent=True)
+    stream_format = get_stream_format(request_arguments)
+    if stream_format:
+        snapshot = blogger_engine.GetSnapshot('Blogpost')['Blogpost']
+        return stream_response('blogposts', snapshot.Iterate(),
+                               stream_format)
 
-    return jsonify({
-        'blogposts': []
-    })
+    limit, cursor = get_page_arguments(request_arguments)
+    blogposts = blogger_engine.GetAllBlogposts(limit, cursor)
+    return jsonify_models(add_next_cursor({
+        'blogposts': blogposts
+    }, blogposts))
 
 
 @app.route('/blogpost/remove', methods=['POST'])
@@ -561,7 +1528,7 @@ def blogpost_remove():
       blogpost_id: string; The blogpost ID to remove.
 
     """
-    request_arguments = request.get_json()
+    request_arguments = get_request_body()
     blogpost_id = request_arguments.get('blogpost_id')
 
     if not blogpost_id:
@@ -569,7 +1536,7 @@ def blogpost_remove():
 
     blogpost = blogger_engine.GetBlogpostById(blogpost_id)
     if not blogpost:
-        return jsonify({
+        return jsonify_models({
             'removed_blogpost': None,
             'author': None
         })
@@ -577,13 +1544,14 @@ def blogpost_remove():
     author = blogpost.author
     deleted_blogpost = blogger_engine.DeleteBlogpost(blogpost.id)
     if blogpost:
-        return jsonify({
-            'removed_blogpost': blogpost.ToJson(),
-            'author': author.ToJson()
+        return jsonify_models({
+            'removed_blogpost': blogpost,
+            'author': author
         })
 
 
 @app.route('/blogpost/get_all_by_username', methods=['POST'])
+@conditional('Author', 'Blogpost')
 def blogpost_get_all_by_username():
     """Gets all blogposts for a given author.
 
@@ -616,7 +1584,9 @@ def comment_create():
 
 
 @app.route('/comment/get_by_id', methods=['POST'])
-def comment_get_by_id():
+@app.route('/comments/<comment_id>', methods=['GET'])
+@conditional('Comment')
+def comment_get_by_id(comment_id=None):
     """Gets a comment by ID.
 
     Request Args:
@@ -626,7 +1596,7 @@ def comment_get_by_id():
       A dictinoary containing the comment, if found.
 
     """
-    request_arguments = request.get_json()
+    request_arguments = get_read_arguments(comment_id=comment_id)
     comment_id = request_arguments.get('comment_id')
 
     if not comment_id:
@@ -634,15 +1604,41 @@ def comment_get_by_id():
 
     comment = blogger_engine.GetCommentById(comment_id)
     if comment:
-        return jsonify({
-            'comment': comment.ToJson()
+        return jsonify_models({
+            'comment': comment
         })
 
-    return jsonify({
+    return jsonify_models({
         'comment': None
     })
 
 
+@app.route('/comment/get_by_ids', methods=['GET', 'POST'])
+@conditional('Comment')
+def comment_get_by_ids():
+    """Gets several comments by id at once.
+
+    Comments are normalized unless normalize is false, so the authors and
+    blogposts they share are serialized once.
+
+    Request Args:
+      comment_ids: list; The comment IDs, or in a query string a comma
+        separated string.
+
+    Returns:
+      A dictionary of the comments, in the order of the ids, with null for
+      each comment not found.
+
+    """
+    comment_ids = get_names_argument('comment_ids')
+    if comment_ids is None:
+        abort(400)
+
+    return jsonify_models({
+        'comments': blogger_engine.GetCommentsByIds(comment_ids)
+    }, normalize=True)
+
+
 @app.route('/comment/remove', methods=['POST'])
 def comment_remove():
     """Removes a comment from a blogpost.
@@ -658,6 +1654,7 @@ def comment_remove():
 
 
 @app.route('/comment/get_all_by_username', methods=['POST'])
+@conditional('Author', 'Comment')
 def comment_get_all_by_username():
     """Gets all comments from a given author.
 
@@ -672,22 +1669,31 @@ def comment_get_all_by_username():
 
 
 @app.route('/comment/get_all', methods=['GET', 'POST'])
+@conditional('Comment')
 def comments_get_all():
     """Gets all comments from the datastore.
 
+    Request Args:
+      limit: int; Return at most this many results, and a next_cursor.
+      cursor: string; The next_cursor of the previous page.
+      stream: string; 'json' or 'ndjson' to stream every result.
+
     Returns:
       A dictionary of comments.
 
     """
-    comments = blogger_engine.GetAllComments()
-    if comments:
-        return jsonify({
-            'comments': [comment.ToJson() for comment in comments]
-        })
-
-    return jsonify({
-        'comments': []
-    })
+    request_arguments = get_request_body(silent=True)
+    stream_format = get_stream_format(request_arguments)
+    if stream_format:
+        snapshot = blogger_engine.GetSnapshot('Comment')['Comment']
+        return stream_response('comments', snapshot.Iterate(),
+                               stream_format)
+
+    limit, cursor = get_page_arguments(request_arguments)
+    comments = blogger_engine.GetAllComments(limit, cursor)
+    return jsonify_models(add_next_cursor({
+        'comments': comments
+    }, comments))
 
 """Label methods."""
 
@@ -703,38 +1709,49 @@ def label_create():
       A dictionary containing the new label.
 
     """
-    request_arguments = request.get_json()
+    request_arguments = get_request_body()
     label_text = request_arguments.get('label_text')
 
     if not label_text:
         abort(400)
 
-    return jsonify({
-        'label': blogger_engine.GetOrInsertLabel(label_text).ToJson()
+    return jsonify_models({
+        'label': blogger_engine.GetOrInsertLabel(label_text)
     })
 
 
 @app.route('/label/get_all', methods=['GET', 'POST'])
+@conditional('Label')
 def label_get_all():
     """Gets all labels from the datastore.
 
+    Request Args:
+      limit: int; Return at most this many results, and a next_cursor.
+      cursor: string; The next_cursor of the previous page.
+      stream: string; 'json' or 'ndjson' to stream every result.
+
     Returns:
       A dictionary containing the labels.
 
     """
-    labels = blogger_engine.GetAllLabels()
-    if labels:
-        return jsonify({
-            'labels': [label.ToJson() for label in labels]
-        })
+    request_arguments = get_request_body(silent=True)
+    stream_format = get_stream_format(request_arguments)
+    if stream_format:
+        snapshot = blogger_engine.GetSnapshot('Label')['Label']
+        return stream_response('labels', snapshot.Iterate(),
+                               stream_format)
 
-    return jsonify({
-        'labels': []
-    })
+    limit, cursor = get_page_arguments(request_arguments)
+    labels = blogger_engine.GetAllLabels(limit, cursor)
+    return jsonify_models(add_next_cursor({
+        'labels': labels
+    }, labels))
 
 
 @app.route('/label/get_by_id', methods=['POST'])
-def label_get_by_id():
+@app.route('/labels/<label_text>', methods=['GET'])
+@conditional('Label')
+def label_get_by_id(label_text=None):
     """Gets a label by it's ID, which is also it's text.
 
     Request Args:
@@ -744,20 +1761,37 @@ def label_get_by_id():
       A dictionary containing the label, if found.
 
     """
-    request_arguments = request.get_json()
+    request_arguments = get_read_arguments(label_text=label_text)
     label_text = request_arguments.get('label_text')
 
     if not label_text:
         abort(400)
 
-    label = blogger_engine.GetLabel(label_text)
-    if label:
-        label_json = label.ToJson()
-    else:
-        label_json = None
+    return jsonify_models({
+        'label': blogger_engine.GetLabel(label_text)
+    })
 
-    return jsonify({
-        'label': label_json
+
+@app.route('/label/get_by_ids', methods=['GET', 'POST'])
+@conditional('Label')
+def label_get_by_ids():
+    """Gets several labels by their label text at once.
+
+    Request Args:
+      label_texts: list; The label texts, or in a query string a comma
+        separated string.
+
+    Returns:
+      A dictionary of the labels, in the order of the label texts, with
+      null for each label not found.
+
+    """
+    label_texts = get_names_argument('label_texts')
+    if label_texts is None:
+        abort(400)
+
+    return jsonify_models({
+        'labels': blogger_engine.GetLabelsByText(label_texts)
     })
 
 
@@ -792,6 +1826,7 @@ def label_remove_from_blogpost():
 
 
 @app.route('/label/get_all_blogposts_with_label', methods=['POST'])
+@conditional('Blogpost', 'Label')
 def label_get_all_blogposts_with_label():
     """Gets all blogposts associated with a given label.
 
@@ -816,7 +1851,7 @@ def label_delete():
       A dictionary containing the deleted label and affected blogposts.
 
     """
-    request_arguments = request.get_json()
+    request_arguments = get_request_body()
     label_text = request_arguments.get('label_text')
 
     if not label_text:
@@ -825,21 +1860,248 @@ def label_delete():
     blogposts = blogger_engine.GetBlogpostsByLabel(label_text)
     deleted_label = blogger_engine.DeleteLabel(label_text)
     if deleted_label:
-        if blogposts:
-            return jsonify({
-                'deleted_label': deleted_label.ToJson(),
-                'blogposts': [blogpost.ToJson() for blogpost in blogposts]
-            })
-        else:
-            return jsonify({
-                'deleted_label': deleted_label.ToJson(),
-                'blogposts': []
-            })
+        return jsonify_models({
+            'deleted_label': deleted_label,
+            'blogposts': blogposts or []
+        })
 
-    return jsonify({
+    return jsonify_models({
         'deleted_label': None,
         'blogposts': []
     })
 
+"""Batch methods."""
+
+
+def resolve_references(value, results):
+    """Replaces references to earlier results in batch operation arguments.
+
+    A reference is a dictionary holding only '$ref', a dotted path into
+    the result of an earlier operation, starting with its index, e.g.
+    {'$ref': '0.blogpost.id'} for the id of the blogpost created by the
+    first operation.
+
+    Args:
+      value: object; The arguments, or a value within them.
+      results: list; The results of the operations run so far.
+
+    Returns:
+      The value with its references replaced.
+
+    Raises:
+      ValueError: If a reference does not point into a successful result.
+
+    """
+    if isinstance(value, list):
+        return [resolve_references(item, results) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if list(value) != ['$ref']:
+        return dict((key, resolve_references(item, results))
+                    for key, item in value.items())
+
+    path = str(value['$ref']).split('.')
+    try:
+        result = results[int(path[0])]
+    except (IndexError, ValueError):
+        raise ValueError('Invalid reference: %s' % value['$ref'])
+    if result['status'] != 200:
+        raise ValueError('Reference to a failed operation: %s' %
+                         value['$ref'])
+
+    resolved = result['body']
+    for name in path[1:]:
+        if not isinstance(resolved, dict) or name not in resolved:
+            raise ValueError('Invalid reference: %s' % value['$ref'])
+        resolved = resolved[name]
+    return resolved
+
+
+def run_operation(operation, results, data_format):
+    """Runs one batch operation through the route it names.
+
+    The route runs in a request of its own, as if the operation's
+    arguments had been POSTed to it.
+
+    Args:
+      operation: dict; The operation, with its route and arguments.
+      results: list; The results of the operations run so far.
+      data_format: formats.Format; The format to run the route in.
+
+    Returns:
+      A dictionary of the response's status and decoded body, None
+      unless the status is 200.
+
+    """
+    route = operation.get('route')
+    try:
+        arguments = resolve_references(operation.get('arguments', {}),
+                                       results)
+        if (not isinstance(route, STRING_TYPES) or
+                not isinstance(arguments, dict)):
+            abort(400)
+        endpoint, view_args = app.url_map.bind('').match(route, 'POST')
+        if endpoint == 'batch' or endpoint.startswith('admin_'):
+            abort(400)
+
+        mimetype = data_format.mimetypes[0]
+        with app.app_context(), app.test_request_context(
+                route, method='POST', data=data_format.Encode(arguments),
+                content_type=mimetype, headers={'Accept': mimetype}):
+            # Read routes skip the response cache, which could otherwise
+            # wait on requests blocked by the batch's locks.
+            g.conditional = True
+            response = app.make_response(
+                app.view_functions[endpoint](**view_args))
+    except ValueError:
+        return {'status': 400, 'body': None}
+    except HTTPException as error:
+        return {'status': error.code, 'body': None}
+
+    if response.status_code != 200:
+        return {'status': response.status_code, 'body': None}
+    return {'status': 200,
+            'body': data_format.Decode(response.get_data())}
+
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    """Runs several operations, in order, holding the engine's locks once.
+
+    Each operation names a route, which must accept POST, and its
+    arguments, in which earlier results can be referenced as described in
+    resolve_references(). Operations run until the last, whether or not
+    earlier ones failed, and are not rolled back.
+
+    Request Args:
+      operations: list; Dictionaries of a route, e.g. '/blogpost/create',
+        and its arguments.
+
+    Returns:
+      A dictionary of results, holding the status and body of the
+      response to each operation.
+
+    """
+    request_arguments = get_request_body()
+    operations = (isinstance(request_arguments, dict) and
+                  request_arguments.get('operations'))
+    if (not isinstance(operations, list) or
+            not all(isinstance(operation, dict)
+                    for operation in operations)):
+        abort(400)
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        abort(413)
+
+    data_format = get_response_format()
+    results = []
+    with blogger_engine.Writing():
+        for operation in operations:
+            results.append(run_operation(operation, results, data_format))
+
+    return jsonify_models({'results': results})
+
+"""Admin methods."""
+
+
+@app.route('/admin/snapshot', methods=['GET', 'POST'])
+def admin_snapshot():
+    """Reports on, or with POST starts, a background snapshot.
+
+    Returns:
+      A dictionary containing the snapshot status, including progress,
+      duration and copy-on-write memory growth of the snapshot process.
+
+    """
+    if background_snapshotter is None:
+        abort(404)
+
+    started = False
+    if request.method == 'POST':
+        started = background_snapshotter.Start()
+
+    return jsonify({
+        'started': started,
+        'snapshot': background_snapshotter.GetStatus()
+    })
+
+
+@app.route('/admin/compact_log', methods=['POST'])
+def admin_compact_log():
+    """Rewrites the operation log down to the live datastore.
+
+    Returns:
+      A dictionary containing the log size before and after, in bytes.
+
+    """
+    result = blogger_engine.CompactOperationLog()
+    if result is None:
+        abort(404)
+
+    return jsonify({
+        'bytes_before': result[0],
+        'bytes_after': result[1]
+    })
+
+
+@app.route('/admin/json_cache', methods=['GET'])
+def admin_json_cache():
+    """Reports how often serialized models were reused from the cache.
+
+    Returns:
+      A dictionary of hits, misses and hit rate for each model kind.
+
+    """
+    return jsonify({
+        'json_cache': blogger_engine.GetJsonCacheStats()
+    })
+
+
+@app.route('/admin/compression_cache', methods=['GET'])
+def admin_compression_cache():
+    """Reports how often compressed responses were reused from the cache.
+
+    Returns:
+      A dictionary of hits, misses, hit rate, entries and bytes kept.
+
+    """
+    return jsonify({
+        'compression_cache': compression_cache.GetStats()
+    })
+
+
+@app.route('/admin/response_cache', methods=['GET'])
+def admin_response_cache():
+    """Reports how often read responses were served from the cache.
+
+    Returns:
+      A dictionary of hits, misses, hit rate, evictions, invalidations,
+      entries and bytes kept.
+
+    """
+    return jsonify({
+        'response_cache': response_cache.GetStats()
+    })
+
+
+@app.route('/admin/single_flight', methods=['GET'])
+def admin_single_flight():
+    """Reports how many read requests waited for an identical one.
+
+    Returns:
+      A dictionary of the route runs, coalesced requests and their rate,
+      and the runs in flight and requests waiting on them.
+
+    """
+    return jsonify({
+        'single_flight': single_flight.GetStats()
+    })
+
 if __name__ == '__main__':
+    if SQLITE_PATH:
+        blogger_engine.OpenSqliteStorage(SQLITE_PATH)
+    elif OPLOG_PATH:
+        blogger_engine.OpenOperationLog(OPLOG_PATH, OPLOG_DURABILITY,
+                                        OPLOG_GROUP_COMMIT_MS, SNAPSHOT_PATH)
+    if background_snapshotter is not None:
+        background_snapshotter.StartScheduler()
     app.run()
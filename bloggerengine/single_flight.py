@@ -0,0 +1,95 @@
+#!/usr/bin/python
+
+import threading
+
+
+class Call_(object):
+
+    """A call in flight, and the result its waiting callers share."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+        self.waiting = 0
+
+
+class SingleFlight(object):
+
+    """Coalesces identical calls made while one of them is in flight.
+
+    The first caller of Do() for a key runs the function; callers for the
+    same key arriving before it returns wait for it and share its result,
+    instead of computing it again.
+
+    Attributes:
+      calls: int; How many times a function was run.
+      coalesced: int; How many callers shared a result instead.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def Do(self, key, function):
+        """Runs a function, or waits for an identical call in flight.
+
+        If the running call raises, the callers waiting on it each run the
+        function themselves.
+
+        Args:
+          key: hashable; Identifies calls returning the same result.
+          function: callable; Computes the result, with no arguments.
+
+        Returns:
+          A (result, shared) tuple, shared being True if the result was
+          computed by another caller.
+
+        """
+        with self.lock:
+            call = self.in_flight.get(key)
+            if call is None:
+                call = self.in_flight[key] = Call_()
+                self.calls += 1
+                leader = True
+            else:
+                call.waiting += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if not call.failed:
+                with self.lock:
+                    self.coalesced += 1
+                return call.result, True
+            with self.lock:
+                self.calls += 1
+            return function(), False
+
+        try:
+            call.result = function()
+        except BaseException:
+            call.failed = True
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+            call.done.set()
+        return call.result, False
+
+    def GetStats(self):
+        """Gets the counts of calls run, coalesced, in flight and waiting."""
+        with self.lock:
+            requests = self.calls + self.coalesced
+            return {
+                'calls': self.calls,
+                'coalesced': self.coalesced,
+                'coalesced_rate': (float(self.coalesced) / requests
+                                   if requests else None),
+                'in_flight': len(self.in_flight),
+                'waiting': sum(call.waiting
+                               for call in self.in_flight.values()),
+            }
@@ -0,0 +1,417 @@
+#!/usr/bin/python
+
+import array
+import datetime
+import gc
+import json
+import os
+import struct
+import sys
+import zlib
+from bloggerengine import base_model
+from bloggerengine import storage
+from collections import OrderedDict
+
+MAGIC = b'BESNAP01'
+
+# Magic bytes, the log generation and offset covered, and the kind count.
+FILE_HEADER = struct.Struct('<8sQQI')
+
+# CRC32 of everything before it.
+FILE_TRAILER = struct.Struct('<I')
+
+COUNT = struct.Struct('<I')
+
+BLOB_LENGTH = struct.Struct('<Q')
+
+# Marks a None value in a string column.
+NULL_LENGTH = 0xffffffff
+
+# Set in a string column length when the value is not a string, but JSON
+# encoding one, such as a number posted as a blogpost headline.
+JSON_FLAG = 0x80000000
+
+STRING_TYPES = (str, type(u''))
+
+
+class SnapshotWriter(object):
+
+    def __init__(self, model_classes, progress=None):
+        """Constructor.
+
+        Args:
+          model_classes: dict; Maps model class names to model classes.
+          progress: callable; Called with (objects written, total objects)
+            after each kind is written.
+
+        """
+        self.model_classes = model_classes
+        self.progress = progress
+
+    def Write(self, path, log_generation=0, log_offset=0):
+        """Writes a snapshot of the whole datastore.
+
+        The snapshot is written to a temporary file and renamed into place, so
+        a crash never leaves a partial snapshot at path.
+
+        Args:
+          path: string; The path of the snapshot file.
+          log_generation: int; The generation of the operation log covered.
+          log_offset: int; The operation log offset covered.
+
+        Returns:
+          The number of objects written.
+
+        """
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self.Write_(path, log_generation, log_offset)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def Write_(self, path, log_generation, log_offset):
+        """Writes the snapshot with the cyclic collector disabled."""
+        collected = CollectObjects(self.model_classes)
+
+        indexes = {}
+        for objects, unused_stored_count in collected.values():
+            for instance in objects:
+                indexes[id(instance)] = len(indexes)
+
+        total = len(indexes)
+        written = 0
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as snapshot_file:
+            writer = ChecksummedWriter(snapshot_file)
+            writer.write(FILE_HEADER.pack(MAGIC, log_generation, log_offset,
+                                          len(collected)))
+
+            for kind, (objects, stored_count) in collected.items():
+                self.WriteKind_(writer, kind, objects, stored_count, indexes)
+                written += len(objects)
+                if self.progress:
+                    self.progress(written, total)
+
+            snapshot_file.write(FILE_TRAILER.pack(writer.checksum))
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+
+        os.rename(temporary_path, path)
+        return total
+
+    def WriteKind_(self, writer, kind, objects, stored_count, indexes):
+        """Writes the columns for every object of one kind."""
+        model_class = self.model_classes[kind]
+
+        WriteString(writer, kind)
+        writer.write(COUNT.pack(len(objects)))
+        writer.write(COUNT.pack(stored_count))
+
+        WriteStringColumn(writer, [instance.id for instance in objects])
+        to_microseconds = base_model.TimestampToMicroseconds
+        WriteInt64Column(writer, [to_microseconds(instance.created_timestamp)
+                                  for instance in objects])
+
+        for field in model_class.persisted_fields:
+            WriteStringColumn(writer, [getattr(instance, field)
+                                       for instance in objects])
+
+        for field in model_class.persisted_references:
+            WriteArray(writer, array.array(
+                'I', [indexes[id(getattr(instance, field))]
+                      for instance in objects]))
+
+        for field in model_class.relation_fields:
+            relations = [getattr(instance, field) for instance in objects]
+            WriteArray(writer, array.array(
+                'I', [len(relation) for relation in relations]))
+            WriteArray(writer, array.array(
+                'I', [indexes[id(related)]
+                      for relation in relations
+                      for related in relation.values()]))
+
+
+def CollectObjects(model_classes):
+    """Gathers every stored object, plus any only reachable through others.
+
+    Removed blogposts, for example, are deleted from the datastore but still
+    referenced from their author's removed_blogposts.
+
+    Args:
+      model_classes: dict; Maps model class names to model classes.
+
+    Returns:
+      An OrderedDict mapping each kind to a (objects, stored count) pair,
+      where the stored objects come first and in datastore order.
+
+    """
+    kinds = sorted(model_classes)
+    objects = OrderedDict()
+    seen = set()
+    for kind in kinds:
+        stored = model_classes[kind].GetAll()
+        objects[kind] = stored
+        seen.update(id(instance) for instance in stored)
+
+    stored_counts = dict((kind, len(objects[kind])) for kind in kinds)
+    pending = [instance for kind in kinds for instance in objects[kind]]
+    while pending:
+        instance = pending.pop()
+        related = [getattr(instance, field)
+                   for field in instance.persisted_references]
+        for field in instance.relation_fields:
+            related.extend(getattr(instance, field).values())
+
+        for other in related:
+            if id(other) not in seen:
+                seen.add(id(other))
+                objects[other.__class__.__name__].append(other)
+                pending.append(other)
+
+    return OrderedDict((kind, (objects[kind], stored_counts[kind]))
+                       for kind in kinds)
+
+
+def LoadSnapshot(path, model_classes):
+    """Rebuilds the datastore from a snapshot.
+
+    Args:
+      path: string; The path of the snapshot file.
+      model_classes: dict; Maps model class names to model classes.
+
+    Returns:
+      A (registry, log generation, log offset) tuple, where the registry
+      holds every restored object keyed by (kind, id), as used by
+      oplog.ApplyRecord.
+
+    """
+    with open(path, 'rb') as snapshot_file:
+        data = snapshot_file.read()
+
+    if len(data) < FILE_HEADER.size + FILE_TRAILER.size:
+        raise ValueError('Truncated snapshot: %s' % path)
+
+    body = data[:-FILE_TRAILER.size]
+    checksum, = FILE_TRAILER.unpack(data[-FILE_TRAILER.size:])
+    if zlib.crc32(body) & 0xffffffff != checksum:
+        raise ValueError('Corrupt snapshot: %s' % path)
+
+    magic, log_generation, log_offset, kind_count = FILE_HEADER.unpack_from(
+        body)
+    if magic != MAGIC:
+        raise ValueError('Not a snapshot: %s' % path)
+
+    # Building millions of objects with the cyclic collector running makes it
+    # rescan the young heap over and over; nothing here is garbage anyway.
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        registry = LoadObjects_(Reader(body, FILE_HEADER.size), kind_count,
+                                model_classes)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    return registry, log_generation, log_offset
+
+
+def LoadObjects_(reader, kind_count, model_classes):
+    """Builds every object in a snapshot and links them together.
+
+    Args:
+      reader: Reader; Positioned just past the file header.
+      kind_count: int; The number of kinds in the snapshot.
+      model_classes: dict; Maps model class names to model classes.
+
+    Returns:
+      Every restored object keyed by (kind, id).
+
+    """
+    objects = []
+    pending_links = []
+    for unused_kind in range(kind_count):
+        kind = ReadString(reader)
+        model_class = model_classes[kind]
+        count, = reader.Unpack(COUNT)
+        stored_count, = reader.Unpack(COUNT)
+
+        ids = ReadStringColumn(reader, count)
+        timestamps = ReadInt64Column(reader, count)
+        fields = [(field, ReadStringColumn(reader, count))
+                  for field in model_class.persisted_fields]
+        references = [(field, ReadArray(reader, 'I', count))
+                      for field in model_class.persisted_references]
+        relations = []
+        for field in model_class.relation_fields:
+            counts = ReadArray(reader, 'I', count)
+            targets = ReadArray(reader, 'I', sum(counts))
+            relations.append((field, counts, targets))
+
+        start = len(objects)
+        new = model_class.__new__
+        epoch = base_model.EPOCH
+        timedelta = datetime.timedelta
+        field_names = [field for field, unused_values in fields]
+        field_rows = ([()] * count if not fields else
+                      zip(*[values for unused_field, values in fields]))
+        for instance_id, timestamp, row in zip(ids, timestamps, field_rows):
+            instance = new(model_class)
+            attributes = instance.__dict__
+            attributes['id'] = instance_id
+            attributes['created_timestamp'] = epoch + timedelta(
+                microseconds=timestamp)
+            attributes.update(zip(field_names, row))
+            objects.append(instance)
+
+        pending_links.append((model_class, start, count, stored_count,
+                              references, relations))
+
+    storage_keys = [instance.GetStorageKey_() for instance in objects]
+    for (model_class, start, count, stored_count, references,
+         relations) in pending_links:
+        kind_objects = objects[start:start + count]
+        for field, targets in references:
+            for instance, target in zip(kind_objects, targets):
+                instance.__dict__[field] = objects[target]
+
+        for field, counts, targets in relations:
+            position = 0
+            for instance, relation_count in zip(kind_objects, counts):
+                relation = storage.VersionedCollection(
+                    (storage_keys[target], objects[target])
+                    for target in targets[position:position + relation_count])
+                position += relation_count
+                instance.__dict__[field] = relation
+
+        model_class.instances[model_class.__name__] = (
+            storage.VersionedCollection(zip(
+                storage_keys[start:start + stored_count],
+                kind_objects[:stored_count])))
+
+    return dict(((instance.__class__.__name__, instance.id), instance)
+                for instance in objects)
+
+
+class ChecksummedWriter(object):
+
+    def __init__(self, output_file):
+        """Wraps a file, keeping a running CRC32 of everything written."""
+        self.output_file = output_file
+        self.checksum = 0
+
+    def write(self, data):
+        self.checksum = zlib.crc32(data, self.checksum) & 0xffffffff
+        self.output_file.write(data)
+
+
+class Reader(object):
+
+    def __init__(self, data, offset=0):
+        """A cursor over an in-memory snapshot."""
+        self.data = data
+        self.offset = offset
+
+    def Unpack(self, struct_format):
+        values = struct_format.unpack_from(self.data, self.offset)
+        self.offset += struct_format.size
+        return values
+
+    def Read(self, size):
+        chunk = self.data[self.offset:self.offset + size]
+        if len(chunk) != size:
+            raise ValueError('Truncated snapshot')
+        self.offset += size
+        return chunk
+
+
+def WriteArray(writer, values):
+    """Writes an array, always little-endian."""
+    if sys.byteorder == 'big':
+        values.byteswap()
+    writer.write(values.tostring() if sys.version_info[0] == 2
+                 else values.tobytes())
+
+
+def ReadArray(reader, typecode, count):
+    """Reads an array written by WriteArray."""
+    values = array.array(typecode)
+    chunk = reader.Read(values.itemsize * count)
+    if sys.version_info[0] == 2:
+        values.fromstring(chunk)
+    else:
+        values.frombytes(chunk)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def WriteInt64Column(writer, values):
+    """Writes signed 64-bit integers, always little-endian.
+
+    Python 2.7 arrays have no 64-bit typecode, so these go through struct.
+
+    """
+    writer.write(struct.pack('<%dq' % len(values), *values))
+
+
+def ReadInt64Column(reader, count):
+    """Reads a column written by WriteInt64Column."""
+    return struct.unpack('<%dq' % count, reader.Read(8 * count))
+
+
+def WriteString(writer, value):
+    encoded = value.encode('utf-8')
+    writer.write(COUNT.pack(len(encoded)) + encoded)
+
+
+def ReadString(reader):
+    length, = reader.Unpack(COUNT)
+    return reader.Read(length).decode('utf-8')
+
+
+def WriteStringColumn(writer, values):
+    """Writes strings as an array of lengths followed by one UTF-8 blob.
+
+    Lengths are in characters, so the blob can be decoded in one go. None is
+    stored as NULL_LENGTH, and any other value that is not a string as its
+    JSON encoding, with JSON_FLAG set in its length.
+
+    """
+    lengths = array.array('I')
+    parts = []
+    for value in values:
+        if value is None:
+            lengths.append(NULL_LENGTH)
+        elif isinstance(value, STRING_TYPES):
+            lengths.append(len(value))
+            parts.append(value)
+        else:
+            value = json.dumps(value, separators=(',', ':'))
+            lengths.append(len(value) | JSON_FLAG)
+            parts.append(value)
+    encoded = u''.join(parts).encode('utf-8')
+    WriteArray(writer, lengths)
+    writer.write(BLOB_LENGTH.pack(len(encoded)))
+    writer.write(encoded)
+
+
+def ReadStringColumn(reader, count):
+    """Reads a column written by WriteStringColumn."""
+    lengths = ReadArray(reader, 'I', count)
+    blob_length, = reader.Unpack(BLOB_LENGTH)
+    blob = reader.Read(blob_length).decode('utf-8')
+    values = []
+    position = 0
+    for length in lengths:
+        if length == NULL_LENGTH:
+            values.append(None)
+        elif length & JSON_FLAG:
+            length &= ~JSON_FLAG
+            values.append(json.loads(blob[position:position + length]))
+            position += length
+        else:
+            values.append(blob[position:position + length])
+            position += length
+    return values
@@ -0,0 +1,976 @@
+#!/usr/bin/python
+
+import contextlib
+import itertools
+import sqlite3
+import threading
+import weakref
+from collections import OrderedDict
+
+from bloggerengine import persistent
+
+# Rebuild a collection's published version from scratch, rather than apply
+# each change, when more than 1 / REBUILD_RATIO of it has changed.
+REBUILD_RATIO = 8
+
+# The most parameters older SQLite versions accept in one statement.
+SQLITE_MAX_PARAMETERS = 999
+
+
+class StorageBackend(object):
+
+    """Interface for where BaseModel stores its instances.
+
+    Backends are handed the model class for every call, since each model
+    class may point at its own instances dictionary.
+
+    """
+
+    def Put(self, model_class, storage_key, instance):
+        """Stores an instance, unless one is already stored under the key.
+
+        Returns:
+          True if the instance was stored.
+
+        """
+        raise NotImplementedError
+
+    def Delete(self, model_class, storage_key, instance):
+        """Deletes a stored instance.
+
+        Returns:
+          True if the instance was deleted.
+
+        """
+        raise NotImplementedError
+
+    def Get(self, model_class, storage_key):
+        """Gets a stored instance.
+
+        Returns:
+          The instance, if found. Otherwise, None.
+
+        """
+        raise NotImplementedError
+
+    def GetMany(self, model_class, storage_keys):
+        """Gets stored instances by several storage keys.
+
+        Returns:
+          A list of the instances, in the order of the keys, with None for
+          each key not found.
+
+        """
+        return [self.Get(model_class, storage_key)
+                for storage_key in storage_keys]
+
+    def GetAll(self, model_class):
+        """Gets all stored instances, in the order they were stored.
+
+        Returns:
+          A list of instances.
+
+        """
+        raise NotImplementedError
+
+    def Snapshot(self, model_class):
+        """Gets an immutable, point-in-time view of the stored instances.
+
+        Backends without versioned storage copy every instance.
+
+        Returns:
+          A CollectionSnapshot.
+
+        """
+        return CollectionSnapshot.FromItems(
+            [(instance.GetStorageKey_(), instance)
+             for instance in self.GetAll(model_class)])
+
+    @contextlib.contextmanager
+    def Batching(self, atomic=False):
+        """Groups the writes this thread makes in a block, if it can.
+
+        Args:
+          atomic: bool; Whether to discard the block's writes, if it can,
+            when it raises.
+
+        """
+        yield
+
+    def Link(self, instance, field, key, target):
+        """Records that target was added to a relation dict of instance."""
+
+    def Unlink(self, instance, field, key):
+        """Records that key was removed from a relation dict of instance."""
+
+
+class MemoryBackend(StorageBackend):
+
+    """Keeps every instance in the model's instances OrderedDicts."""
+
+    def Put(self, model_class, storage_key, instance):
+        instances = model_class.instances[model_class.__name__]
+        if storage_key in instances:
+            return False
+
+        instances[storage_key] = instance
+        return True
+
+    def Delete(self, model_class, storage_key, instance):
+        instances = model_class.instances[model_class.__name__]
+        if storage_key not in instances:
+            return False
+
+        del instances[storage_key]
+        return True
+
+    def Get(self, model_class, storage_key):
+        return model_class.instances.get(model_class.__name__, {}).get(
+            storage_key, None)
+
+    def GetMany(self, model_class, storage_keys):
+        instances = model_class.instances.get(model_class.__name__, {})
+        return [instances.get(storage_key) for storage_key in storage_keys]
+
+    def GetAll(self, model_class):
+        return self.Snapshot(model_class).GetAll()
+
+    def Snapshot(self, model_class):
+        collection = model_class.instances.get(model_class.__name__)
+        if collection is None:
+            return EMPTY_SNAPSHOT
+        return collection.Snapshot()
+
+
+class VersionedCollection(OrderedDict):
+
+    """An OrderedDict that can hand out immutable snapshots of itself.
+
+    Snapshots are PersistentMaps from storage key to insertion sequence and
+    from sequence to instance, so a snapshot shares almost all of its
+    structure with the previous one and readers can use it without locks.
+    Mutations only note which keys changed; the next Snapshot() applies
+    them and atomically publishes the new version. Versions that no reader
+    references any more are freed like any other object.
+
+    Every relation dict is one too, so they are kept small: no instance
+    dict, locks shared from a pool, and no change tracking until the first
+    snapshot is asked for.
+
+    Inside an UndoLog, the contents are saved before the first mutation,
+    and until the log is committed other threads' snapshots show them.
+
+    """
+
+    __slots__ = ('lock', 'version', 'next_sequence', 'next_front_sequence',
+                 'changes', 'published', 'saved')
+
+    def __init__(self, items=()):
+        self.lock = COLLECTION_LOCKS[(id(self) >> 4) % len(COLLECTION_LOCKS)]
+        # Bumped on every mutation.
+        self.version = 0
+        self.next_sequence = 0
+        self.next_front_sequence = -1
+        # Maps keys changed since the last snapshot to their new sequence,
+        # None if only the value changed, or Deleted. None if no changes.
+        self.changes = None
+        # None until the first snapshot.
+        self.published = None
+        # The SavedContents_ of the current UndoLog, if any.
+        self.saved = None
+        OrderedDict.__init__(self)
+
+        # Nothing to track yet, so skip __setitem__.
+        if hasattr(items, 'items'):
+            items = items.items()
+        set_item = OrderedDict.__setitem__
+        for key, value in items:
+            set_item(self, key, value)
+        self.version = len(self)
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.SaveForUndo_(key)
+            if self.published is not None:
+                if self.changes is None:
+                    self.changes = {}
+                if OrderedDict.__contains__(self, key):
+                    self.changes.setdefault(key, None)
+                else:
+                    self.changes[key] = self.next_sequence
+                    self.next_sequence += 1
+            OrderedDict.__setitem__(self, key, value)
+            self.version += 1
+
+    def __delitem__(self, key):
+        with self.lock:
+            self.SaveForUndo_()
+            OrderedDict.__delitem__(self, key)
+            self.RecordChange_(key, Deleted)
+            self.version += 1
+
+    def pop(self, key, *default):
+        with self.lock:
+            if OrderedDict.__contains__(self, key):
+                value = OrderedDict.__getitem__(self, key)
+                del self[key]
+                return value
+            if default:
+                return default[0]
+            raise KeyError(key)
+
+    def popitem(self, last=True):
+        with self.lock:
+            if not len(self):
+                raise KeyError('dictionary is empty')
+            key = next(reversed(self)) if last else next(iter(self))
+            return key, self.pop(key)
+
+    def setdefault(self, key, default=None):
+        with self.lock:
+            if not OrderedDict.__contains__(self, key):
+                self[key] = default
+            return OrderedDict.__getitem__(self, key)
+
+    def clear(self):
+        with self.lock:
+            self.SaveForUndo_()
+            for key in self:
+                self.RecordChange_(key, Deleted)
+            OrderedDict.clear(self)
+            self.version += 1
+
+    def move_to_end(self, key, last=True):
+        with self.lock:
+            self.SaveForUndo_()
+            OrderedDict.move_to_end(self, key, last)
+            if last:
+                self.RecordChange_(key, self.next_sequence)
+                self.next_sequence += 1
+            else:
+                self.RecordChange_(key, self.next_front_sequence)
+                self.next_front_sequence -= 1
+            self.version += 1
+
+    def RecordChange_(self, key, sequence):
+        """Notes a change for the next snapshot, once snapshots are taken."""
+        if self.published is not None:
+            if self.changes is None:
+                self.changes = {}
+            self.changes[key] = sequence
+
+    def Snapshot(self):
+        """Publishes any changes and gets the current version.
+
+        Returns:
+          A CollectionSnapshot.
+
+        """
+        with self.lock:
+            saved = self.saved
+            if (saved is not None and
+                    saved.undo_log is not getattr(TRANSACTION, 'undo_log',
+                                                  None)):
+                if not isinstance(saved.before, CollectionSnapshot):
+                    saved.before = CollectionSnapshot.FromItems(saved.before)
+                return saved.before
+
+            if self.published is not None and not self.changes:
+                return self.published
+
+            if (self.published is None or
+                    len(self.changes) * REBUILD_RATIO > len(self)):
+                self.published = CollectionSnapshot.FromItems(
+                    list(OrderedDict.items(self)), self.version)
+                self.next_sequence = len(self)
+            else:
+                self.published = self.ApplyChanges_()
+            self.changes = None
+            return self.published
+
+    def ApplyChanges_(self):
+        """Applies the changes since the last snapshot to its maps."""
+        by_key = self.published.by_key
+        by_sequence = self.published.by_sequence
+        for key, sequence in self.changes.items():
+            old_sequence = by_key.Get(key)
+            if sequence is None:
+                sequence = old_sequence
+            elif old_sequence is not None:
+                by_sequence = by_sequence.Remove(old_sequence)
+
+            if sequence is Deleted:
+                by_key = by_key.Remove(key)
+            else:
+                by_key = by_key.Insert(key, sequence)
+                by_sequence = by_sequence.Insert(
+                    sequence, OrderedDict.__getitem__(self, key))
+        return CollectionSnapshot(self.version, by_key, by_sequence)
+
+    def SaveForUndo_(self, key=None):
+        """Saves the contents before the current UndoLog's first mutation.
+
+        Must hold the lock and be called before every mutation.
+
+        Args:
+          key: The key being set, if the mutation sets one.
+
+        """
+        undo_log = getattr(TRANSACTION, 'undo_log', None)
+        if undo_log is None:
+            return
+
+        saved = self.saved
+        if saved is None:
+            # Tracked collections save a snapshot, which costs only the
+            # changes since the last one; relation dicts are small enough
+            # to copy.
+            if self.published is not None:
+                before = self.Snapshot()
+            else:
+                before = list(OrderedDict.items(self))
+            saved = self.saved = SavedContents_(undo_log, before)
+            undo_log.collections.append(self)
+
+        if key is not None and not OrderedDict.__contains__(self, key):
+            saved.added.append(key)
+        else:
+            saved.rewritten = True
+
+    def Restore_(self):
+        """Restores the contents SaveForUndo_() saved."""
+        with self.lock:
+            saved, self.saved = self.saved, None
+            if not saved.rewritten:
+                # Only new keys were appended, so removing them is enough.
+                for key in reversed(saved.added):
+                    del self[key]
+                return
+
+            before = saved.before
+            if isinstance(before, CollectionSnapshot):
+                before = before.Items()
+            self.clear()
+            for key, value in before:
+                self[key] = value
+
+    def Forget_(self):
+        """Drops the contents SaveForUndo_() saved."""
+        with self.lock:
+            self.saved = None
+
+
+# Marks a key deleted since the last snapshot.
+Deleted = object()
+
+# Shared by all VersionedCollections, picked by id.
+COLLECTION_LOCKS = [threading.RLock() for unused_x in range(64)]
+
+
+@contextlib.contextmanager
+def LockingCollections():
+    """Holds every collection lock, so no collection is mid-change.
+
+    Each lock is only ever held by itself, so taking them all in order
+    cannot deadlock.
+
+    """
+    for lock in COLLECTION_LOCKS:
+        lock.acquire()
+    try:
+        yield
+    finally:
+        for lock in reversed(COLLECTION_LOCKS):
+            lock.release()
+
+
+class CollectionSnapshot(object):
+
+    """An immutable, point-in-time view of stored instances."""
+
+    def __init__(self, version, by_key, by_sequence):
+        """Constructor.
+
+        Args:
+          version: int; The collection version this is a view of.
+          by_key: PersistentMap; Maps storage keys to sequences.
+          by_sequence: PersistentMap; Maps sequences to instances, in the
+            order they were stored.
+
+        """
+        self.version = version
+        self.by_key = by_key
+        self.by_sequence = by_sequence
+        self.values = None
+
+    @classmethod
+    def FromItems(cls, items, version=0):
+        """Builds a snapshot.
+
+        Args:
+          items: list; (storage key, instance) pairs, in storage order.
+          version: int; The collection version this is a view of.
+
+        Returns:
+          A CollectionSnapshot.
+
+        """
+        keys = sorted((key, sequence)
+                      for sequence, (key, unused_value) in enumerate(items))
+        return cls(version,
+                   persistent.PersistentMap.FromSortedItems(
+                       [key for key, unused_sequence in keys],
+                       [sequence for unused_key, sequence in keys]),
+                   persistent.PersistentMap.FromSortedItems(
+                       list(range(len(items))),
+                       [value for unused_key, value in items]))
+
+    def __len__(self):
+        return len(self.by_sequence)
+
+    def __contains__(self, storage_key):
+        return storage_key in self.by_key
+
+    def Get(self, storage_key, default=None):
+        """Gets an instance by storage key, or default if not stored."""
+        sequence = self.by_key.Get(storage_key)
+        if sequence is None:
+            return default
+        return self.by_sequence.Get(sequence)
+
+    def GetRange(self, start=None, stop=None):
+        """Gets instances by storage key range, in storage key order.
+
+        Args:
+          start: The first storage key to include, if any.
+          stop: The storage key to stop before, if any.
+
+        Returns:
+          A list of instances.
+
+        """
+        instances = []
+        for storage_key, sequence in self.by_key.Items(start):
+            if stop is not None and storage_key >= stop:
+                break
+            instances.append(self.by_sequence.Get(sequence))
+        return instances
+
+    def GetAll(self):
+        """Gets all instances, in the order they were stored.
+
+        Returns:
+          A new list.
+
+        """
+        if self.values is None:
+            self.values = self.by_sequence.Values()
+        return list(self.values)
+
+    def Iterate(self):
+        """Iterates over all instances in the order they were stored.
+
+        Unlike GetAll(), this never builds a list of the whole collection.
+
+        """
+        if self.values is not None:
+            return iter(self.values)
+        return self.by_sequence.IterValues()
+
+    def Items(self):
+        """Gets all (storage key, instance) pairs, in storage order."""
+        keys = dict((sequence, key) for key, sequence in self.by_key.Items())
+        return [(keys[sequence], instance)
+                for sequence, instance in self.by_sequence.Items()]
+
+
+EMPTY_SNAPSHOT = CollectionSnapshot.FromItems([])
+
+# The UndoLog each thread is in, if any.
+TRANSACTION = threading.local()
+
+
+class UndoLog(object):
+
+    """Undoes the changes a thread makes to collections, on request.
+
+    While a log is begun, each VersionedCollection and LazyRelation the
+    thread changes saves its contents first, once, so Rollback() can put
+    them back. Until the log ends, other threads' snapshots of a changed
+    collection keep showing the saved contents.
+
+    """
+
+    def __init__(self):
+        # The collections with saved contents, in the order they changed.
+        self.collections = []
+
+    @classmethod
+    def Begin(cls):
+        """Starts logging this thread's changes.
+
+        Returns:
+          The new UndoLog.
+
+        """
+        undo_log = TRANSACTION.undo_log = cls()
+        return undo_log
+
+    def Commit(self):
+        """Keeps the changes, and stops logging."""
+        TRANSACTION.undo_log = None
+        for collection in self.collections:
+            collection.Forget_()
+
+    def Rollback(self):
+        """Restores every changed collection, and stops logging."""
+        TRANSACTION.undo_log = None
+        for collection in reversed(self.collections):
+            collection.Restore_()
+
+
+class SavedContents_(object):
+
+    """The contents of a collection before an UndoLog changed it."""
+
+    __slots__ = ('undo_log', 'before', 'added', 'rewritten')
+
+    def __init__(self, undo_log, before):
+        self.undo_log = undo_log
+        # A CollectionSnapshot, or a list of (key, value) pairs.
+        self.before = before
+        # Keys appended since, while rewritten is False.
+        self.added = []
+        # Whether anything but appending new keys was done since.
+        self.rewritten = False
+
+
+class SqliteBackend(StorageBackend):
+
+    """Keeps instances in SQLite, materializing them on demand.
+
+    Each model gets a table with a column per persisted field and reference,
+    and each relation dict gets a table of (owner, key, target) rows. Loaded
+    instances are tracked in a weak identity map, so they can be reclaimed
+    once nothing references them, and their relation dicts are only read
+    from the database when first used. This keeps memory use proportional
+    to what requests touch rather than to the whole dataset.
+
+    Every thread gets its own connection, closed when the thread exits.
+
+    """
+
+    def __init__(self, path, model_classes):
+        """Constructor.
+
+        Args:
+          path: string; The path of the SQLite database, created if missing.
+          model_classes: dict; Maps model class names to model classes.
+
+        """
+        self.path = path
+        self.model_classes = model_classes
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # Maps a weak reference to each thread's ThreadToken_ to its
+        # connection.
+        self.connections = {}
+
+        # Instances loaded from or stored to the database, by (kind, id).
+        self.identity_map = weakref.WeakValueDictionary()
+        # Instances linked to before being stored, e.g. a Blogpost is added
+        # to its author in its constructor before put() is called.
+        self.pending = {}
+
+        self.tables = dict((kind, ModelTable(model_class))
+                           for kind, model_class in model_classes.items())
+        self.put_sequences = {}
+
+        connection = self.Connection_()
+        for table in self.tables.values():
+            for statement in table.GetSchema():
+                connection.execute(statement)
+            last, = connection.execute(
+                'SELECT COALESCE(MAX(put_seq), 0) FROM %s' %
+                table.name).fetchone()
+            self.put_sequences[table.kind] = itertools.count(last + 1)
+
+    def Connection_(self):
+        """Gets this thread's connection, opening it if necessary."""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None,
+                                         check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            # Only the thread's local storage holds the token, so it dies,
+            # and the connection is closed, when the thread exits.
+            token = ThreadToken_()
+            self.local.connection = connection
+            self.local.token = token
+            with self.lock:
+                self.connections[
+                    weakref.ref(token, self.CloseThreadConnection_)] = (
+                        connection)
+        return connection
+
+    def CloseThreadConnection_(self, token_reference):
+        """Closes the connection of a thread that exited."""
+        # Called from whatever thread frees the token, which may hold the
+        # lock already; popping from a dict is atomic anyway.
+        connection = self.connections.pop(token_reference, None)
+        if connection is not None:
+            connection.close()
+
+    def Close(self):
+        """Closes every thread's connection."""
+        with self.lock:
+            connections = self.connections
+            self.connections = {}
+        for connection in connections.values():
+            connection.close()
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def Batching(self, atomic=False):
+        """Makes the writes of a block one transaction, committed at its end.
+
+        Unless atomic, the transaction is committed even if the block
+        raises, since the instances in memory keep whatever changes were
+        made.
+
+        """
+        connection = self.Connection_()
+        if connection.in_transaction:
+            yield
+            return
+
+        connection.execute('BEGIN')
+        try:
+            yield
+        except BaseException:
+            connection.execute('ROLLBACK' if atomic else 'COMMIT')
+            raise
+        connection.execute('COMMIT')
+
+    def Put(self, model_class, storage_key, instance):
+        table = self.tables[model_class.__name__]
+        connection = self.Connection_()
+        if connection.execute(
+                'SELECT 1 FROM %s WHERE storage_key = ? AND stored = 1' %
+                table.name, (storage_key,)).fetchone():
+            return False
+
+        state = instance.GetState_()
+        values = [instance.id, storage_key, 1,
+                  next(self.put_sequences[table.kind]),
+                  state['created_timestamp']]
+        values.extend(state[field] for field in table.fields)
+        for field in table.references:
+            values.extend(state[field])
+
+        connection.execute(table.insert, values)
+        self.Remember_(instance)
+        return True
+
+    def Delete(self, model_class, storage_key, instance):
+        table = self.tables[model_class.__name__]
+        cursor = self.Connection_().execute(
+            'UPDATE %s SET stored = 0 WHERE storage_key = ? AND stored = 1' %
+            table.name, (storage_key,))
+        return cursor.rowcount > 0
+
+    def Get(self, model_class, storage_key):
+        table = self.tables[model_class.__name__]
+        row = self.Connection_().execute(
+            'SELECT * FROM %s WHERE storage_key = ? AND stored = 1' %
+            table.name, (storage_key,)).fetchone()
+        if row is None:
+            return None
+        return self.Materialize_(table, row)
+
+    def GetMany(self, model_class, storage_keys):
+        table = self.tables[model_class.__name__]
+        connection = self.Connection_()
+        distinct_keys = list(OrderedDict.fromkeys(storage_keys))
+        found = {}
+        for start in range(0, len(distinct_keys), SQLITE_MAX_PARAMETERS):
+            chunk = distinct_keys[start:start + SQLITE_MAX_PARAMETERS]
+            rows = connection.execute(
+                'SELECT * FROM %s WHERE stored = 1 AND storage_key IN (%s)' %
+                (table.name, ', '.join('?' * len(chunk))), chunk)
+            for row in rows:
+                found[row['storage_key']] = self.Materialize_(table, row)
+        return [found.get(storage_key) for storage_key in storage_keys]
+
+    def GetAll(self, model_class):
+        table = self.tables[model_class.__name__]
+        rows = self.Connection_().execute(
+            'SELECT * FROM %s WHERE stored = 1 ORDER BY put_seq' % table.name)
+        return [self.Materialize_(table, row) for row in rows]
+
+    def Link(self, instance, field, key, target):
+        table = self.tables[instance.__class__.__name__]
+        self.Connection_().execute(
+            'INSERT OR REPLACE INTO %s (owner_id, key, target_kind, target_id)'
+            ' VALUES (?, ?, ?, ?)' % table.relations[field],
+            (instance.id, key, target.__class__.__name__, target.id))
+
+        for model in (instance, target):
+            identity = (model.__class__.__name__, model.id)
+            if identity not in self.identity_map:
+                self.pending[identity] = model
+
+    def Unlink(self, instance, field, key):
+        table = self.tables[instance.__class__.__name__]
+        self.Connection_().execute(
+            'DELETE FROM %s WHERE owner_id = ? AND key = ?' %
+            table.relations[field], (instance.id, key))
+
+    def Remember_(self, instance):
+        """Adds a stored instance to the identity map."""
+        identity = (instance.__class__.__name__, instance.id)
+        self.identity_map[identity] = instance
+        self.pending.pop(identity, None)
+
+    def Resolve_(self, kind, model_id):
+        """Gets an instance by kind and id, loading it if necessary.
+
+        Returns:
+          The instance, or None if it was never stored.
+
+        """
+        identity = (kind, model_id)
+        instance = self.identity_map.get(identity)
+        if instance is None:
+            instance = self.pending.get(identity)
+        if instance is not None:
+            return instance
+
+        table = self.tables[kind]
+        row = self.Connection_().execute(
+            'SELECT * FROM %s WHERE id = ?' % table.name,
+            (model_id,)).fetchone()
+        if row is None:
+            return None
+        return self.Materialize_(table, row)
+
+    def Materialize_(self, table, row):
+        """Builds an instance from its row, or reuses the loaded one.
+
+        References are resolved right away, relation dicts lazily.
+
+        """
+        identity = (table.kind, row['id'])
+        instance = self.identity_map.get(identity)
+        if instance is not None:
+            return instance
+
+        instance = table.model_class.CreateEmpty_(row['id'])
+        for field in table.model_class.relation_fields:
+            setattr(instance, field, LazyRelation(
+                self.RelationLoader_(table, row['id'], field)))
+        self.identity_map[identity] = instance
+
+        state = {'created_timestamp': row['created_timestamp'],
+                 'storage_key': row['storage_key']}
+        for field in table.fields:
+            state[field] = row[field]
+        for field in table.references:
+            state[field] = [row[field + '_kind'], row[field + '_id']]
+        instance.SetState_(state, self.Resolve_)
+        return instance
+
+    def RelationLoader_(self, table, owner_id, field):
+        """Makes a callable that reads one relation dict from the database."""
+        def Load():
+            rows = self.Connection_().execute(
+                'SELECT key, target_kind, target_id FROM %s'
+                ' WHERE owner_id = ? ORDER BY seq' % table.relations[field],
+                (owner_id,)).fetchall()
+            for row in rows:
+                target = self.Resolve_(row['target_kind'], row['target_id'])
+                if target is not None:
+                    yield row['key'], target
+        return Load
+
+
+class ThreadToken_(object):
+
+    """Stands for a thread in SqliteBackend.connections, dying with it."""
+
+    __slots__ = ('__weakref__',)
+
+
+class ModelTable(object):
+
+    def __init__(self, model_class):
+        """Describes the SQLite tables for one model class.
+
+        Args:
+          model_class: class; The model class.
+
+        """
+        self.model_class = model_class
+        self.kind = model_class.__name__
+        self.name = self.kind.lower() + 's'
+        self.fields = [field for field in model_class.persisted_fields
+                       if field != 'storage_key']
+        self.references = list(model_class.persisted_references)
+        self.relations = dict((field, '%s_%s' % (self.kind.lower(), field))
+                              for field in model_class.relation_fields)
+
+        columns = ['id', 'storage_key', 'stored', 'put_seq',
+                   'created_timestamp'] + self.fields
+        for field in self.references:
+            columns.extend([field + '_kind', field + '_id'])
+        self.insert = 'INSERT OR REPLACE INTO %s (%s) VALUES (%s)' % (
+            self.name, ', '.join(columns), ', '.join('?' * len(columns)))
+
+    def GetSchema(self):
+        """Gets the statements that create the tables and their indexes.
+
+        Returns:
+          A list of SQL statements.
+
+        """
+        columns = ['seq INTEGER PRIMARY KEY AUTOINCREMENT',
+                   'id TEXT NOT NULL UNIQUE',
+                   'storage_key TEXT NOT NULL',
+                   'stored INTEGER NOT NULL',
+                   'put_seq INTEGER NOT NULL',
+                   'created_timestamp INTEGER NOT NULL']
+        columns.extend('%s TEXT' % field for field in self.fields)
+        for field in self.references:
+            columns.extend(['%s_kind TEXT NOT NULL' % field,
+                            '%s_id TEXT NOT NULL' % field])
+
+        statements = [
+            'CREATE TABLE IF NOT EXISTS %s (%s)' % (self.name,
+                                                    ', '.join(columns)),
+            'CREATE INDEX IF NOT EXISTS %s_storage_key ON %s '
+            '(storage_key, stored)' % (self.name, self.name),
+            'CREATE INDEX IF NOT EXISTS %s_put_seq ON %s (stored, put_seq)' %
+            (self.name, self.name)
+        ]
+        for field in self.references:
+            statements.append(
+                'CREATE INDEX IF NOT EXISTS %s_%s_id ON %s (%s_id)' %
+                (self.name, field, self.name, field))
+
+        for relation in self.relations.values():
+            statements.extend([
+                'CREATE TABLE IF NOT EXISTS %s ('
+                'seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'owner_id TEXT NOT NULL, '
+                'key TEXT NOT NULL, '
+                'target_kind TEXT NOT NULL, '
+                'target_id TEXT NOT NULL, '
+                'UNIQUE (owner_id, key))' % relation,
+                'CREATE INDEX IF NOT EXISTS %s_owner ON %s (owner_id, seq)' %
+                (relation, relation),
+                'CREATE INDEX IF NOT EXISTS %s_target ON %s (target_id)' %
+                (relation, relation)
+            ])
+        return statements
+
+
+class LazyRelation(OrderedDict):
+
+    """A relation OrderedDict that reads its contents on first use."""
+
+    def __init__(self, loader):
+        OrderedDict.__init__(self)
+        self.loader = loader
+        self.loaded = False
+        # The contents before the current UndoLog changed them, if any.
+        self.saved = None
+
+    def Load_(self):
+        if not self.loaded:
+            self.loaded = True
+            for key, target in self.loader():
+                OrderedDict.__setitem__(self, key, target)
+
+    def __getitem__(self, key):
+        self.Load_()
+        return OrderedDict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        self.Load_()
+        self.SaveForUndo_()
+        OrderedDict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.Load_()
+        self.SaveForUndo_()
+        OrderedDict.__delitem__(self, key)
+
+    def __contains__(self, key):
+        self.Load_()
+        return OrderedDict.__contains__(self, key)
+
+    def __iter__(self):
+        self.Load_()
+        return OrderedDict.__iter__(self)
+
+    def __reversed__(self):
+        self.Load_()
+        return OrderedDict.__reversed__(self)
+
+    def __len__(self):
+        self.Load_()
+        return OrderedDict.__len__(self)
+
+    def __eq__(self, other):
+        self.Load_()
+        return OrderedDict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        self.Load_()
+        return OrderedDict.__repr__(self)
+
+    def get(self, key, default=None):
+        self.Load_()
+        return OrderedDict.get(self, key, default)
+
+    def pop(self, key, *default):
+        self.Load_()
+        self.SaveForUndo_()
+        return OrderedDict.pop(self, key, *default)
+
+    def keys(self):
+        self.Load_()
+        return OrderedDict.keys(self)
+
+    def values(self):
+        self.Load_()
+        return OrderedDict.values(self)
+
+    def items(self):
+        self.Load_()
+        return OrderedDict.items(self)
+
+    def SaveForUndo_(self):
+        """Saves the contents before the current UndoLog's first mutation."""
+        undo_log = getattr(TRANSACTION, 'undo_log', None)
+        if undo_log is not None and self.saved is None:
+            self.saved = list(OrderedDict.items(self))
+            undo_log.collections.append(self)
+
+    def Restore_(self):
+        """Restores the contents SaveForUndo_() saved."""
+        saved, self.saved = self.saved, None
+        OrderedDict.clear(self)
+        for key, value in saved:
+            OrderedDict.__setitem__(self, key, value)
+
+    def Forget_(self):
+        """Drops the contents SaveForUndo_() saved."""
+        self.saved = None
@@ -1,8 +1,16 @@
 #!/usr/bin/python
 
+import datetime
+import json
+import mock
 import unittest
 
+from bloggerengine import author as author_model
 from bloggerengine import base_model
+from bloggerengine import blogpost as blogpost_model
+from bloggerengine import comment as comment_model
+from bloggerengine import formats
+from bloggerengine import label as label_model
 
 from collections import OrderedDict
 
@@ -41,6 +49,95 @@ class BaseModelTests(unittest.TestCase):
         self.assertTrue(base.id in base.instances[base.__class__.__name__])
         self.assertEquals(len(base.instances[base.__class__.__name__]), 1)
 
+    def test_Put_ChangesCollectionVersion(self):
+        base = base_model.BaseModel()
+        before = base_model.BaseModel.collection_version
+
+        base.put()
+        stored = base_model.BaseModel.collection_version
+        base.put()
+
+        self.assertNotEquals(stored, before)
+        self.assertEquals(base_model.BaseModel.collection_version, stored)
+        self.assertEquals(base.version, 1)
+
+        base.delete()
+        self.assertNotEquals(base_model.BaseModel.collection_version, stored)
+
+    def test_SetState_KeepsCollectionVersion(self):
+        base = base_model.BaseModel()
+        before = base_model.BaseModel.collection_version
+
+        base.SetState_(base.GetState_(), None)
+
+        self.assertEquals(base_model.BaseModel.collection_version, before)
+        self.assertEquals(base.version, 1)
+
+    def test_Batching_NotifiesChangesOnce(self):
+        listener = mock.MagicMock()
+        base = base_model.BaseModel()
+
+        with mock.patch.object(base_model.BaseModel, 'change_listeners',
+                               [listener]):
+            with base_model.BaseModel.Batching():
+                base.put()
+                with base_model.BaseModel.Batching():
+                    base.Changed_()
+                self.assertFalse(listener.called)
+            base.Changed_()
+
+        self.assertEquals(listener.call_args_list,
+                          [mock.call(base), mock.call(base)])
+
+    def test_Batching_AppendsOneRecord(self):
+        operation_log = mock.MagicMock()
+        first = base_model.BaseModel()
+        second = base_model.BaseModel()
+
+        with mock.patch.object(base_model.BaseModel, 'oplog', operation_log):
+            with base_model.BaseModel.Batching():
+                first.put()
+                second.put()
+
+        self.assertFalse(operation_log.Append.called)
+        records = operation_log.AppendBatch.call_args[0][0]
+        self.assertEquals([(record['op'], record['id']) for record in records],
+                          [('put', first.id), ('put', second.id)])
+
+    def test_Batching_Atomic_RollsBack(self):
+        operation_log = mock.MagicMock()
+        listener = mock.MagicMock()
+        kept = base_model.BaseModel()
+        kept.put()
+        added = base_model.BaseModel()
+        version = kept.version
+
+        with mock.patch.object(base_model.BaseModel, 'oplog', operation_log):
+            with mock.patch.object(base_model.BaseModel, 'change_listeners',
+                                   [listener]):
+                with self.assertRaises(ValueError):
+                    with base_model.BaseModel.Batching(atomic=True):
+                        kept.delete()
+                        added.put()
+                        raise ValueError()
+
+        self.assertEquals(list(base_model.BaseModel.instances['BaseModel']),
+                          [kept.id])
+        self.assertFalse(operation_log.Append.called)
+        self.assertFalse(operation_log.AppendBatch.called)
+        self.assertEquals(kept.version, version + 2)
+        self.assertEquals(listener.call_count, 2)
+
+    def test_Batching_Atomic_Commits(self):
+        base = base_model.BaseModel()
+
+        with base_model.BaseModel.Batching(atomic=True):
+            base.put()
+
+        self.assertEquals(list(base_model.BaseModel.instances['BaseModel']),
+                          [base.id])
+        self.assertIsNone(base_model.BaseModel.instances['BaseModel'].saved)
+
     def test_Put_MultipleInstances(self):
         for instance in self.GenerateBaseModelInstances():
             instance.put()
@@ -121,10 +218,246 @@ class BaseModelTests(unittest.TestCase):
         result = base_model.BaseModel.GetByStorageKey('unseen_storage_key')
         self.assertIsNone(result)
 
+    def test_GetRange(self):
+        instances = list(self.GenerateBaseModelInstances())
+        for instance in reversed(instances):
+            instance.put()
+
+        self.assertEquals(base_model.BaseModel.GetRange(), instances)
+        self.assertEquals(
+            base_model.BaseModel.GetRange(instances[1].id, instances[3].id),
+            instances[1:3])
+        self.assertEquals(base_model.BaseModel.GetRange(
+            base_model.IdFromTimestamp(datetime.datetime(2100, 1, 1))), [])
+
     def GenerateBaseModelInstances(self):
         for unused_x in range(5):
             base = base_model.BaseModel()
             yield base
 
+
+class JsonCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        author_model.Author.instances = {}
+        blogpost_model.Blogpost.instances = {}
+        comment_model.Comment.instances = {}
+        label_model.Label.instances = {}
+        for model_class in (author_model.Author, blogpost_model.Blogpost,
+                            comment_model.Comment, label_model.Label):
+            model_class.ResetJsonCacheStats()
+
+        self.zack = author_model.Author('zack')
+        self.colin = author_model.Author('colin')
+        self.blogpost = blogpost_model.Blogpost(self.zack, 'Hi!', 'Lorem.')
+        self.other_blogpost = blogpost_model.Blogpost(self.colin, 'Yo', 'Ok.')
+        self.comment = comment_model.Comment(self.colin, self.blogpost,
+                                             'Welcome!')
+
+    def test_ToJson_Cached(self):
+        result = self.comment.ToJson()
+
+        self.assertIs(self.comment.ToJson(), result)
+        self.assertIs(result['blogpost'], self.blogpost.ToJson())
+        stats = comment_model.Comment.GetJsonCacheStats()
+        self.assertEquals((stats['hits'], stats['misses'], stats['hit_rate']),
+                          (1, 1, 0.5))
+
+    def test_ToEncodedJson_Cached(self):
+        result = self.blogpost.ToEncodedJson()
+
+        self.assertIs(self.blogpost.ToEncodedJson(), result)
+        self.assertEquals(json.loads(result.decode('utf-8')),
+                          self.blogpost.ToJson())
+
+        comment_model.Comment(self.colin, self.blogpost, 'Again!')
+
+        self.assertIsNot(self.blogpost.ToEncodedJson(), result)
+        self.assertEquals(
+            len(json.loads(self.blogpost.ToEncodedJson().decode('utf-8'))[
+                'comments']), 2)
+        stats = blogpost_model.Blogpost.GetJsonCacheStats()
+        self.assertEquals((stats['encoded_hits'], stats['encoded_misses']),
+                          (2, 2))
+
+    def test_ToJson_InvalidatedByReferences(self):
+        comment_json = self.comment.ToJson()
+        other_json = self.other_blogpost.ToJson()
+
+        label_model.Label('intro').AddToBlogpost(self.blogpost)
+
+        self.assertIsNot(self.comment.ToJson(), comment_json)
+        self.assertEquals(self.comment.ToJson()['blogpost']['labels'],
+                          ['intro'])
+        self.assertIs(self.other_blogpost.ToJson(), other_json)
+
+    def test_ToJson_InvalidatedByAuthor(self):
+        blogpost_json = self.blogpost.ToJson()
+        other_json = self.other_blogpost.ToJson()
+
+        comment_model.Comment(self.zack, self.other_blogpost, 'Thanks!')
+
+        self.assertEquals(len(self.blogpost.ToJson()['author']['comments']),
+                          1)
+        self.assertIsNot(self.blogpost.ToJson(), blogpost_json)
+        self.assertIsNot(self.other_blogpost.ToJson(), other_json)
+
+    def test_ToJson_FieldsBypassCache(self):
+        result = self.comment.ToJson(['id', 'blogpost.headline'])
+
+        self.assertEquals(result, {'id': self.comment.id,
+                                   'blogpost': {'headline': 'Hi!'}})
+        self.assertIsNone(self.comment.json_cache)
+        encoded = self.comment.ToEncodedJson(['id'])
+        self.assertEquals(json.loads(encoded.decode('utf-8')),
+                          {'id': self.comment.id})
+        self.assertIsNone(self.comment.encoded_json_cache)
+        self.assertIs(self.comment.ToEncodedJson(['id']), encoded)
+        self.assertIsNot(self.comment.ToEncodedJson(['comment_text']),
+                         encoded)
+
+    def test_ToJson_Normalized(self):
+        result = self.comment.ToJson(normalized=True)
+
+        self.assertEquals(result['author'], 'colin')
+        self.assertEquals(result['blogpost'], self.blogpost.id)
+        self.assertEquals(result['comment_text'], 'Welcome!')
+
+    def test_ToEncodedJson_NormalizedIgnoresReferences(self):
+        encoded = self.comment.ToEncodedJson(normalized=True)
+
+        label_model.Label('intro').AddToBlogpost(self.blogpost)
+
+        self.assertIs(self.comment.ToEncodedJson(normalized=True), encoded)
+        self.assertIsNot(self.comment.ToEncodedJson(), encoded)
+
+    def test_ToJson_Native(self):
+        result = self.comment.ToJson(native=True)
+
+        self.assertEquals(result['created_timestamp'],
+                          self.comment.created_timestamp)
+        self.assertEquals(result['author']['created_timestamp'],
+                          self.colin.created_timestamp)
+        self.assertEquals(self.comment.ToJson()['created_timestamp'],
+                          str(self.comment.created_timestamp))
+
+    def test_ToEncoded(self):
+        data_format = mock.Mock(name='format')
+        data_format.name = 'test'
+        data_format.Encode.side_effect = repr
+
+        self.assertIs(self.comment.ToEncoded(formats.JSON),
+                      self.comment.ToEncodedJson())
+        encoded = self.comment.ToEncoded(data_format)
+        self.assertIs(self.comment.ToEncoded(data_format), encoded)
+        self.assertEquals(data_format.Encode.call_count, 1)
+        self.assertIn('datetime.datetime', encoded)
+
+        self.comment.author.Changed_()
+        self.assertIsNot(self.comment.ToEncoded(data_format), encoded)
+        self.assertIsNot(self.comment.ToEncoded(data_format, ['id']),
+                         self.comment.ToEncoded(data_format))
+
+    def test_GetRelated(self):
+        self.assertEquals(self.comment.GetRelated('author'), [self.colin])
+        self.assertEquals(self.blogpost.GetRelated('comments'),
+                          [self.comment])
+        self.assertEquals(self.blogpost.GetRelated('headline'), [])
+
+    def test_ToJson_Uncached(self):
+        with mock.patch.object(base_model.BaseModel, 'cache_json', False):
+            result = self.blogpost.ToJson()
+
+            self.assertIsNot(self.blogpost.ToJson(), result)
+            self.assertEquals(self.blogpost.ToJson(), result)
+        self.assertIsNone(blogpost_model.Blogpost.GetJsonCacheStats()[
+            'hit_rate'])
+
+
+class ParseFieldsTests(unittest.TestCase):
+
+    def test_ParseFields(self):
+        result = base_model.ParseFields(
+            ['id', 'blogpost.author.username', 'author.id', 'author',
+             'blogpost.id'])
+
+        self.assertEquals(result, {
+            'id': None,
+            'author': None,
+            'blogpost': {'id': None, 'author': {'username': None}}
+        })
+
+
+class IdGeneratorTests(unittest.TestCase):
+
+    def test_NextId_Increasing(self):
+        generator = base_model.IdGenerator()
+        ids = [generator.NextId() for unused_x in range(10000)]
+
+        self.assertEquals(ids, sorted(set(ids)))
+        self.assertEquals(set(len(model_id) for model_id in ids), set([16]))
+
+    def test_NextId_ClockGoesBackwards(self):
+        generator = base_model.IdGenerator()
+        with mock.patch('time.time', return_value=1500000000.0):
+            first = generator.NextId()
+        with mock.patch('time.time', return_value=1400000000.0):
+            second = generator.NextId()
+
+        self.assertTrue(second > first)
+
+    def test_NextId_SequenceExhausted(self):
+        generator = base_model.IdGenerator()
+        with mock.patch('time.time', return_value=1500000000.0):
+            ids = [generator.NextId()
+                   for unused_x in range(base_model.MAX_SEQUENCE + 2)]
+
+        self.assertEquals(ids, sorted(set(ids)))
+        self.assertEquals(base_model.TimestampFromId(ids[-1]),
+                          datetime.datetime.utcfromtimestamp(1500000000.001))
+
+    def test_NextId_NodeId(self):
+        with mock.patch('time.time', return_value=1500000000.0):
+            first = base_model.IdGenerator(1).NextId()
+            second = base_model.IdGenerator(2).NextId()
+
+        self.assertNotEquals(first, second)
+        self.assertEquals(base_model.TimestampFromId(first),
+                          base_model.TimestampFromId(second))
+
+    def test_Advance(self):
+        generator = base_model.IdGenerator()
+        with mock.patch('time.time', return_value=1500000000.0):
+            restored = base_model.IdGenerator(3).NextId()
+        generator.Advance(['legacy', restored, 'not a hex id 123'])
+
+        with mock.patch('time.time', return_value=1400000000.0):
+            result = generator.NextId()
+
+        self.assertTrue(result > restored)
+
+    def test_Advance_KeepsLaterIds(self):
+        generator = base_model.IdGenerator()
+        with mock.patch('time.time', return_value=1500000000.0):
+            later = generator.NextId()
+        generator.Advance([base_model.FormatId(
+            base_model.ID_EPOCH_MILLISECONDS, 0, 0)])
+
+        self.assertTrue(generator.NextId() > later)
+
+    def test_Constructor_InvalidNodeId(self):
+        self.assertRaises(ValueError, base_model.IdGenerator,
+                          base_model.MAX_NODE_ID + 1)
+
+    def test_IdFromTimestamp(self):
+        timestamp = datetime.datetime(2020, 2, 3, 4, 5, 6, 7000)
+        with mock.patch('time.time', return_value=1580702706.007):
+            generated = base_model.IdGenerator(5).NextId()
+
+        self.assertEquals(base_model.TimestampFromId(
+            base_model.IdFromTimestamp(timestamp)), timestamp)
+        self.assertTrue(base_model.IdFromTimestamp(timestamp) <= generated)
+        self.assertEquals(base_model.TimestampFromId(generated), timestamp)
+
 if __name__ == '__main__':
     unittest.main()
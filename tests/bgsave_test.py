@@ -0,0 +1,160 @@
+#!/usr/bin/python
+
+import mock
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import unittest
+
+from bloggerengine import author as author_model
+from bloggerengine import base_model
+from bloggerengine import bgsave
+from bloggerengine import blogpost as blogpost_model
+from bloggerengine import comment as comment_model
+from bloggerengine import engine
+from bloggerengine import label as label_model
+from bloggerengine import snapshot
+from bloggerengine import storage
+
+
+class BackgroundSnapshotterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ResetInstances()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'snapshot')
+        self.log_path = os.path.join(self.directory, 'oplog')
+        self.blogger_engine = engine.BloggerEngine()
+
+        blogpost = self.blogger_engine.SubmitBlogpost('zack', 'Hi!', 'Yo.')
+        self.blogger_engine.AddLabelToBlogpost('intro', blogpost.id)
+        self.blogger_engine.SubmitComment('colin', 'Welcome!', blogpost.id)
+
+    def tearDown(self):
+        self.blogger_engine.CloseOperationLog()
+        shutil.rmtree(self.directory)
+        del self.blogger_engine
+
+    def ResetInstances(self):
+        author_model.Author.instances = {}
+        base_model.BaseModel.instances = {}
+        blogpost_model.Blogpost.instances = {}
+        comment_model.Comment.instances = {}
+        label_model.Label.instances = {}
+
+    def DumpDatastore(self):
+        return dict((kind, [instance.ToJson()
+                            for instance in model_class.GetAll()])
+                    for kind, model_class in engine.MODEL_CLASSES.items())
+
+    def test_GetStatus_Idle(self):
+        snapshotter = bgsave.BackgroundSnapshotter(engine.MODEL_CLASSES,
+                                                   self.path)
+        result = snapshotter.GetStatus()
+
+        self.assertEquals(result['state'], bgsave.STATE_IDLE)
+        self.assertIsNone(result['duration_seconds'])
+        self.assertEquals(result['snapshots_taken'], 0)
+
+    def test_Start_WritesSnapshot(self):
+        expected = self.DumpDatastore()
+        snapshotter = bgsave.BackgroundSnapshotter(engine.MODEL_CLASSES,
+                                                   self.path)
+
+        self.assertTrue(snapshotter.Start())
+        result = snapshotter.Wait(timeout=30)
+
+        self.assertEquals(result['state'], bgsave.STATE_SUCCEEDED)
+        self.assertEquals(result['objects_written'], 5)
+        self.assertEquals(result['objects_total'], 5)
+        self.assertEquals(result['snapshots_taken'], 1)
+        self.assertIsNotNone(result['duration_seconds'])
+
+        self.ResetInstances()
+        snapshot.LoadSnapshot(self.path, engine.MODEL_CLASSES)
+        self.assertEquals(self.DumpDatastore(), expected)
+
+    def test_Start_WaitsForCollectionLocks(self):
+        collection = blogpost_model.Blogpost.instances['Blogpost']
+        held = threading.Event()
+
+        def Hold():
+            with collection.lock:
+                held.set()
+                time.sleep(0.2)
+
+        thread = threading.Thread(target=Hold)
+        thread.start()
+        held.wait(5)
+        snapshotter = bgsave.BackgroundSnapshotter(engine.MODEL_CLASSES,
+                                                   self.path)
+
+        snapshotter.Start()
+        result = snapshotter.Wait(timeout=10)
+        thread.join()
+        if result['state'] == bgsave.STATE_RUNNING:
+            os.kill(snapshotter.pid, signal.SIGKILL)
+
+        self.assertEquals(result['state'], bgsave.STATE_SUCCEEDED)
+
+    def test_Start_AlreadyRunning(self):
+        snapshotter = bgsave.BackgroundSnapshotter(engine.MODEL_CLASSES,
+                                                   self.path)
+        snapshotter.state = bgsave.STATE_RUNNING
+
+        with mock.patch.object(snapshotter, 'Poll_'):
+            result = snapshotter.Start()
+
+        self.assertFalse(result)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_Start_RecordsLogPosition(self):
+        self.ResetInstances()
+        self.blogger_engine.OpenOperationLog(self.log_path)
+        self.blogger_engine.SubmitBlogpost('zack', 'Logged', 'Yo.')
+        snapshotter = bgsave.BackgroundSnapshotter(engine.MODEL_CLASSES,
+                                                   self.path)
+        snapshotter.Start()
+        snapshotter.Wait(timeout=30)
+        self.blogger_engine.SubmitBlogpost('zack', 'Tail', 'Yo.')
+        expected = self.DumpDatastore()
+        self.blogger_engine.CloseOperationLog()
+
+        self.ResetInstances()
+        self.blogger_engine.OpenOperationLog(self.log_path,
+                                             snapshot_path=self.path)
+
+        self.assertEquals(self.DumpDatastore(), expected)
+
+    def test_IsDue_Interval(self):
+        snapshotter = bgsave.BackgroundSnapshotter(engine.MODEL_CLASSES,
+                                                   self.path,
+                                                   interval_seconds=60)
+        self.assertFalse(snapshotter.IsDue())
+
+        snapshotter.last_start -= 61
+        self.assertTrue(snapshotter.IsDue())
+
+    def test_IsDue_Mutations(self):
+        self.blogger_engine.OpenOperationLog(self.log_path)
+        snapshotter = bgsave.BackgroundSnapshotter(engine.MODEL_CLASSES,
+                                                   self.path,
+                                                   mutation_threshold=3)
+        self.assertFalse(snapshotter.IsDue())
+
+        self.blogger_engine.SubmitBlogpost('steve', 'Hi!', 'Yo.')
+
+        self.assertTrue(snapshotter.IsDue())
+
+    def test_IsDue_NoSchedule(self):
+        snapshotter = bgsave.BackgroundSnapshotter(engine.MODEL_CLASSES,
+                                                   self.path)
+        snapshotter.last_start -= 3600
+
+        self.assertFalse(snapshotter.IsDue())
+
+if __name__ == '__main__':
+    unittest.main()
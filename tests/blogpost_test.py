@@ -237,6 +237,26 @@ class BlogpostTests(unittest.TestCase):
         self.assertEquals(result['created_timestamp'],
                           str(blogpost.created_timestamp))
 
+    def test_ToJson_Fields(self):
+        blogpost = blogpost_model.Blogpost(self.author, self.headline,
+                                           self.body)
+
+        result = blogpost.ToJson(['id', 'headline', 'unknown'])
+
+        self.assertFalse(self.author.ToJson.called)
+        self.assertEquals(result, {'id': blogpost.id,
+                                   'headline': blogpost.headline})
+
+    def test_ToJson_NestedFields(self):
+        blogpost = blogpost_model.Blogpost(self.author, self.headline,
+                                           self.body)
+        self.author.ToJson.return_value = {'username': 'zack'}
+
+        result = blogpost.ToJson(['author.username'])
+
+        self.author.ToJson.assert_called_once_with({'username': None})
+        self.assertEquals(result, {'author': {'username': 'zack'}})
+
     def GenerateComments(self):
         # I used a generator here since I needed to set the id property,
         # otherwise, I would've just used a list comprehension.
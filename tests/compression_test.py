@@ -0,0 +1,66 @@
+#!/usr/bin/python
+
+import gzip
+import unittest
+import zlib
+
+from bloggerengine import compression
+
+PAYLOAD = b'{"author":{"username":"zack"}}' * 100
+
+
+class CompressionTest(unittest.TestCase):
+
+    def test_Compress(self):
+        self.assertEquals(
+            gzip.decompress(compression.Compress(PAYLOAD, 'gzip')), PAYLOAD)
+        self.assertEquals(
+            zlib.decompress(compression.Compress(PAYLOAD, 'deflate', 1)),
+            PAYLOAD)
+
+    def test_CompressChunks(self):
+        chunks = [PAYLOAD[index:index + 7]
+                  for index in range(0, len(PAYLOAD), 7)]
+
+        result = b''.join(compression.CompressChunks(chunks, 'gzip'))
+
+        self.assertEquals(gzip.decompress(result), PAYLOAD)
+
+
+class CompressionCacheTest(unittest.TestCase):
+
+    def test_Compress_ReusesPayloads(self):
+        cache = compression.CompressionCache()
+
+        result = cache.Compress(PAYLOAD, 'gzip')
+
+        self.assertIs(cache.Compress(PAYLOAD, 'gzip'), result)
+        self.assertIsNot(cache.Compress(PAYLOAD, 'deflate'), result)
+        self.assertIsNot(cache.Compress(PAYLOAD + b' ', 'gzip'), result)
+        self.assertEquals(gzip.decompress(result), PAYLOAD)
+        self.assertEquals(cache.GetStats(), {
+            'hits': 1, 'misses': 3, 'hit_rate': 0.25, 'entries': 3,
+            'bytes': cache.size})
+
+    def test_Compress_EvictsLeastRecentlyUsed(self):
+        size = len(compression.Compress(PAYLOAD, 'gzip'))
+        cache = compression.CompressionCache(max_bytes=size * 2 + 8)
+        first = cache.Compress(PAYLOAD, 'gzip')
+        cache.Compress(PAYLOAD + b'1', 'gzip')
+        cache.Compress(PAYLOAD, 'gzip')
+        cache.Compress(PAYLOAD + b'2', 'gzip')
+
+        self.assertEquals(len(cache.entries), 2)
+        self.assertTrue(cache.size <= size * 2 + 8)
+        self.assertIs(cache.Compress(PAYLOAD, 'gzip'), first)
+
+    def test_Compress_Disabled(self):
+        cache = compression.CompressionCache(max_bytes=0)
+        cache.Compress(PAYLOAD, 'gzip')
+
+        self.assertEquals(cache.GetStats()['entries'], 0)
+        self.assertEquals(cache.GetStats()['misses'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,7 @@
 #!/usr/bin/python
 
+import mock
+import threading
 import unittest
 
 from bloggerengine import author as author_model
@@ -107,6 +109,22 @@ class BloggerEngineTest(unittest.TestCase):
         self.assertEquals(
             len(blogpost_model.Blogpost.instances['Blogpost']), 4)
 
+    def test_SubmitBlogposts(self):
+        result = self.blogger_engine.SubmitBlogposts([
+            (self.username, self.headline, self.body),
+            ('steve', 'Bulk', 'Yo!'),
+            ('steve', 'Bulk again', 'Yo!'),
+        ])
+
+        self.assertEquals([blogpost.headline for blogpost in result],
+                          [self.headline, 'Bulk', 'Bulk again'])
+        self.assertIs(result[0].author, self.authors[1])
+        self.assertIs(result[1].author, result[2].author)
+        self.assertEquals(result[1].author.GetBlogposts(), result[1:])
+        self.assertEquals(
+            len(blogpost_model.Blogpost.instances['Blogpost']), 6)
+        self.assertEquals(len(author_model.Author.instances['Author']), 3)
+
     def test_AddLabelToBlogpost_BlogpostFound(self):
         blogpost = self.blogger_engine.SubmitBlogpost(self.username,
                                                       self.headline,
@@ -153,6 +171,23 @@ class BloggerEngineTest(unittest.TestCase):
                                                              blogpost.id)
         self.assertIsNone(result)
 
+    def test_AddLabelsToBlogposts(self):
+        blogpost1, blogpost2, unused_blogpost3 = self.blogposts
+
+        result = self.blogger_engine.AddLabelsToBlogposts([
+            (self.label_text, blogpost1.id),
+            (self.label_text, blogpost2.id),
+            ('intro', blogpost2.id),
+            (self.label_text, '12345'),
+        ])
+
+        self.assertIs(result[0], result[1])
+        self.assertIs(result[2], self.labels[0])
+        self.assertIsNone(result[3])
+        self.assertEquals(result[0].GetBlogposts(), [blogpost1, blogpost2])
+        self.assertIn('intro', blogpost2.labels)
+        self.assertEquals(len(label_model.Label.instances['Label']), 4)
+
     def test_DeleteLabel_LabelFound(self):
         label = self.labels[2]
         result = self.blogger_engine.DeleteLabel(label.label)
@@ -193,6 +228,16 @@ class BloggerEngineTest(unittest.TestCase):
         self.assertTrue(
             blogpost.id not in blogpost_model.Blogpost.instances['Blogpost'])
 
+    def test_DeleteBlogpost_FailurePartwayRollsBack(self):
+        expected = self.DumpGraph()
+
+        with mock.patch.object(label_model.Label, 'RemoveFromBlogpost',
+                               side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.blogger_engine.DeleteBlogpost(self.blogposts[0].id)
+
+        self.assertEquals(self.DumpGraph(), expected)
+
     def test_DeleteBlogpost_BlogpostNotFound(self):
         blogpost_id = '12345'
 
@@ -228,6 +273,24 @@ class BloggerEngineTest(unittest.TestCase):
 
         self.assertIsNone(result)
 
+    def test_SubmitComments(self):
+        blogpost1, blogpost2, unused_blogpost3 = self.blogposts
+
+        result = self.blogger_engine.SubmitComments([
+            ('colin', 'First!', blogpost1.id),
+            ('steve', 'Second!', blogpost1.id),
+            ('steve', 'Elsewhere', blogpost2.id),
+            ('steve', 'Lost', '12345'),
+        ])
+
+        self.assertEquals([comment and comment.comment_text
+                           for comment in result],
+                          ['First!', 'Second!', 'Elsewhere', None])
+        self.assertIs(result[0].author, self.authors[0])
+        self.assertIs(result[1].author, result[2].author)
+        self.assertEquals(blogpost1.GetComments()[-2:], result[:2])
+        self.assertEquals(len(comment_model.Comment.instances['Comment']), 6)
+
     def test_RemoveCommentFromBlogpost_CommentFound(self):
         comment = self.comments[0]
         blogpost = comment.blogpost
@@ -289,6 +352,31 @@ class BloggerEngineTest(unittest.TestCase):
         result = self.blogger_engine.GetBlogpostById('12345')
         self.assertIsNone(result)
 
+    def test_GetBlogpostsByIds(self):
+        blogpost1, unused_blogpost2, blogpost3 = self.blogposts
+
+        result = self.blogger_engine.GetBlogpostsByIds(
+            [blogpost3.id, '12345', blogpost1.id])
+
+        self.assertEquals(result, [blogpost3, None, blogpost1])
+
+    def test_GetCommentsByIds(self):
+        result = self.blogger_engine.GetCommentsByIds(
+            ['12345', self.comments[1].id])
+
+        self.assertEquals(result, [None, self.comments[1]])
+
+    def test_GetAuthorsByUsernames(self):
+        result = self.blogger_engine.GetAuthorsByUsernames(
+            ['zack', 'steve', 'colin'])
+
+        self.assertEquals(result, [self.authors[1], None, self.authors[0]])
+
+    def test_GetLabelsByText(self):
+        result = self.blogger_engine.GetLabelsByText(['funny', 'intro', 'x'])
+
+        self.assertEquals(result, [self.labels[1], self.labels[0], None])
+
     def test_GetBlogpostsByLabel_LabelExists(self):
         result = self.blogger_engine.GetBlogpostsByLabel('funny')
         expected = [self.blogposts[1]]
@@ -332,6 +420,103 @@ class BloggerEngineTest(unittest.TestCase):
         expected = self.blogposts
         self.assertEquals(result, expected)
 
+    def test_GetAllBlogposts_Paginated(self):
+        first = self.blogger_engine.GetAllBlogposts(limit=1)
+        rest = self.blogger_engine.GetAllBlogposts(cursor=first.next_cursor)
+
+        result = first + rest
+        expected = self.blogposts
+        self.assertEquals(result, expected)
+        self.assertIsNone(rest.next_cursor)
+
+    def test_GetBlogpostsByUsername_Paginated(self):
+        username = self.blogposts[0].author.username
+        result = self.blogger_engine.GetBlogpostsByUsername(username, limit=1)
+        expected = [self.blogposts[0]]
+        self.assertEquals(result, expected)
+
+    def test_GetSnapshot_UnaffectedByLaterWrites(self):
+        snapshot = self.blogger_engine.GetSnapshot()
+        self.blogger_engine.DeleteBlogpost(self.blogposts[0].id)
+        self.blogger_engine.SubmitBlogpost('steve', 'Later', 'Post.')
+
+        result = snapshot['Blogpost'].GetAll()
+        expected = self.blogposts
+        self.assertEquals(result, expected)
+        self.assertIs(snapshot['Blogpost'].Get(self.blogposts[0].id),
+                      self.blogposts[0])
+
+    def DumpGraph(self):
+        graph = dict((kind, list(model_class.instances[kind]))
+                     for kind, model_class in engine.MODEL_CLASSES.items())
+        for model in self.authors + self.blogposts + self.labels:
+            for field in model.relation_fields:
+                graph[model.id, field] = list(getattr(model, field))
+        return graph
+
+    def test_Transaction_Commits(self):
+        with self.blogger_engine.Transaction():
+            blogpost = self.blogger_engine.SubmitBlogpost('steve', 'New',
+                                                          'Post.')
+            self.blogger_engine.DeleteLabel('intro')
+
+        self.assertIs(self.blogger_engine.GetBlogpostById(blogpost.id),
+                      blogpost)
+        self.assertIsNone(self.blogger_engine.GetLabel('intro'))
+
+    def test_Transaction_RollsBack(self):
+        expected = self.DumpGraph()
+
+        with self.assertRaises(ValueError):
+            with self.blogger_engine.Transaction():
+                self.blogger_engine.DeleteBlogpost(self.blogposts[0].id)
+                self.blogger_engine.DeleteLabel('good stuff')
+                blogpost = self.blogger_engine.SubmitBlogpost(
+                    'steve', 'New', 'Post.')
+                self.blogger_engine.AddLabelToBlogpost('funny', blogpost.id)
+                raise ValueError()
+
+        self.assertEquals(self.DumpGraph(), expected)
+        self.assertEquals(self.blogger_engine.GetAllBlogposts(),
+                          self.blogposts)
+        self.assertIsNone(self.blogger_engine.GetAuthorByUsername('steve'))
+
+    def test_Transaction_IsolatesReaders(self):
+        self.blogger_engine.GetAllBlogposts()
+        results = []
+
+        def Read():
+            results.append(self.blogger_engine.GetAllBlogposts())
+
+        with self.blogger_engine.Transaction():
+            self.blogger_engine.DeleteBlogpost(self.blogposts[0].id)
+            thread = threading.Thread(target=Read)
+            thread.start()
+            thread.join()
+        Read()
+
+        self.assertEquals(results, [self.blogposts, self.blogposts[1:]])
+
+    def test_GetSnapshot_Kinds(self):
+        snapshot = self.blogger_engine.GetSnapshot('Comment')
+
+        self.assertEquals(list(snapshot), ['Comment'])
+        self.assertEquals(list(snapshot['Comment'].Iterate()), self.comments)
+
+    def test_GetCollectionVersions(self):
+        before = self.blogger_engine.GetCollectionVersions()
+        labels = self.blogger_engine.GetCollectionVersions('Label')
+
+        self.blogger_engine.SubmitComment('colin', 'Again',
+                                          self.blogposts[0].id)
+        after = self.blogger_engine.GetCollectionVersions()
+
+        self.assertEquals(len(before), 4)
+        self.assertEquals(labels, before[3:])
+        for index in range(3):
+            self.assertNotEquals(after[index], before[index])
+        self.assertEquals(after[3], before[3])
+
     def test_GetCommentsByBlogpost_BlogpostFound(self):
         blogpost_id = self.blogposts[0].id
         result = self.blogger_engine.GetCommentsByBlogpost(blogpost_id)
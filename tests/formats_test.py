@@ -0,0 +1,89 @@
+#!/usr/bin/python
+
+import datetime
+import unittest
+
+from bloggerengine import formats
+
+TIMESTAMP = datetime.datetime(2015, 6, 1, 12, 30, 15, 123456)
+
+
+class FormatsTest(unittest.TestCase):
+
+    def Assemble(self, data_format, items):
+        parts = [data_format.MapStart(len(items))]
+        for index, (key, value) in enumerate(items):
+            if index:
+                parts.append(data_format.separator)
+            parts.append(data_format.Encode(key) + data_format.key_separator)
+            parts.append(data_format.ArrayStart(len(value)))
+            parts.append(data_format.separator.join(
+                data_format.Encode(item) for item in value))
+            parts.append(data_format.array_end)
+        parts.append(data_format.map_end)
+        return b''.join(parts)
+
+    def CheckAssembled(self, data_format):
+        for count in (0, 1, 23, 24, 255, 256, 70000):
+            items = [('key%d' % index, list(range(index % 3)))
+                     for index in range(count)]
+            self.assertEquals(
+                data_format.Decode(self.Assemble(data_format, items)),
+                dict(items))
+
+    def test_Utc(self):
+        result = TIMESTAMP.replace(tzinfo=formats.Utc_())
+
+        self.assertEquals(result, TIMESTAMP.replace(tzinfo=formats.UTC))
+        self.assertEquals(result.utcoffset(), datetime.timedelta(0))
+        self.assertEquals(result.tzname(), 'UTC')
+
+    def test_Json_Assemble(self):
+        self.CheckAssembled(formats.JSON)
+
+    def test_Json_DecodeInvalid(self):
+        for data in (b'{', b'\xff'):
+            self.assertRaises(ValueError, formats.JSON.Decode, data)
+
+    @unittest.skipUnless(formats.MESSAGEPACK.available, 'msgpack missing')
+    def test_MessagePack_Assemble(self):
+        self.CheckAssembled(formats.MESSAGEPACK)
+
+    @unittest.skipUnless(formats.MESSAGEPACK.available, 'msgpack missing')
+    def test_MessagePack_Timestamps(self):
+        result = formats.MESSAGEPACK.Decode(
+            formats.MESSAGEPACK.Encode({'created_timestamp': TIMESTAMP}))
+
+        self.assertEquals(result['created_timestamp'],
+                          TIMESTAMP.replace(tzinfo=formats.UTC))
+
+    @unittest.skipUnless(formats.MESSAGEPACK.available, 'msgpack missing')
+    def test_MessagePack_DecodeInvalid(self):
+        for data in (b'', b'\xc1', b'\x81\x91\x01\x01'):
+            self.assertRaises(ValueError, formats.MESSAGEPACK.Decode, data)
+
+    @unittest.skipUnless(formats.CBOR.available, 'cbor2 missing')
+    def test_Cbor_Assemble(self):
+        self.CheckAssembled(formats.CBOR)
+
+    @unittest.skipUnless(formats.CBOR.available, 'cbor2 missing')
+    def test_Cbor_Timestamps(self):
+        result = formats.CBOR.Decode(
+            formats.CBOR.Encode({'created_timestamp': TIMESTAMP}))
+
+        self.assertEquals(result['created_timestamp'],
+                          TIMESTAMP.replace(tzinfo=formats.UTC))
+
+    @unittest.skipUnless(formats.CBOR.available, 'cbor2 missing')
+    def test_Cbor_DecodeInvalid(self):
+        for data in (b'', b'\xff'):
+            self.assertRaises(ValueError, formats.CBOR.Decode, data)
+
+    def test_ByMimetype(self):
+        self.assertIs(formats.BY_MIMETYPE['application/x-msgpack'],
+                      formats.MESSAGEPACK)
+        self.assertEquals(formats.MIMETYPES[0], 'application/json')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+#!/usr/bin/python
+
+import threading
+import unittest
+
+from bloggerengine import author as author_model
+from bloggerengine import base_model
+from bloggerengine import blogpost as blogpost_model
+from bloggerengine import comment as comment_model
+from bloggerengine import engine
+from bloggerengine import label as label_model
+from bloggerengine import locking
+
+
+class ReaderWriterLockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = locking.ReaderWriterLock()
+
+    def RunInThread(self, target):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def test_Reading_SharedBetweenThreads(self):
+        acquired = threading.Event()
+
+        def Read():
+            with self.lock.Reading():
+                acquired.set()
+
+        with self.lock.Reading():
+            self.RunInThread(Read)
+            self.assertTrue(acquired.wait(5))
+
+    def test_Writing_ExcludesReaders(self):
+        acquired = threading.Event()
+
+        def Read():
+            with self.lock.Reading():
+                acquired.set()
+
+        with self.lock.Writing():
+            thread = self.RunInThread(Read)
+            self.assertFalse(acquired.wait(0.1))
+
+        thread.join(5)
+        self.assertTrue(acquired.is_set())
+
+    def test_Writing_WaitsForReaders(self):
+        acquired = threading.Event()
+
+        def Write():
+            with self.lock.Writing():
+                acquired.set()
+
+        with self.lock.Reading():
+            thread = self.RunInThread(Write)
+            self.assertFalse(acquired.wait(0.1))
+
+        thread.join(5)
+        self.assertTrue(acquired.is_set())
+
+    def test_WaitingWriter_BlocksNewReaders(self):
+        order = []
+        writer_waiting = threading.Event()
+
+        def Write():
+            writer_waiting.set()
+            with self.lock.Writing():
+                order.append('writer')
+
+        def Read():
+            with self.lock.Reading():
+                order.append('reader')
+
+        with self.lock.Reading():
+            writer = self.RunInThread(Write)
+            writer_waiting.wait(5)
+            while not self.lock.waiting_writers:
+                pass
+            reader = self.RunInThread(Read)
+
+        writer.join(5)
+        reader.join(5)
+        self.assertEquals(order, ['writer', 'reader'])
+
+    def test_Reentrant(self):
+        with self.lock.Writing():
+            with self.lock.Writing():
+                with self.lock.Reading():
+                    pass
+            self.assertIsNotNone(self.lock.writer)
+        self.assertIsNone(self.lock.writer)
+
+        with self.lock.Reading():
+            with self.lock.Reading():
+                pass
+        self.assertEquals(self.lock.readers, {})
+
+    def test_AcquireWrite_UpgradeRaises(self):
+        with self.lock.Reading():
+            self.assertRaises(RuntimeError, self.lock.AcquireWrite)
+
+    def test_Release_NotHeldRaises(self):
+        self.assertRaises(RuntimeError, self.lock.ReleaseRead)
+        self.assertRaises(RuntimeError, self.lock.ReleaseWrite)
+
+
+class LockManagerTest(unittest.TestCase):
+
+    def test_Locking_MixedModes(self):
+        manager = locking.LockManager(['Author', 'Blogpost'])
+
+        with manager.Locking(reads=['Author'], writes=['Blogpost']):
+            self.assertEquals(len(manager.locks['Author'].readers), 1)
+            self.assertIsNotNone(manager.locks['Blogpost'].writer)
+
+        self.assertEquals(manager.locks['Author'].readers, {})
+        self.assertIsNone(manager.locks['Blogpost'].writer)
+
+
+class ConcurrentEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        author_model.Author.instances = {}
+        base_model.BaseModel.instances = {}
+        blogpost_model.Blogpost.instances = {}
+        comment_model.Comment.instances = {}
+        label_model.Label.instances = {}
+        self.blogger_engine = engine.BloggerEngine()
+
+    def RunInThread(self, target):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def test_SubmitBlogpost_ExcludesWriters(self):
+        submitted = threading.Event()
+
+        def Submit():
+            self.blogger_engine.SubmitBlogpost('zack', 'Hi!', 'Lorem.')
+            submitted.set()
+
+        with self.blogger_engine.Writing('Blogpost'):
+            thread = self.RunInThread(Submit)
+            self.assertFalse(submitted.wait(0.1))
+
+        thread.join(5)
+        self.assertTrue(submitted.is_set())
+
+    def test_GetSnapshot_SharedWithReaders(self):
+        done = threading.Event()
+
+        def Snapshot():
+            self.blogger_engine.GetSnapshot('Label')
+            done.set()
+
+        with self.blogger_engine.Reading('Author'):
+            self.RunInThread(Snapshot)
+            self.assertTrue(done.wait(5))
+
+    def test_ConcurrentMutations_KeepGraphConsistent(self):
+        errors = []
+        blogpost_ids = [self.blogger_engine.SubmitBlogpost(
+            'zack', 'Hi!', 'Lorem.').id for unused_x in range(50)]
+        self.blogger_engine.GetOrInsertLabel('intro')
+
+        def Comment():
+            try:
+                for blogpost_id in blogpost_ids:
+                    for unused_x in range(5):
+                        self.blogger_engine.SubmitComment('colin', 'Yo',
+                                                          blogpost_id)
+                        self.blogger_engine.AddLabelToBlogpost('intro',
+                                                               blogpost_id)
+            except Exception as error:
+                errors.append(error)
+
+        def Delete():
+            try:
+                for blogpost_id in blogpost_ids:
+                    self.blogger_engine.DeleteBlogpost(blogpost_id)
+                    self.blogger_engine.GetAllBlogposts()
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=target)
+                   for target in (Comment, Comment, Delete)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(errors, [])
+        self.assertEquals(self.blogger_engine.GetAllBlogposts(), [])
+        for comment in self.blogger_engine.GetAllComments():
+            self.assertIn(comment.blogpost.id, blogpost_ids)
+            self.assertNotIn(comment.id, comment.blogpost.comments)
+        self.assertEquals(self.blogger_engine.GetLabel('intro').blogposts,
+                          {})
+
+if __name__ == '__main__':
+    unittest.main()
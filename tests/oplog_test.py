@@ -0,0 +1,342 @@
+#!/usr/bin/python
+
+import mock
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from bloggerengine import author as author_model
+from bloggerengine import base_model
+from bloggerengine import blogpost as blogpost_model
+from bloggerengine import comment as comment_model
+from bloggerengine import engine
+from bloggerengine import label as label_model
+from bloggerengine import oplog
+
+
+class OperationLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ResetInstances()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'oplog')
+        self.blogger_engine = engine.BloggerEngine()
+
+    def tearDown(self):
+        self.blogger_engine.CloseOperationLog()
+        shutil.rmtree(self.directory)
+        del self.blogger_engine
+
+    def ResetInstances(self):
+        author_model.Author.instances = {}
+        base_model.BaseModel.instances = {}
+        blogpost_model.Blogpost.instances = {}
+        comment_model.Comment.instances = {}
+        label_model.Label.instances = {}
+
+    def PopulateEngine(self):
+        zack = self.blogger_engine.SubmitBlogpost('zack', 'Hi!', 'Lorem.')
+        colin = self.blogger_engine.SubmitBlogpost('colin', 'Yo', 'Ipsum.')
+        removed = self.blogger_engine.SubmitBlogpost('zack', 'Oops', 'Typo.')
+
+        self.blogger_engine.AddLabelToBlogpost('intro', zack.id)
+        self.blogger_engine.AddLabelToBlogpost('intro', colin.id)
+        self.blogger_engine.AddLabelToBlogpost('funny', colin.id)
+        self.blogger_engine.SubmitComment('colin', 'Welcome!', zack.id)
+        comment = self.blogger_engine.SubmitComment('zack', 'Spam', colin.id)
+        self.blogger_engine.SubmitComment('colin', 'Gone', removed.id)
+
+        self.blogger_engine.RemoveCommentFromBlogpost(comment.id)
+        self.blogger_engine.RemoveLabelFromBlogpost('intro', colin.id)
+        self.blogger_engine.DeleteLabel('funny')
+        self.blogger_engine.DeleteBlogpost(removed.id)
+
+    def DumpDatastore(self):
+        return dict((kind, [instance.ToJson()
+                            for instance in model_class.GetAll()])
+                    for kind, model_class in engine.MODEL_CLASSES.items())
+
+    def test_Constructor_NewLog(self):
+        operation_log = oplog.OperationLog(self.path)
+        operation_log.Close()
+
+        self.assertIsNotNone(operation_log.generation)
+        self.assertEquals(oplog.OperationLog(self.path).generation,
+                          operation_log.generation)
+        self.assertEquals(os.path.getsize(self.path),
+                          oplog.FILE_HEADER.size)
+
+    def test_Constructor_InvalidDurability(self):
+        self.assertRaises(ValueError, oplog.OperationLog, self.path, 'never')
+
+    def test_Constructor_NotALog(self):
+        with open(self.path, 'wb') as log_file:
+            log_file.write(b'definitely not an operation log')
+
+        self.assertRaises(ValueError, oplog.OperationLog, self.path)
+
+    def test_AppendAndReadRecords(self):
+        for durability in oplog.DURABILITY_MODES:
+            path = os.path.join(self.directory, durability)
+            operation_log = oplog.OperationLog(path, durability)
+            operation_log.Append({'op': 'first'})
+            operation_log.Append({'op': 'second'})
+            operation_log.Close()
+
+            result = list(oplog.OperationLog(path).ReadRecords())
+            expected = [{'op': 'first'}, {'op': 'second'}]
+
+            self.assertEquals(result, expected)
+
+    def test_AppendBatch(self):
+        operation_log = oplog.OperationLog(self.path)
+        operation_log.Append({'op': 'first'})
+        operation_log.AppendBatch([{'op': 'second'}, {'op': 'third'}])
+        operation_log.Close()
+
+        result = list(oplog.OperationLog(self.path).ReadRecords())
+        expected = [{'op': 'first'},
+                    {'op': 'batch',
+                     'records': [{'op': 'second'}, {'op': 'third'}]}]
+
+        self.assertEquals(result, expected)
+        self.assertEquals(operation_log.records_written, 3)
+
+    def test_ReadRecords_TornTailIsTruncated(self):
+        operation_log = oplog.OperationLog(self.path)
+        operation_log.Append({'op': 'first'})
+        operation_log.Append({'op': 'second'})
+        operation_log.Close()
+
+        with open(self.path, 'r+b') as log_file:
+            log_file.truncate(os.path.getsize(self.path) - 3)
+
+        operation_log = oplog.OperationLog(self.path)
+        operation_log.Append({'op': 'third'})
+        operation_log.Close()
+
+        result = list(operation_log.ReadRecords())
+        expected = [{'op': 'first'}, {'op': 'third'}]
+
+        self.assertEquals(result, expected)
+
+    def test_ReadRecords_ChecksumMismatchStopsReading(self):
+        operation_log = oplog.OperationLog(self.path)
+        operation_log.Append({'op': 'first'})
+        end_of_first = operation_log.Tell()
+        operation_log.Append({'op': 'second'})
+        operation_log.Close()
+
+        with open(self.path, 'r+b') as log_file:
+            log_file.seek(end_of_first + oplog.RECORD_HEADER.size)
+            log_file.write(b'X')
+
+        result = list(operation_log.ReadRecords())
+        expected = [{'op': 'first'}]
+
+        self.assertEquals(result, expected)
+
+    def test_OpenOperationLog_ReplayRestoresGraph(self):
+        self.blogger_engine.OpenOperationLog(self.path)
+        self.PopulateEngine()
+        expected = self.DumpDatastore()
+        self.blogger_engine.CloseOperationLog()
+
+        self.ResetInstances()
+        self.blogger_engine.OpenOperationLog(self.path)
+        result = self.DumpDatastore()
+
+        self.assertEquals(result, expected)
+
+    def test_OpenOperationLog_ReplayRestoresBulkGraph(self):
+        self.blogger_engine.OpenOperationLog(self.path)
+        self.PopulateEngine()
+        blogposts = self.blogger_engine.SubmitBlogposts(
+            [('zack', 'Bulk', 'Post.'), ('steve', 'Bulk', 'Post.')])
+        self.blogger_engine.SubmitComments(
+            [('steve', 'Bulk comment', blogposts[0].id),
+             ('colin', 'Bulk comment', blogposts[1].id)])
+        self.blogger_engine.AddLabelsToBlogposts(
+            [('intro', blogposts[0].id), ('bulk', blogposts[1].id)])
+        expected = self.DumpDatastore()
+        self.blogger_engine.CloseOperationLog()
+
+        records = list(oplog.OperationLog(self.path).ReadRecords())
+        self.assertEquals([record['op'] for record in records[-3:]],
+                          ['batch'] * 3)
+
+        self.ResetInstances()
+        self.blogger_engine.OpenOperationLog(self.path)
+        result = self.DumpDatastore()
+
+        self.assertEquals(result, expected)
+
+    def test_OpenOperationLog_ReplayRestoresRelationships(self):
+        self.blogger_engine.OpenOperationLog(self.path)
+        self.PopulateEngine()
+        self.blogger_engine.CloseOperationLog()
+
+        self.ResetInstances()
+        self.blogger_engine.OpenOperationLog(self.path)
+
+        zack = self.blogger_engine.GetAuthorByUsername('zack')
+        blogpost = zack.GetBlogposts()[0]
+        label = self.blogger_engine.GetLabel('intro')
+
+        self.assertIs(blogpost.author, zack)
+        self.assertIs(blogpost.labels['intro'], label)
+        self.assertIs(label.blogposts[blogpost.id], blogpost)
+        self.assertIs(blogpost.GetComments()[0].blogpost, blogpost)
+        self.assertEquals(len(zack.GetRemovedBlogposts()), 1)
+        self.assertEquals(len(zack.GetRemovedComments()), 1)
+        self.assertIsNone(self.blogger_engine.GetLabel('funny'))
+
+    def test_OpenOperationLog_ContinuesAppending(self):
+        self.blogger_engine.OpenOperationLog(self.path)
+        self.blogger_engine.SubmitBlogpost('zack', 'Hi!', 'Lorem.')
+        self.blogger_engine.CloseOperationLog()
+
+        self.ResetInstances()
+        self.blogger_engine.OpenOperationLog(self.path)
+        self.blogger_engine.SubmitBlogpost('zack', 'Again', 'Ipsum.')
+        self.blogger_engine.CloseOperationLog()
+
+        self.ResetInstances()
+        self.blogger_engine.OpenOperationLog(self.path)
+        result = [blogpost.headline
+                  for blogpost in self.blogger_engine.GetAllBlogposts()]
+
+        self.assertEquals(result, ['Hi!', 'Again'])
+        self.assertEquals(
+            len(self.blogger_engine.GetAuthorByUsername('zack').blogposts), 2)
+
+    def test_OpenOperationLog_NewIdsFollowRestoredIds(self):
+        self.blogger_engine.OpenOperationLog(self.path)
+        with mock.patch('time.time', return_value=1500000000.0):
+            restored = self.blogger_engine.SubmitBlogpost('zack', 'Hi!',
+                                                          'Lorem.')
+        self.blogger_engine.CloseOperationLog()
+
+        self.ResetInstances()
+        with mock.patch.object(base_model.BaseModel, 'id_generator',
+                               base_model.IdGenerator()):
+            self.blogger_engine.OpenOperationLog(self.path)
+            with mock.patch('time.time', return_value=1400000000.0):
+                blogpost = self.blogger_engine.SubmitBlogpost(
+                    'zack', 'Again', 'Ipsum.')
+
+        self.assertTrue(blogpost.id > restored.id)
+        self.assertEquals(
+            [post.headline for post in self.blogger_engine.GetAllBlogposts()],
+            ['Hi!', 'Again'])
+
+    def test_Compact_RestoresGraph(self):
+        self.blogger_engine.OpenOperationLog(self.path)
+        self.PopulateEngine()
+        expected = self.DumpDatastore()
+        zack = self.blogger_engine.GetAuthorByUsername('zack')
+        expected_removed = [blogpost.ToJson()
+                            for blogpost in zack.GetRemovedBlogposts()]
+
+        self.blogger_engine.CompactOperationLog()
+        self.blogger_engine.CloseOperationLog()
+
+        self.ResetInstances()
+        self.blogger_engine.OpenOperationLog(self.path)
+        zack = self.blogger_engine.GetAuthorByUsername('zack')
+
+        self.assertEquals(self.DumpDatastore(), expected)
+        self.assertEquals([blogpost.ToJson()
+                           for blogpost in zack.GetRemovedBlogposts()],
+                          expected_removed)
+        self.assertIsNone(self.blogger_engine.GetBlogpostById(
+            zack.GetRemovedBlogposts()[0].id))
+
+    def test_Compact_ShrinksDeleteHeavyLog(self):
+        self.blogger_engine.OpenOperationLog(self.path)
+        for unused_x in range(20):
+            self.blogger_engine.AddLabelToBlogpost(
+                'temporary', self.blogger_engine.SubmitBlogpost(
+                    'zack', 'Hi!', 'Lorem.').id)
+            self.blogger_engine.DeleteLabel('temporary')
+
+        before, after = self.blogger_engine.CompactOperationLog()
+
+        self.assertEquals(os.path.getsize(self.path), after)
+        self.assertTrue(after < before / 2)
+
+    def test_Compact_KeepsAppendingToNewGeneration(self):
+        operation_log = self.blogger_engine.OpenOperationLog(self.path)
+        self.PopulateEngine()
+        generation = operation_log.generation
+
+        self.blogger_engine.CompactOperationLog()
+        self.blogger_engine.SubmitBlogpost('steve', 'After', 'Compaction.')
+        expected = self.DumpDatastore()
+        self.blogger_engine.CloseOperationLog()
+
+        self.ResetInstances()
+        self.blogger_engine.OpenOperationLog(self.path)
+
+        self.assertNotEquals(operation_log.generation, generation)
+        self.assertEquals(self.DumpDatastore(), expected)
+
+    def test_Compact_CopiesRecordsAppendedDuringCompaction(self):
+        operation_log = self.blogger_engine.OpenOperationLog(self.path)
+        self.PopulateEngine()
+
+        compact_records = oplog.CompactRecords
+
+        def AppendDuringCompaction(model_classes):
+            for record in compact_records(model_classes):
+                yield record
+            self.blogger_engine.SubmitBlogpost('steve', 'During', 'Yo.')
+
+        with mock.patch.object(oplog, 'CompactRecords',
+                               AppendDuringCompaction):
+            operation_log.Compact(engine.MODEL_CLASSES)
+
+        expected = self.DumpDatastore()
+        self.blogger_engine.CloseOperationLog()
+
+        self.ResetInstances()
+        self.blogger_engine.OpenOperationLog(self.path)
+
+        self.assertEquals(self.DumpDatastore(), expected)
+        self.assertEquals(
+            len(self.blogger_engine.GetBlogpostsByUsername('steve')), 1)
+
+    def test_CompactOperationLog_ConcurrentWrites(self):
+        self.blogger_engine.OpenOperationLog(self.path)
+        blogpost = self.blogger_engine.SubmitBlogpost('zack', 'Hi!', 'Lorem.')
+        errors = []
+
+        def Comment():
+            try:
+                for unused_x in range(500):
+                    self.blogger_engine.SubmitComment('colin', 'Yo',
+                                                      blogpost.id)
+            except Exception as error:
+                errors.append(error)
+
+        thread = threading.Thread(target=Comment)
+        thread.start()
+        while thread.is_alive():
+            self.blogger_engine.CompactOperationLog()
+        thread.join()
+        expected = self.DumpDatastore()
+        self.blogger_engine.CloseOperationLog()
+
+        self.ResetInstances()
+        self.blogger_engine.OpenOperationLog(self.path)
+
+        self.assertEquals(errors, [])
+        self.assertEquals(self.DumpDatastore(), expected)
+
+    def test_CompactOperationLog_NoLog(self):
+        self.assertIsNone(self.blogger_engine.CompactOperationLog())
+
+if __name__ == '__main__':
+    unittest.main()
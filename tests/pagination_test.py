@@ -0,0 +1,82 @@
+#!/usr/bin/python
+
+import unittest
+from collections import OrderedDict
+
+from bloggerengine import pagination
+from bloggerengine import storage
+
+
+class PaginationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = storage.VersionedCollection(
+            ('key%02d' % index, index) for index in range(10))
+
+    def ReadAllPages(self, collection, limit):
+        results = []
+        page = pagination.Paginate(collection, limit)
+        results.extend(page)
+        while page.next_cursor is not None:
+            page = pagination.Paginate(collection, limit, page.next_cursor)
+            results.extend(page)
+        return results
+
+    def test_Paginate(self):
+        page = pagination.Paginate(self.collection, 4)
+
+        self.assertEquals(page, [0, 1, 2, 3])
+        self.assertIsNotNone(page.next_cursor)
+
+        page = pagination.Paginate(self.collection, 4, page.next_cursor)
+        self.assertEquals(page, [4, 5, 6, 7])
+
+        page = pagination.Paginate(self.collection, 4, page.next_cursor)
+        self.assertEquals(page, [8, 9])
+        self.assertIsNone(page.next_cursor)
+
+    def test_Paginate_ExactMultiple(self):
+        page = pagination.Paginate(self.collection, 5)
+        page = pagination.Paginate(self.collection, 5, page.next_cursor)
+
+        self.assertEquals(page, [5, 6, 7, 8, 9])
+        self.assertIsNone(page.next_cursor)
+
+    def test_Paginate_StableUnderWrites(self):
+        page = pagination.Paginate(self.collection, 3)
+        del self.collection['key01']
+        del self.collection['key03']
+        self.collection['key99'] = 99
+
+        page = pagination.Paginate(self.collection, 3, page.next_cursor)
+
+        self.assertEquals(page, [4, 5, 6])
+
+    def test_Paginate_PlainMapping(self):
+        mapping = OrderedDict((key, value)
+                              for key, value in self.collection.items())
+
+        self.assertEquals(self.ReadAllPages(mapping, 3), list(range(10)))
+
+    def test_Paginate_Empty(self):
+        page = pagination.Paginate(storage.VersionedCollection(), 3)
+
+        self.assertEquals(page, [])
+        self.assertIsNone(page.next_cursor)
+
+    def test_Paginate_InvalidLimit(self):
+        for limit in (0, -1):
+            self.assertRaises(ValueError, pagination.Paginate,
+                              self.collection, limit)
+
+    def test_Cursor_RoundTrip(self):
+        for storage_key in ('', 'key', u'L\xf6rem ipsum?'):
+            self.assertEquals(pagination.DecodeCursor(
+                pagination.EncodeCursor(storage_key)), storage_key)
+
+    def test_DecodeCursor_Invalid(self):
+        for cursor in ('!!!', None, '\xff'):
+            self.assertRaises(ValueError, pagination.DecodeCursor, cursor)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+
+import random
+import unittest
+
+from bloggerengine import persistent
+
+
+class PersistentMapTest(unittest.TestCase):
+
+    def test_Insert_KeepsOldVersions(self):
+        empty = persistent.PersistentMap()
+        first = empty.Insert('b', 2)
+        second = first.Insert('a', 1).Insert('b', 3)
+
+        self.assertEquals(len(empty), 0)
+        self.assertEquals(list(first.Items()), [('b', 2)])
+        self.assertEquals(list(second.Items()), [('a', 1), ('b', 3)])
+
+    def test_Remove(self):
+        mapping = persistent.PersistentMap().Insert(1, 'a').Insert(2, 'b')
+        removed = mapping.Remove(1)
+
+        self.assertEquals(list(removed), [2])
+        self.assertEquals(list(mapping), [1, 2])
+        self.assertIs(removed.Remove(5).root, removed.root)
+        self.assertEquals(len(removed.Remove(2)), 0)
+
+    def test_Get(self):
+        mapping = persistent.PersistentMap().Insert('a', None)
+
+        self.assertIsNone(mapping.Get('a', 'default'))
+        self.assertEquals(mapping.Get('b', 'default'), 'default')
+        self.assertTrue('a' in mapping)
+        self.assertFalse('b' in mapping)
+
+    def test_ManyChanges_MatchDict(self):
+        random.seed(1)
+        mapping = persistent.PersistentMap()
+        expected = {}
+        versions = []
+        for index in range(5000):
+            key = random.randrange(1000)
+            if random.random() < 0.6:
+                mapping = mapping.Insert(key, index)
+                expected[key] = index
+            else:
+                mapping = mapping.Remove(key)
+                expected.pop(key, None)
+            if index % 1000 == 0:
+                versions.append((mapping, sorted(expected.items())))
+
+        self.assertEquals(len(mapping), len(expected))
+        self.assertEquals(mapping.Values(),
+                          [expected[key] for key in sorted(expected)])
+        self.assertEquals(list(mapping.Items(500)),
+                          [(key, expected[key])
+                           for key in sorted(expected) if key >= 500])
+        for version, items in versions:
+            self.assertEquals(list(version.Items()), items)
+
+    def test_FromSortedItems(self):
+        keys = list(range(0, 10000, 2))
+        mapping = persistent.PersistentMap.FromSortedItems(keys, keys)
+
+        self.assertEquals(len(mapping), 5000)
+        self.assertEquals(list(mapping), keys)
+        self.assertEquals(mapping.Get(5000), 5000)
+        self.assertIsNone(mapping.Get(5001))
+        self.assertEquals(len(persistent.PersistentMap.FromSortedItems(
+            [], [])), 0)
+
+    def test_IterValues(self):
+        keys = list(range(1000))
+        mapping = persistent.PersistentMap.FromSortedItems(
+            keys, [key * 2 for key in keys])
+
+        self.assertEquals(list(mapping.IterValues()), mapping.Values())
+        self.assertEquals(list(persistent.PersistentMap().IterValues()), [])
+
+if __name__ == '__main__':
+    unittest.main()
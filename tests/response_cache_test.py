@@ -0,0 +1,84 @@
+#!/usr/bin/python
+
+import unittest
+
+from bloggerengine import response_cache
+
+ENTRY_SIZE = response_cache.ENTRY_OVERHEAD + response_cache.TAG_OVERHEAD
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def test_GetPut(self):
+        cache = response_cache.ResponseCache()
+
+        value, generation = cache.Get('a')
+        self.assertEquals(value, None)
+        self.assertTrue(cache.Put('a', b'response', 8, ['author/zack'],
+                                  generation))
+
+        self.assertEquals(cache.Get('a')[0], b'response')
+        stats = cache.GetStats()
+        self.assertEquals((stats['hits'], stats['misses'], stats['hit_rate'],
+                           stats['entries'], stats['bytes']),
+                          (1, 1, 0.5, 1, 8 + ENTRY_SIZE))
+
+    def test_Put_EvictsLeastRecentlyUsed(self):
+        cache = response_cache.ResponseCache(3 * (ENTRY_SIZE + 10))
+        for key in ('a', 'b', 'c'):
+            cache.Put(key, key, 10, [key], cache.Get(key)[1])
+        cache.Get('a')
+
+        cache.Put('d', 'd', 10, ['d'], cache.Get('d')[1])
+
+        self.assertEquals(cache.Get('b')[0], None)
+        self.assertEquals(cache.Get('a')[0], 'a')
+        self.assertEquals(cache.Get('d')[0], 'd')
+        self.assertEquals(cache.GetStats()['evictions'], 1)
+        self.assertNotIn('b', cache.tags)
+
+    def test_Put_TooLarge(self):
+        cache = response_cache.ResponseCache(100)
+
+        self.assertFalse(cache.Put('a', 'a', 101, [], cache.Get('a')[1]))
+        self.assertEquals(cache.Get('a')[0], None)
+
+    def test_Put_Disabled(self):
+        cache = response_cache.ResponseCache(0)
+
+        self.assertFalse(cache.Put('a', 'a', 1, [], cache.Get('a')[1]))
+
+    def test_Put_StaleGeneration(self):
+        cache = response_cache.ResponseCache()
+        unused_value, generation = cache.Get('a')
+
+        cache.Invalidate(['author/zack'])
+
+        self.assertFalse(cache.Put('a', 'a', 1, ['author/zack'], generation))
+        self.assertEquals(cache.Get('a')[0], None)
+
+    def test_Invalidate(self):
+        cache = response_cache.ResponseCache()
+        cache.Put('a', 'a', 1, ['author/zack', 'blogposts'],
+                  cache.Get('a')[1])
+        cache.Put('b', 'b', 1, ['author/colin'], cache.Get('b')[1])
+
+        cache.Invalidate(['blogposts', 'comments'])
+
+        self.assertEquals(cache.Get('a')[0], None)
+        self.assertEquals(cache.Get('b')[0], 'b')
+        self.assertEquals(cache.GetStats()['invalidations'], 1)
+        self.assertEquals(sorted(cache.tags), ['author/colin'])
+
+    def test_Clear(self):
+        cache = response_cache.ResponseCache()
+        cache.Put('a', 'a', 1, ['author/zack'], cache.Get('a')[1])
+
+        cache.Clear()
+
+        self.assertEquals(cache.Get('a')[0], None)
+        self.assertEquals((cache.size, cache.tags), (0, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,20 +1,32 @@
 #!/usr/bin/python
 
+import datetime
+import gzip
+import mock
+import threading
+import time
 import unittest
 import json
+import zlib
 
 from bloggerengine import author as author_model
 from bloggerengine import base_model
 from bloggerengine import blogpost as blogpost_model
 from bloggerengine import comment as comment_model
+from bloggerengine import compression
+from bloggerengine import formats
 from bloggerengine import label as label_model
+from bloggerengine import response_cache
 from bloggerengine import server
+from bloggerengine import single_flight
 
 
 class ServerTest(unittest.TestCase):
 
     def setUp(self):
         self.app = server.app.test_client()
+        server.response_cache = response_cache.ResponseCache()
+        server.single_flight = single_flight.SingleFlight()
 
         author_model.Author.instances = {}
         base_model.BaseModel.instances = {}
@@ -167,6 +179,19 @@ class ServerTest(unittest.TestCase):
         self.assertEquals(response_data['blogposts'], expected_blogposts)
         self.assertEquals(response_data['author'], expected_author)
 
+    def test_author_get_all_blogposts_paginated(self):
+        post_data = {'username': 'zack', 'limit': 1}
+        response = self.app.post('/author/get_all_blogposts',
+                                 data=json.dumps(post_data),
+                                 content_type='application/json')
+        self.assertEquals(response.status_code, 200)
+
+        response_data = json.loads(response.get_data(as_text=True))
+
+        self.assertEquals(response_data['blogposts'],
+                          [self.blogposts[0].ToJson()])
+        self.assertIsNotNone(response_data['next_cursor'])
+
     def test_author_get_all_blogposts_unsuccessful(self):
         post_data = {'username': ''}
         response = self.app.post('/author/get_all_blogposts',
@@ -213,6 +238,21 @@ class ServerTest(unittest.TestCase):
         self.assertEquals(response_data['author'], expected_author)
         self.assertEquals(response_data['comments'], expected_comments)
 
+    def test_author_get_all_comments_normalized(self):
+        post_data = {'username': 'colin', 'normalize': True}
+        response = self.app.post('/author/get_all_comments',
+                                 data=json.dumps(post_data),
+                                 content_type='application/json')
+        self.assertEquals(response.status_code, 200)
+        response_data = json.loads(response.get_data(as_text=True))
+
+        self.assertEquals(response_data['author'], 'colin')
+        self.assertEquals(response_data['comments'],
+                          [self.comments[0].id, self.comments[1].id])
+        self.assertEquals(sorted(response_data['entities']['authors']),
+                          ['colin', 'zack'])
+        self.assertEquals(len(response_data['entities']['blogposts']), 2)
+
     def test_author_get_all_comments_usernotfound(self):
         post_data = {'username': 'steve'}
         response = self.app.post('/author/get_all_comments',
@@ -555,6 +595,315 @@ class ServerTest(unittest.TestCase):
         self.assertEquals(response_data['blogpost'],
                           expected_blogpost.ToJson())
 
+    def test_blogpost_get_by_id_encodesunderreadlock(self):
+        lock = server.blogger_engine.locks.locks['Blogpost']
+        held = []
+        to_encoded = blogpost_model.Blogpost.ToEncoded
+
+        def ToEncoded(blogpost, *args, **kwargs):
+            held.append(bool(lock.readers))
+            return to_encoded(blogpost, *args, **kwargs)
+
+        with mock.patch.object(blogpost_model.Blogpost, 'ToEncoded',
+                               ToEncoded):
+            response = self.app.post(
+                '/blogpost/get_by_id',
+                data=json.dumps({'blogpost_id': self.blogposts[0].id}),
+                content_type='application/json')
+
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(held, [True])
+
+    def test_blogpost_get_by_ids(self):
+        blogpost1, blogpost2, blogpost3 = self.blogposts
+        post_data = {'blogpost_ids': [blogpost3.id, '12345', blogpost1.id,
+                                      blogpost2.id]}
+        response = self.app.post('/blogpost/get_by_ids',
+                                 data=json.dumps(post_data),
+                                 content_type='application/json')
+        self.assertEquals(response.status_code, 200)
+
+        response_data = json.loads(response.get_data(as_text=True))
+
+        self.assertEquals(response_data['blogposts'],
+                          [blogpost3.id, None, blogpost1.id, blogpost2.id])
+        self.assertEquals(sorted(response_data['entities']['authors']),
+                          ['colin', 'zack'])
+        self.assertEquals(
+            response_data['entities']['blogposts'][blogpost1.id],
+            blogpost1.ToJson(normalized=True))
+
+    def test_blogpost_get_by_ids_notnormalized(self):
+        blogpost1 = self.blogposts[0]
+        response = self.app.get('/blogpost/get_by_ids?blogpost_ids=12345,%s'
+                                '&normalize=0' % blogpost1.id)
+        self.assertEquals(response.status_code, 200)
+
+        response_data = json.loads(response.get_data(as_text=True))
+
+        self.assertEquals(response_data['blogposts'],
+                          [None, blogpost1.ToJson()])
+        self.assertNotIn('entities', response_data)
+
+    def test_blogpost_get_by_ids_invalid(self):
+        for post_data in ({}, {'blogpost_ids': 1}):
+            response = self.app.post('/blogpost/get_by_ids',
+                                     data=json.dumps(post_data),
+                                     content_type='application/json')
+            self.assertEquals(response.status_code, 400)
+
+    def test_comment_get_by_ids(self):
+        comment1, unused_comment2, comment3 = self.comments
+        post_data = {'comment_ids': [comment3.id, comment1.id, '12345'],
+                     'normalize': False}
+        response = self.app.post('/comment/get_by_ids',
+                                 data=json.dumps(post_data),
+                                 content_type='application/json')
+        self.assertEquals(response.status_code, 200)
+
+        response_data = json.loads(response.get_data(as_text=True))
+
+        self.assertEquals(response_data['comments'],
+                          [comment3.ToJson(), comment1.ToJson(), None])
+
+    def test_author_get_by_usernames(self):
+        response = self.app.get('/author/get_by_usernames?'
+                                'usernames=zack,steve,colin')
+        self.assertEquals(response.status_code, 200)
+
+        response_data = json.loads(response.get_data(as_text=True))
+
+        self.assertEquals(response_data['authors'],
+                          [self.authors[1].ToJson(), None,
+                           self.authors[0].ToJson()])
+
+    def test_label_get_by_ids(self):
+        post_data = {'label_texts': ['funny', 'sad']}
+        response = self.app.post('/label/get_by_ids',
+                                 data=json.dumps(post_data),
+                                 content_type='application/json')
+        self.assertEquals(response.status_code, 200)
+
+        response_data = json.loads(response.get_data(as_text=True))
+
+        self.assertEquals(response_data['labels'],
+                          [self.labels[1].ToJson(), None])
+
+    def test_label_get_by_ids_cachedmiss(self):
+        url = '/label/get_by_ids?label_texts=funny,sad'
+        self.app.get(url)
+
+        self.app.post('/label/create',
+                      data=json.dumps({'label_text': 'happy'}),
+                      content_type='application/json')
+        self.app.get(url)
+        self.assertEquals(server.response_cache.GetStats()['hits'], 1)
+
+        self.app.post('/label/create',
+                      data=json.dumps({'label_text': 'sad'}),
+                      content_type='application/json')
+        response_data = json.loads(self.app.get(url).get_data(as_text=True))
+
+        self.assertEquals(response_data['labels'][1]['label'], 'sad')
+
+    def test_blogpost_get_by_id_include(self):
+        expected_blogpost = self.blogposts[0]
+        post_data = {'blogpost_id': expected_blogpost.id,
+                     'include': ['comments', 'labels', 'comments.author']}
+        response = self.app.post('/blogpost/get_by_id',
+                                 data=json.dumps(post_data),
+                                 content_type='application/json')
+        self.assertEquals(response.status_code, 200)
+
+        response_data = json.loads(response.get_data(as_text=True))
+
+        comment = self.comments[0]
+        self.assertEquals(response_data['blogpost'],
+                          expected_blogpost.ToJson(normalized=True))
+        self.assertEquals(response_data['included'], {
+            'comments': {comment.id: comment.ToJson(normalized=True)},
+            'labels': {'intro': self.labels[0].ToJson(normalized=True),
+                       'good stuff': self.labels[2].ToJson(normalized=True)},
+            'authors': {'colin': self.authors[0].ToJson(normalized=True),
+                        'zack': self.authors[1].ToJson(normalized=True)}
+        })
+
+    @unittest.skipUnless(formats.MESSAGEPACK.available, 'msgpack missing')
+    def test_blogpost_get_by_id_msgpack(self):
+        expected_blogpost = self.blogposts[0]
+        response = self.app.post(
+            '/blogpost/get_by_id',
+            data=formats.MESSAGEPACK.Encode(
+                {'blogpost_id': expected_blogpost.id}),
+            content_type='application/msgpack',
+            headers={'Accept': 'application/msgpack'})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.mimetype, 'application/msgpack')
+        self.assertIn('Accept', response.headers['Vary'])
+
+        result = formats.MESSAGEPACK.Decode(response.get_data())['blogpost']
+
+        self.assertEquals(result['id'], expected_blogpost.id)
+        self.assertEquals(
+            result['created_timestamp'],
+            expected_blogpost.created_timestamp.replace(tzinfo=formats.UTC))
+        self.assertEquals(
+            result['author']['created_timestamp'],
+            self.authors[1].created_timestamp.replace(tzinfo=formats.UTC))
+        self.assertEquals(result['labels'], ['intro', 'good stuff'])
+
+    @unittest.skipUnless(formats.MESSAGEPACK.available, 'msgpack missing')
+    def test_blogpost_get_by_id_invalidmsgpack(self):
+        response = self.app.post('/blogpost/get_by_id', data=b'\xc1',
+                                 content_type='application/msgpack')
+
+        self.assertEquals(response.status_code, 400)
+
+    @unittest.skipUnless(formats.CBOR.available, 'cbor2 missing')
+    def test_blogpost_get_all_cbor(self):
+        response = self.app.get('/blogpost/get_all?normalize=1&include=labels',
+                                headers={'Accept': 'application/cbor'})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.mimetype, 'application/cbor')
+
+        result = formats.CBOR.Decode(response.get_data())
+        json_result = json.loads(self.app.get(
+            '/blogpost/get_all?normalize=1&include=labels').get_data(
+                as_text=True))
+
+        self.assertEquals(result['blogposts'], json_result['blogposts'])
+        self.assertEquals(sorted(result['entities']),
+                          sorted(json_result['entities']))
+        self.assertEquals(sorted(result['entities']['labels']),
+                          sorted(json_result['entities']['labels']))
+        self.assertIsInstance(
+            result['entities']['authors']['zack']['created_timestamp'],
+            datetime.datetime)
+
+    def test_blogpost_get_all_formatunavailable(self):
+        with mock.patch.object(formats.MESSAGEPACK, 'available', False):
+            response = self.app.get('/blogpost/get_all',
+                                    headers={'Accept': 'application/msgpack'})
+            self.assertEquals(response.status_code, 406)
+
+            response = self.app.get(
+                '/blogpost/get_all',
+                headers={'Accept': 'application/msgpack, */*;q=0.1'})
+            self.assertEquals(response.status_code, 200)
+            self.assertEquals(response.mimetype, 'application/json')
+
+            response = self.app.post('/blogpost/get_by_id', data=b'\x80',
+                                     content_type='application/msgpack')
+            self.assertEquals(response.status_code, 415)
+
+    def test_blogpost_get_by_id_include_normalized(self):
+        expected_blogpost = self.blogposts[0]
+        response = self.app.get(
+            '/blogpost/get_by_id?blogpost_id=%s&include=comments.author'
+            '&normalize=1' % expected_blogpost.id)
+        self.assertEquals(response.status_code, 405)
+
+        post_data = {'blogpost_id': expected_blogpost.id,
+                     'include': 'comments.author', 'normalize': True}
+        response = self.app.post('/blogpost/get_by_id',
+                                 data=json.dumps(post_data),
+                                 content_type='application/json')
+        self.assertEquals(response.status_code, 200)
+
+        response_data = json.loads(response.get_data(as_text=True))
+
+        entities = response_data['entities']
+        self.assertEquals(response_data['blogpost'], expected_blogpost.id)
+        self.assertNotIn('included', response_data)
+        self.assertEquals(list(entities['comments']), [self.comments[0].id])
+        self.assertEquals(sorted(entities['authors']), ['colin', 'zack'])
+        self.assertEquals(list(entities['blogposts']),
+                          [expected_blogpost.id])
+
+    def test_blogpost_get_by_id_get(self):
+        expected_blogpost = self.blogposts[0]
+        expected = self.app.post(
+            '/blogpost/get_by_id',
+            data=json.dumps({'blogpost_id': expected_blogpost.id}),
+            content_type='application/json')
+
+        response = self.app.get('/blogposts/%s' % expected_blogpost.id)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.get_data(), expected.get_data())
+        self.assertNotIn('Surrogate-Key', expected.headers)
+        self.assertNotIn('Cache-Control', expected.headers)
+
+        self.assertEquals(response.headers['Surrogate-Key'],
+                          'author/zack blogpost/%s' % expected_blogpost.id)
+        self.assertTrue(response.cache_control.public)
+        self.assertEquals(response.cache_control.max_age, 0)
+        self.assertEquals(response.cache_control.s_maxage, 60)
+        self.assertEquals(set(response.vary),
+                          set(['Accept', 'Accept-Encoding']))
+
+        response = self.app.get(
+            '/blogposts/%s' % expected_blogpost.id,
+            headers={'If-None-Match': response.headers['ETag']})
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(response.cache_control.s_maxage, 60)
+
+    def test_blogpost_get_by_id_get_include(self):
+        comment = self.comments[0]
+        response = self.app.get('/blogposts/%s?include=comments.author' %
+                                self.blogposts[0].id)
+
+        self.assertEquals(
+            response.headers['Surrogate-Key'].split(),
+            sorted(['author/colin', 'author/zack',
+                    'blogpost/%s' % self.blogposts[0].id,
+                    'comment/%s' % comment.id]))
+
+    def test_blogpost_get_by_id_get_notfound(self):
+        response = self.app.get('/blogposts/12345')
+
+        self.assertEquals(response.status_code, 200)
+        self.assertIsNone(
+            json.loads(response.get_data(as_text=True))['blogpost'])
+        self.assertEquals(response.headers['Surrogate-Key'],
+                          'authors blogposts')
+
+    def test_get_variants(self):
+        blogpost_id = self.blogposts[0].id
+        comment_id = self.comments[0].id
+        for path, url, post_data in (
+                ('/authors/zack', '/author/get_by_username',
+                 {'username': 'zack'}),
+                ('/authors/zack/blogposts?limit=1',
+                 '/author/get_all_blogposts',
+                 {'username': 'zack', 'limit': 1}),
+                ('/authors/zack/removed_blogposts',
+                 '/author/get_all_removed_blogposts', {'username': 'zack'}),
+                ('/authors/colin/comments', '/author/get_all_comments',
+                 {'username': 'colin'}),
+                ('/authors/colin/removed_comments',
+                 '/author/get_all_removed_comments', {'username': 'colin'}),
+                ('/blogposts/%s/comments' % blogpost_id,
+                 '/blogpost/get_all_comments', {'blogpost_id': blogpost_id}),
+                ('/blogposts/%s/labels' % blogpost_id,
+                 '/blogpost/get_all_labels', {'blogpost_id': blogpost_id}),
+                ('/labels/good%20stuff/blogposts', '/blogpost/get_by_label',
+                 {'label_text': 'good stuff'}),
+                ('/labels/intro', '/label/get_by_id',
+                 {'label_text': 'intro'}),
+                ('/comments/%s' % comment_id, '/comment/get_by_id',
+                 {'comment_id': comment_id})):
+            response = self.app.get(path)
+            expected = self.app.post(url, data=json.dumps(post_data),
+                                     content_type='application/json')
+
+            self.assertEquals(response.status_code, 200)
+            self.assertEquals(response.get_data(), expected.get_data())
+            self.assertIn('Surrogate-Key', response.headers)
+
+        response = self.app.get('/authors/zack/blogposts?limit=1')
+        self.assertEquals(response.headers['Surrogate-Key'],
+                          'authors blogposts')
+
     def test_blogpost_get_by_id_unsuccessful(self):
         post_data = {'blogpost_id': ''}
         response = self.app.post('/blogpost/get_by_id',
@@ -728,6 +1077,371 @@ class ServerTest(unittest.TestCase):
         self.assertEquals(response_data['blogposts'],
                           expected_blogposts_json)
 
+    def test_blogpost_get_all_paginated(self):
+        post_data = {'limit': 2}
+        response = self.app.post('/blogpost/get_all',
+                                 data=json.dumps(post_data),
+                                 content_type='application/json')
+        self.assertEquals(response.status_code, 200)
+
+        first_page = json.loads(response.get_data(as_text=True))
+
+        post_data = {'limit': 2, 'cursor': first_page['next_cursor']}
+        response = self.app.post('/blogpost/get_all',
+                                 data=json.dumps(post_data),
+                                 content_type='application/json')
+        self.assertEquals(response.status_code, 200)
+
+        second_page = json.loads(response.get_data(as_text=True))
+
+        expected_blogposts_json = [blogpost.ToJson()
+                                   for blogpost in self.blogposts]
+        self.assertEquals(first_page['blogposts'] + second_page['blogposts'],
+                          expected_blogposts_json)
+        self.assertIsNone(second_page['next_cursor'])
+
+    def test_blogpost_get_all_get_paginated(self):
+        response = self.app.get('/blogpost/get_all?limit=1')
+        self.assertEquals(response.status_code, 200)
+
+        response_data = json.loads(response.get_data(as_text=True))
+
+        self.assertEquals(response_data['blogposts'],
+                          [self.blogposts[0].ToJson()])
+        self.assertIsNotNone(response_data['next_cursor'])
+
+    def test_blogpost_get_all_invalidpagination(self):
+        for post_data in ({'limit': 0}, {'limit': 'ten'},
+                          {'cursor': '!not a cursor!'}):
+            response = self.app.post('/blogpost/get_all',
+                                     data=json.dumps(post_data),
+                                     content_type='application/json')
+            self.assertEquals(response.status_code, 400)
+
+    def test_blogpost_get_all_fields(self):
+        post_data = {'fields': ['id', 'headline', 'author.username']}
+        response = self.app.post('/blogpost/get_all',
+                                 data=json.dumps(post_data),
+                                 content_type='application/json')
+        self.assertEquals(response.status_code, 200)
+
+        response_data = json.loads(response.get_data(as_text=True))
+
+        self.assertEquals(response_data['blogposts'], [
+            {'id': blogpost.id, 'headline': blogpost.headline,
+             'author': {'username': blogpost.author.username}}
+            for blogpost in self.blogposts])
+
+    def test_blogpost_get_all_get_fields(self):
+        response = self.app.get(
+            '/blogpost/get_all?fields=id,created_timestamp&limit=1')
+        self.assertEquals(response.status_code, 200)
+
+        response_data = json.loads(response.get_data(as_text=True))
+
+        blogpost = self.blogposts[0]
+        self.assertEquals(response_data['blogposts'], [
+            {'id': blogpost.id,
+             'created_timestamp': str(blogpost.created_timestamp)}])
+        self.assertIsNotNone(response_data['next_cursor'])
+
+    def test_blogpost_get_all_stream_fields(self):
+        response = self.app.get('/blogpost/get_all?stream=ndjson&fields=id')
+        self.assertEquals(response.status_code, 200)
+
+        self.assertEquals(
+            [json.loads(line) for line in
+             response.get_data(as_text=True).splitlines()],
+            [{'id': blogpost.id} for blogpost in self.blogposts])
+
+    def test_blogpost_get_all_invalidfields(self):
+        for post_data in ({'fields': 7}, {'fields': ['id', None]},
+                          {'fields': 'id,'}):
+            response = self.app.post('/blogpost/get_all',
+                                     data=json.dumps(post_data),
+                                     content_type='application/json')
+            self.assertEquals(response.status_code, 400)
+
+    def test_blogpost_get_all_stream_json(self):
+        post_data = {'stream': 'json'}
+        response = self.app.post('/blogpost/get_all',
+                                 data=json.dumps(post_data),
+                                 content_type='application/json')
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEquals(response.mimetype, 'application/json')
+
+        response_data = json.loads(response.get_data(as_text=True))
+
+        expected_blogposts_json = [blogpost.ToJson()
+                                   for blogpost in self.blogposts]
+        self.assertEquals(response_data, {'blogposts':
+                                          expected_blogposts_json})
+
+    def test_blogpost_get_all_stream_ndjson(self):
+        response = self.app.get('/blogpost/get_all?stream=ndjson')
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.mimetype, 'application/x-ndjson')
+
+        lines = response.get_data(as_text=True).split('\n')
+
+        expected_blogposts_json = [blogpost.ToJson()
+                                   for blogpost in self.blogposts]
+        self.assertEquals([json.loads(line) for line in lines[:-1]],
+                          expected_blogposts_json)
+        self.assertEquals(lines[-1], '')
+
+    def test_blogpost_get_all_stream_concurrenttransaction(self):
+        blogpost = self.blogposts[1]
+        added = threading.Event()
+        to_encoded_json = blogpost_model.Blogpost.ToEncodedJson
+
+        def RollBack():
+            try:
+                with server.blogger_engine.Transaction():
+                    server.blogger_engine.SubmitComment('colin', 'Draft',
+                                                        blogpost.id)
+                    added.set()
+                    time.sleep(0.2)
+                    raise RuntimeError('Rolled back')
+            except RuntimeError:
+                pass
+
+        writer = threading.Thread(target=RollBack)
+
+        def ToEncodedJson(instance, *args, **kwargs):
+            if not writer.is_alive() and not added.is_set():
+                writer.start()
+                added.wait(0.2)
+            return to_encoded_json(instance, *args, **kwargs)
+
+        with mock.patch.object(blogpost_model.Blogpost, 'ToEncodedJson',
+                               ToEncodedJson):
+            response = self.app.get('/blogpost/get_all?stream=ndjson')
+            lines = response.get_data(as_text=True).splitlines()
+        writer.join()
+
+        self.assertEquals([json.loads(line)['comments'] for line in lines],
+                          [[comment.id for comment in instance.GetComments()]
+                           for instance in self.blogposts])
+        self.assertEquals(len(blogpost.GetComments()), 1)
+
+    def test_blogpost_get_all_stream_accept(self):
+        response = self.app.get('/blogpost/get_all',
+                                headers={'Accept': 'application/x-ndjson'})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.mimetype, 'application/x-ndjson')
+        self.assertEquals(
+            len(response.get_data(as_text=True).splitlines()), 3)
+
+    def test_blogpost_get_all_stream_chunked(self):
+        with mock.patch.object(server, 'STREAM_CHUNK_SIZE', 1):
+            response = self.app.get('/blogpost/get_all?stream=json')
+            chunks = list(response.response)
+
+        self.assertEquals(len(chunks), 4)
+        response_data = json.loads(b''.join(chunks).decode('utf-8'))
+        self.assertEquals(len(response_data['blogposts']), 3)
+
+    def test_blogpost_get_all_gzip(self):
+        expected = self.app.get('/blogpost/get_all').get_data()
+        cache = compression.CompressionCache()
+
+        with mock.patch.object(server, 'compression_cache', cache):
+            response = self.app.get('/blogpost/get_all',
+                                    headers={'Accept-Encoding': 'gzip'})
+            again = self.app.get('/blogpost/get_all',
+                                 headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEquals(gzip.decompress(response.get_data()), expected)
+        self.assertEquals(again.get_data(), response.get_data())
+        self.assertEquals((cache.hits, cache.misses), (1, 1))
+
+    def test_blogpost_get_all_deflate(self):
+        expected = self.app.get('/blogpost/get_all').get_data()
+
+        response = self.app.get(
+            '/blogpost/get_all',
+            headers={'Accept-Encoding': 'deflate, gzip;q=0.5'})
+
+        self.assertEquals(response.headers['Content-Encoding'], 'deflate')
+        self.assertEquals(zlib.decompress(response.get_data()), expected)
+
+    def test_blogpost_get_all_compression_threshold(self):
+        with mock.patch.object(server, 'COMPRESSION_MIN_BYTES', 1 << 20):
+            response = self.app.get('/blogpost/get_all',
+                                    headers={'Accept-Encoding': 'gzip'})
+
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEquals(
+            len(json.loads(response.get_data(as_text=True))['blogposts']), 3)
+
+    def test_blogpost_get_all_stream_gzip(self):
+        with mock.patch.object(server, 'STREAM_CHUNK_SIZE', 1):
+            response = self.app.get('/blogpost/get_all?stream=ndjson',
+                                    headers={'Accept-Encoding': 'gzip'})
+            data = b''.join(response.response)
+
+        self.assertEquals(response.headers['Content-Encoding'], 'gzip')
+        self.assertEquals(
+            len(gzip.decompress(data).decode('utf-8').splitlines()), 3)
+
+    def test_blogpost_get_all_etag(self):
+        response = self.app.get('/blogpost/get_all')
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+
+        with mock.patch.object(blogpost_model.Blogpost,
+                               'ToEncoded') as to_encoded:
+            response = self.app.get('/blogpost/get_all',
+                                    headers={'If-None-Match': etag})
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(response.get_data(), b'')
+        self.assertEquals(response.headers['ETag'], etag)
+        self.assertFalse(to_encoded.called)
+
+        response = self.app.get('/blogpost/get_all',
+                                headers={'If-None-Match': etag,
+                                         'Accept': 'application/x-ndjson'})
+        self.assertEquals(response.status_code, 200)
+
+        self.app.post('/blogpost/add_label',
+                      data=json.dumps({'blogpost_id': self.blogposts[0].id,
+                                       'label_text': 'funny'}),
+                      content_type='application/json')
+        response = self.app.get('/blogpost/get_all',
+                                headers={'If-None-Match': etag})
+        self.assertEquals(response.status_code, 200)
+        self.assertNotEquals(response.headers['ETag'], etag)
+
+    def test_label_get_all_etag_ignoresotherkinds(self):
+        etag = self.app.get('/label/get_all').headers['ETag']
+
+        self.app.post('/blogpost/create',
+                      data=json.dumps({'username': 'zack', 'headline': 'Hi',
+                                       'body': 'Again.'}),
+                      content_type='application/json')
+        response = self.app.get('/label/get_all',
+                                headers={'If-None-Match': etag})
+        self.assertEquals(response.status_code, 304)
+
+        response = self.app.get('/label/get_all?include=blogposts',
+                                headers={'If-None-Match': etag})
+        self.assertEquals(response.status_code, 200)
+
+    def test_blogpost_create_noetag(self):
+        response = self.app.post(
+            '/blogpost/create',
+            data=json.dumps({'username': 'zack', 'headline': 'Hi',
+                             'body': 'Again.'}),
+            content_type='application/json')
+
+        self.assertEquals(response.status_code, 200)
+        self.assertNotIn('ETag', response.headers)
+
+    def test_response_cache(self):
+        blogpost_id = self.blogposts[0].id
+        url = '/blogposts/%s' % blogpost_id
+        expected = self.app.get(url).get_data()
+
+        with mock.patch.object(blogpost_model.Blogpost,
+                               'ToEncoded') as to_encoded:
+            response = self.app.get(url)
+            self.assertEquals(response.get_data(), expected)
+            self.assertIn('blogpost/%s' % blogpost_id,
+                          response.headers['Surrogate-Key'])
+            self.assertFalse(to_encoded.called)
+
+        response = self.app.get('/admin/response_cache')
+        stats = json.loads(response.get_data(as_text=True))['response_cache']
+        self.assertEquals((stats['hits'], stats['misses'], stats['entries']),
+                          (1, 1, 1))
+
+    def test_response_cache_invalidated(self):
+        blogpost_url = '/blogposts/%s' % self.blogposts[0].id
+        author_url = '/authors/colin'
+        self.app.get(blogpost_url)
+        self.app.get(author_url)
+
+        self.app.post('/blogpost/add_label',
+                      data=json.dumps({'blogpost_id': self.blogposts[0].id,
+                                       'label_text': 'new'}),
+                      content_type='application/json')
+
+        response_data = json.loads(
+            self.app.get(blogpost_url).get_data(as_text=True))
+        self.assertIn('new', response_data['blogpost']['labels'])
+        stats = server.response_cache.GetStats()
+        self.assertEquals((stats['hits'], stats['invalidations']), (0, 1))
+
+        self.app.get(author_url)
+        self.assertEquals(server.response_cache.GetStats()['hits'], 1)
+
+    def test_response_cache_notfound(self):
+        post_data = {'username': 'steve'}
+        self.app.post('/author/get_by_username',
+                      data=json.dumps(post_data),
+                      content_type='application/json')
+
+        self.app.post('/author/create',
+                      data=json.dumps(post_data),
+                      content_type='application/json')
+        response = self.app.post('/author/get_by_username',
+                                 data=json.dumps(post_data),
+                                 content_type='application/json')
+        response_data = json.loads(response.get_data(as_text=True))
+
+        self.assertEquals(response_data['author']['username'], 'steve')
+
+    def test_single_flight(self):
+        url = '/blogposts/%s/comments' % self.blogposts[0].id
+        expected = self.app.get(url).get_data()
+        server.response_cache = response_cache.ResponseCache(0)
+        get_comments = server.blogger_engine.GetCommentsByBlogpost
+        release = threading.Event()
+        responses = []
+
+        def GetComments(*args):
+            release.wait(5)
+            return get_comments(*args)
+
+        def Get():
+            responses.append(server.app.test_client().get(url))
+
+        with mock.patch.object(server.blogger_engine, 'GetCommentsByBlogpost',
+                               side_effect=GetComments) as patched:
+            threads = [threading.Thread(target=Get) for unused_x in range(4)]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            deadline = time.time() + 5
+            while (server.single_flight.GetStats()['waiting'] < 3 and
+                   time.time() < deadline):
+                time.sleep(0.001)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+
+        self.assertEquals(patched.call_count, 1)
+        self.assertEquals([response.get_data() for response in responses],
+                          [expected] * 4)
+        self.assertTrue(all(response.headers['Surrogate-Key']
+                            for response in responses))
+
+        response = self.app.get('/admin/single_flight')
+        stats = json.loads(response.get_data(as_text=True))['single_flight']
+        self.assertEquals((stats['calls'], stats['coalesced']), (2, 3))
+
+    def test_blogpost_get_all_stream_invalid(self):
+        for post_data in ({'stream': 'xml'}, {'stream': 'json', 'limit': 1}):
+            response = self.app.post('/blogpost/get_all',
+                                     data=json.dumps(post_data),
+                                     content_type='application/json')
+            self.assertEquals(response.status_code, 400)
+
     def test_blogpost_remove_successful(self):
         expected_blogpost = self.blogposts[0]
         expected_author = self.authors[1]
@@ -1015,6 +1729,133 @@ class ServerTest(unittest.TestCase):
         self.assertEquals(response_data['comments'],
                           expected_comments_json)
 
+    def test_comments_get_all_stream_ndjson(self):
+        post_data = {'stream': 'ndjson'}
+        response = self.app.post('/comment/get_all',
+                                 data=json.dumps(post_data),
+                                 content_type='application/json')
+        self.assertEquals(response.status_code, 200)
+
+        expected_comments_json = [comment.ToJson()
+                                  for comment in self.comments]
+        self.assertEquals(
+            [json.loads(line) for line in
+             response.get_data(as_text=True).splitlines()],
+            expected_comments_json)
+
+    def test_comment_get_by_id_fields(self):
+        expected_comment = self.comments[0]
+        post_data = {'comment_id': expected_comment.id,
+                     'fields': ['comment_text', 'blogpost.id']}
+        response = self.app.post('/comment/get_by_id',
+                                 data=json.dumps(post_data),
+                                 content_type='application/json')
+        self.assertEquals(response.status_code, 200)
+        response_data = json.loads(response.get_data(as_text=True))
+
+        self.assertEquals(response_data['comment'], {
+            'comment_text': expected_comment.comment_text,
+            'blogpost': {'id': expected_comment.blogpost.id}
+        })
+
+    def test_comments_get_all_normalized(self):
+        response = self.app.get('/comment/get_all?normalize=true')
+        self.assertEquals(response.status_code, 200)
+        response_data = json.loads(response.get_data(as_text=True))
+
+        self.assertEquals(response_data['comments'],
+                          [comment.id for comment in self.comments])
+        entities = response_data['entities']
+        self.assertEquals(sorted(entities['authors']), ['colin', 'zack'])
+        self.assertEquals(entities['authors']['zack'],
+                          self.authors[1].ToJson())
+        self.assertEquals(sorted(entities['blogposts']),
+                          sorted(blogpost.id for blogpost in self.blogposts))
+        self.assertNotIn('labels', entities)
+
+        comment = self.comments[0]
+        expected_comment_json = dict(comment.ToJson(),
+                                     author='colin',
+                                     blogpost=comment.blogpost.id)
+        self.assertEquals(entities['comments'][comment.id],
+                          expected_comment_json)
+        self.assertEquals(
+            entities['blogposts'][comment.blogpost.id]['author'], 'zack')
+
+    def test_comments_get_all_normalized_fields(self):
+        post_data = {'normalize': True, 'fields': ['id', 'blogpost.id']}
+        response = self.app.post('/comment/get_all',
+                                 data=json.dumps(post_data),
+                                 content_type='application/json')
+        self.assertEquals(response.status_code, 200)
+        response_data = json.loads(response.get_data(as_text=True))
+
+        comment = self.comments[0]
+        self.assertEquals(sorted(response_data['entities']),
+                          ['blogposts', 'comments'])
+        self.assertEquals(response_data['entities']['comments'][comment.id],
+                          {'id': comment.id, 'blogpost': comment.blogpost.id})
+        self.assertEquals(
+            response_data['entities']['blogposts'][comment.blogpost.id],
+            {'id': comment.blogpost.id})
+
+    def test_comments_get_all_include(self):
+        response = self.app.get('/comment/get_all?include=author,unknown')
+        self.assertEquals(response.status_code, 200)
+        response_data = json.loads(response.get_data(as_text=True))
+
+        self.assertEquals(response_data['included'], {
+            'authors': dict((author.username, author.ToJson(normalized=True))
+                            for author in self.authors),
+            'blogposts': dict((blogpost.id, blogpost.ToJson(normalized=True))
+                              for blogpost in self.blogposts)
+        })
+
+    def test_comments_get_all_include_serializesonce(self):
+        blogpost = self.blogposts[1]
+        for text in ('Me too.', 'Same.'):
+            comment_model.Comment(self.authors[0], blogpost, text).put()
+
+        response = self.app.get(
+            '/comment/get_all?include=blogpost.author,author')
+        self.assertEquals(response.status_code, 200)
+        payload = response.get_data(as_text=True)
+        response_data = json.loads(payload)
+
+        self.assertEquals(payload.count(json.dumps(blogpost.headline)), 1)
+        for author in self.authors:
+            self.assertEquals(
+                payload.count('"username":%s' % json.dumps(author.username)),
+                1)
+        self.assertEquals(
+            [comment['blogpost'] for comment in response_data['comments']
+             if comment['blogpost'] == blogpost.id], [blogpost.id] * 3)
+        self.assertEquals(sorted(response_data['included']),
+                          ['authors', 'blogposts'])
+
+    def test_comments_get_all_include_expandsonce(self):
+        get_related = author_model.Author.GetRelated
+
+        with mock.patch.object(author_model.Author, 'GetRelated',
+                               autospec=True,
+                               side_effect=get_related) as patched:
+            response = self.app.get(
+                '/comment/get_all?include=author.blogposts')
+
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue(len(self.comments) > len(self.authors))
+        self.assertEquals(sorted(call[0][0].username
+                                 for call in patched.call_args_list),
+                          sorted(author.username for author in self.authors))
+        response_data = json.loads(response.get_data(as_text=True))
+        self.assertEquals(len(response_data['included']['blogposts']),
+                          len(self.blogposts))
+
+    def test_comments_get_all_invalidnormalize(self):
+        for query_string in ('normalize=maybe', 'normalize=1&stream=json'):
+            response = self.app.get('/comment/get_all?' + query_string)
+            self.assertEquals(response.status_code, 400)
+
     def test_comments_get_all_comments_nocomments(self):
         comment_model.Comment.instances = {}
 
@@ -1064,6 +1905,14 @@ class ServerTest(unittest.TestCase):
 
         self.assertEquals(response_data['labels'], [])
 
+    def test_label_get_all_stream_nolabels(self):
+        label_model.Label.instances = {}
+        response = self.app.get('/label/get_all?stream=json')
+        self.assertEquals(response.status_code, 200)
+        response_data = json.loads(response.get_data(as_text=True))
+
+        self.assertEquals(response_data, {'labels': []})
+
     def test_label_get_all_get(self):
         response = self.app.get('/label/get_all',
                                 content_type='application/json')
@@ -1291,5 +2140,165 @@ class ServerTest(unittest.TestCase):
                                  content_type='application/json')
         self.assertEquals(response.status_code, 400)
 
+    """Batch tests."""
+
+    def test_batch(self):
+        post_data = {'operations': [
+            {'route': '/blogpost/create',
+             'arguments': {'username': 'steve', 'headline': 'Batched',
+                           'body': 'Hello.'}},
+            {'route': '/blogpost/add_label',
+             'arguments': {'blogpost_id': {'$ref': '0.blogpost.id'},
+                           'label_text': 'batched'}},
+            {'route': '/comment/create',
+             'arguments': {'username': 'zack', 'comment_text': 'Nice.',
+                           'blogpost_id': {'$ref': '0.blogpost.id'}}},
+            {'route': '/blogpost/get_by_id',
+             'arguments': {'blogpost_id': {'$ref': '0.blogpost.id'}}},
+        ]}
+
+        with mock.patch.object(server.blogger_engine, 'Writing',
+                               wraps=server.blogger_engine.Writing) as writing:
+            response = self.app.post('/batch',
+                                     data=json.dumps(post_data),
+                                     content_type='application/json')
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(writing.call_count, 1)
+        results = json.loads(response.get_data(as_text=True))['results']
+
+        self.assertEquals([result['status'] for result in results],
+                          [200] * 4)
+        blogpost_id = results[0]['body']['blogpost']['id']
+        self.assertEquals(results[1]['body']['label']['label'],
+                          'batched')
+        self.assertEquals(results[2]['body']['comment']['blogpost']['id'],
+                          blogpost_id)
+        blogpost = results[3]['body']['blogpost']
+        self.assertEquals((blogpost['labels'], len(blogpost['comments'])),
+                          (['batched'], 1))
+        self.assertEquals(
+            server.blogger_engine.GetBlogpostById(blogpost_id).headline,
+            'Batched')
+
+    def test_batch_failedoperations(self):
+        post_data = {'operations': [
+            {'route': '/blogpost/add_label', 'arguments': {}},
+            {'route': '/blogpost/add_label',
+             'arguments': {'blogpost_id': {'$ref': '0.blogpost.id'},
+                           'label_text': 'batched'}},
+            {'route': '/blogpost/nonexistent'},
+            {'route': '/blogpost/get_all'},
+            {'route': '/author/get_all', 'arguments': {'limit': 'x'}},
+            {'route': '/batch', 'arguments': {'operations': []}},
+            {'route': '/admin/compact_log'},
+            {'route': '/label/create', 'arguments': {'label_text': 'new'}},
+            {'route': 5},
+            {'route': u'/label/create',
+             'arguments': {'label_text': u'n\xfcew'}},
+        ]}
+
+        response = self.app.post('/batch',
+                                 data=json.dumps(post_data),
+                                 content_type='application/json')
+        self.assertEquals(response.status_code, 200)
+        results = json.loads(response.get_data(as_text=True))['results']
+
+        self.assertEquals([result['status'] for result in results],
+                          [400, 400, 404, 200, 400, 400, 400, 200, 400, 200])
+        self.assertEquals(results[0]['body'], None)
+        self.assertEquals(len(results[3]['body']['blogposts']), 3)
+        self.assertEquals(results[7]['body']['label']['label'], 'new')
+
+    def test_batch_invalid(self):
+        for post_data in ({}, {'operations': {}}, {'operations': [1]}):
+            response = self.app.post('/batch',
+                                     data=json.dumps(post_data),
+                                     content_type='application/json')
+            self.assertEquals(response.status_code, 400)
+
+        with mock.patch.object(server, 'BATCH_MAX_OPERATIONS', 1):
+            response = self.app.post(
+                '/batch',
+                data=json.dumps({'operations': [{}, {}]}),
+                content_type='application/json')
+        self.assertEquals(response.status_code, 413)
+
+    """Admin tests."""
+
+    def test_admin_json_cache(self):
+        blogpost_model.Blogpost.ResetJsonCacheStats()
+        with mock.patch.object(server, 'response_cache',
+                               response_cache.ResponseCache(0)):
+            self.app.get('/blogpost/get_all')
+            self.app.get('/blogpost/get_all')
+
+        response = self.app.get('/admin/json_cache')
+        self.assertEquals(response.status_code, 200)
+        response_data = json.loads(response.get_data(as_text=True))
+
+        stats = response_data['json_cache']['Blogpost']
+        self.assertEquals((stats['encoded_hits'], stats['encoded_misses'],
+                           stats['encoded_hit_rate']), (3, 3, 0.5))
+
+    def test_admin_compression_cache(self):
+        with mock.patch.object(server, 'compression_cache',
+                               compression.CompressionCache()):
+            self.app.get('/blogpost/get_all',
+                         headers={'Accept-Encoding': 'gzip'})
+            response = self.app.get('/admin/compression_cache')
+
+        self.assertEquals(response.status_code, 200)
+        response_data = json.loads(response.get_data(as_text=True))
+
+        stats = response_data['compression_cache']
+        self.assertEquals((stats['misses'], stats['entries']), (1, 1))
+
+    def test_admin_snapshot_notconfigured(self):
+        with mock.patch.object(server, 'background_snapshotter', None):
+            response = self.app.get('/admin/snapshot')
+
+        self.assertEquals(response.status_code, 404)
+
+    def test_admin_snapshot_status(self):
+        snapshotter = mock.MagicMock()
+        snapshotter.GetStatus.return_value = {'state': 'idle'}
+
+        with mock.patch.object(server, 'background_snapshotter', snapshotter):
+            response = self.app.get('/admin/snapshot')
+
+        self.assertEquals(response.status_code, 200)
+        response_data = json.loads(response.get_data(as_text=True))
+        self.assertEquals(response_data['snapshot'], {'state': 'idle'})
+        self.assertFalse(response_data['started'])
+        self.assertFalse(snapshotter.Start.called)
+
+    def test_admin_snapshot_start(self):
+        snapshotter = mock.MagicMock()
+        snapshotter.Start.return_value = True
+        snapshotter.GetStatus.return_value = {'state': 'running'}
+
+        with mock.patch.object(server, 'background_snapshotter', snapshotter):
+            response = self.app.post('/admin/snapshot')
+
+        self.assertEquals(response.status_code, 200)
+        response_data = json.loads(response.get_data(as_text=True))
+        self.assertEquals(response_data['snapshot'], {'state': 'running'})
+        self.assertTrue(response_data['started'])
+
+    def test_admin_compact_log_nolog(self):
+        response = self.app.post('/admin/compact_log')
+
+        self.assertEquals(response.status_code, 404)
+
+    def test_admin_compact_log(self):
+        with mock.patch.object(server.blogger_engine, 'CompactOperationLog',
+                               return_value=(100, 40)):
+            response = self.app.post('/admin/compact_log')
+
+        self.assertEquals(response.status_code, 200)
+        response_data = json.loads(response.get_data(as_text=True))
+        self.assertEquals(response_data['bytes_before'], 100)
+        self.assertEquals(response_data['bytes_after'], 40)
+
 if __name__ == '__main__':
     unittest.main()
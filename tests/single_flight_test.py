@@ -0,0 +1,104 @@
+#!/usr/bin/python
+
+import threading
+import time
+import unittest
+
+from bloggerengine import single_flight
+
+
+def WaitFor(condition):
+    deadline = time.time() + 5
+    while not condition() and time.time() < deadline:
+        time.sleep(0.001)
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.single_flight = single_flight.SingleFlight()
+        self.release = threading.Event()
+        self.results = []
+
+    def RunInThreads(self, count, key, function):
+        def Run():
+            self.results.append(self.single_flight.Do(key, function))
+
+        threads = [threading.Thread(target=Run) for unused_x in range(count)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        return threads
+
+    def Join(self, threads):
+        for thread in threads:
+            thread.join(5)
+
+    def test_Do(self):
+        self.assertEquals(self.single_flight.Do('a', lambda: 1), (1, False))
+        self.assertEquals(self.single_flight.Do('a', lambda: 2), (2, False))
+        self.assertEquals(self.single_flight.GetStats()['calls'], 2)
+
+    def test_Do_Coalesces(self):
+        calls = []
+
+        def Compute():
+            calls.append(1)
+            self.release.wait(5)
+            return 'result'
+
+        threads = self.RunInThreads(5, 'a', Compute)
+        WaitFor(lambda: self.single_flight.GetStats()['waiting'] == 4)
+        self.release.set()
+        self.Join(threads)
+
+        self.assertEquals(len(calls), 1)
+        self.assertEquals(sorted(self.results),
+                          [('result', False)] + [('result', True)] * 4)
+        stats = self.single_flight.GetStats()
+        self.assertEquals((stats['calls'], stats['coalesced'],
+                           stats['coalesced_rate'], stats['in_flight']),
+                          (1, 4, 0.8, 0))
+
+    def test_Do_DifferentKeys(self):
+        threads = self.RunInThreads(1, 'a', lambda: self.release.wait(5))
+        WaitFor(lambda: self.single_flight.GetStats()['in_flight'] == 1)
+
+        self.assertEquals(self.single_flight.Do('b', lambda: 'b'),
+                          ('b', False))
+        self.release.set()
+        self.Join(threads)
+
+    def test_Do_Raises(self):
+        calls = []
+
+        def Compute():
+            calls.append(1)
+            if len(calls) == 1:
+                self.release.wait(5)
+                raise ValueError()
+            return 'result'
+
+        def Run():
+            try:
+                self.single_flight.Do('a', Compute)
+            except ValueError:
+                self.results.append('raised')
+
+        leader = threading.Thread(target=Run)
+        leader.daemon = True
+        leader.start()
+        WaitFor(lambda: self.single_flight.GetStats()['in_flight'] == 1)
+        threads = self.RunInThreads(2, 'a', Compute)
+        WaitFor(lambda: self.single_flight.GetStats()['waiting'] == 2)
+        self.release.set()
+        self.Join([leader] + threads)
+
+        self.assertEquals(len(calls), 3)
+        self.assertEquals(sorted(self.results, key=str),
+                          [('result', False), ('result', False), 'raised'])
+        self.assertEquals(self.single_flight.GetStats()['coalesced'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from bloggerengine import author as author_model
+from bloggerengine import base_model
+from bloggerengine import blogpost as blogpost_model
+from bloggerengine import comment as comment_model
+from bloggerengine import engine
+from bloggerengine import label as label_model
+from bloggerengine import snapshot
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ResetInstances()
+        self.directory = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.directory, 'oplog')
+        self.path = os.path.join(self.directory, 'snapshot')
+        self.blogger_engine = engine.BloggerEngine()
+
+    def tearDown(self):
+        self.blogger_engine.CloseOperationLog()
+        shutil.rmtree(self.directory)
+        del self.blogger_engine
+
+    def ResetInstances(self):
+        author_model.Author.instances = {}
+        base_model.BaseModel.instances = {}
+        blogpost_model.Blogpost.instances = {}
+        comment_model.Comment.instances = {}
+        label_model.Label.instances = {}
+
+    def PopulateEngine(self):
+        zack = self.blogger_engine.SubmitBlogpost('zack', 'Hi!', u'L\xf6rem.')
+        colin = self.blogger_engine.SubmitBlogpost('colin', None, 'Ipsum.')
+        removed = self.blogger_engine.SubmitBlogpost('zack', 'Oops', 'Typo.')
+
+        self.blogger_engine.AddLabelToBlogpost('intro', zack.id)
+        self.blogger_engine.AddLabelToBlogpost('funny', colin.id)
+        self.blogger_engine.AddLabelToBlogpost('intro', colin.id)
+        self.blogger_engine.SubmitComment('colin', 'Welcome!', zack.id)
+        comment = self.blogger_engine.SubmitComment('zack', 'Spam', colin.id)
+        self.blogger_engine.SubmitComment('colin', 'Gone', removed.id)
+
+        self.blogger_engine.RemoveCommentFromBlogpost(comment.id)
+        self.blogger_engine.DeleteBlogpost(removed.id)
+
+    def DumpDatastore(self):
+        return dict((kind, [instance.ToJson()
+                            for instance in model_class.GetAll()])
+                    for kind, model_class in engine.MODEL_CLASSES.items())
+
+    def test_WriteAndLoad(self):
+        self.PopulateEngine()
+        expected = self.DumpDatastore()
+        written = self.blogger_engine.SaveSnapshot(self.path)
+
+        self.ResetInstances()
+        registry, generation, offset = snapshot.LoadSnapshot(
+            self.path, engine.MODEL_CLASSES)
+
+        self.assertEquals(written, len(registry))
+        self.assertEquals(generation, 0)
+        self.assertEquals(offset, 0)
+        self.assertEquals(self.DumpDatastore(), expected)
+
+    def test_WriteAndLoad_NonStringFields(self):
+        blogpost = self.blogger_engine.SubmitBlogpost(
+            'zack', 5, [1.5, {'draft': True}])
+        self.blogger_engine.SubmitComment('colin', False, blogpost.id)
+        expected = self.DumpDatastore()
+        self.blogger_engine.SaveSnapshot(self.path)
+
+        self.ResetInstances()
+        snapshot.LoadSnapshot(self.path, engine.MODEL_CLASSES)
+
+        self.assertEquals(self.DumpDatastore(), expected)
+        restored = self.blogger_engine.GetBlogpostById(blogpost.id)
+        self.assertEquals(restored.headline, 5)
+        self.assertEquals(restored.body, [1.5, {'draft': True}])
+        self.assertIs(restored.GetComments()[0].comment_text, False)
+
+    def test_Load_RestoresSharedReferences(self):
+        self.PopulateEngine()
+        self.blogger_engine.SaveSnapshot(self.path)
+
+        self.ResetInstances()
+        snapshot.LoadSnapshot(self.path, engine.MODEL_CLASSES)
+
+        zack = self.blogger_engine.GetAuthorByUsername('zack')
+        blogpost = zack.GetBlogposts()[0]
+        removed = zack.GetRemovedBlogposts()[0]
+
+        self.assertIs(blogpost.author, zack)
+        self.assertIs(blogpost.labels['intro'],
+                      self.blogger_engine.GetLabel('intro'))
+        self.assertEquals(list(blogpost.labels), ['intro'])
+        self.assertIs(removed.author, zack)
+        self.assertIsNone(self.blogger_engine.GetBlogpostById(removed.id))
+        self.assertEquals(list(self.blogger_engine.GetBlogpostById(
+            self.blogger_engine.GetAllBlogposts()[1].id).labels),
+            ['funny', 'intro'])
+
+    def test_Load_CorruptSnapshot(self):
+        self.PopulateEngine()
+        self.blogger_engine.SaveSnapshot(self.path)
+
+        with open(self.path, 'r+b') as snapshot_file:
+            snapshot_file.seek(snapshot.FILE_HEADER.size + 4)
+            snapshot_file.write(b'X')
+
+        self.assertRaises(ValueError, snapshot.LoadSnapshot, self.path,
+                          engine.MODEL_CLASSES)
+
+    def test_OpenOperationLog_ReplaysOnlyTheTail(self):
+        self.blogger_engine.OpenOperationLog(self.log_path)
+        self.PopulateEngine()
+        self.blogger_engine.SaveSnapshot(self.path)
+        self.blogger_engine.SubmitBlogpost('steve', 'Tail', 'After.')
+        expected = self.DumpDatastore()
+        self.blogger_engine.CloseOperationLog()
+
+        self.ResetInstances()
+        self.blogger_engine.OpenOperationLog(self.log_path,
+                                             snapshot_path=self.path)
+
+        self.assertEquals(self.DumpDatastore(), expected)
+
+    def test_OpenOperationLog_IgnoresSnapshotOfAnotherLog(self):
+        self.PopulateEngine()
+        self.blogger_engine.SaveSnapshot(self.path)
+
+        self.ResetInstances()
+        self.blogger_engine.OpenOperationLog(self.log_path,
+                                             snapshot_path=self.path)
+
+        self.assertEquals(self.blogger_engine.GetAllBlogposts(), [])
+
+if __name__ == '__main__':
+    unittest.main()
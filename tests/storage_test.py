@@ -0,0 +1,370 @@
+#!/usr/bin/python
+
+import mock
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from collections import OrderedDict
+
+from bloggerengine import author as author_model
+from bloggerengine import base_model
+from bloggerengine import blogpost as blogpost_model
+from bloggerengine import comment as comment_model
+from bloggerengine import engine
+from bloggerengine import label as label_model
+from bloggerengine import storage
+
+
+class MemoryBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        base_model.BaseModel.instances = {}
+        self.backend = storage.MemoryBackend()
+
+    def test_PutGetDelete(self):
+        model = base_model.BaseModel()
+
+        self.assertTrue(self.backend.Put(base_model.BaseModel, 'key', model))
+        self.assertFalse(self.backend.Put(base_model.BaseModel, 'key', model))
+        self.assertIs(self.backend.Get(base_model.BaseModel, 'key'), model)
+        self.assertEquals(self.backend.GetAll(base_model.BaseModel), [model])
+        self.assertTrue(self.backend.Delete(base_model.BaseModel, 'key',
+                                            model))
+        self.assertFalse(self.backend.Delete(base_model.BaseModel, 'key',
+                                             model))
+        self.assertIsNone(self.backend.Get(base_model.BaseModel, 'key'))
+
+    def test_GetMany(self):
+        model = base_model.BaseModel()
+        self.backend.Put(base_model.BaseModel, 'key', model)
+
+        self.assertEquals(
+            self.backend.GetMany(base_model.BaseModel, ['other', 'key']),
+            [None, model])
+
+    def test_GetAll_UnknownKind(self):
+        self.assertEquals(self.backend.GetAll(base_model.BaseModel), [])
+
+
+class VersionedCollectionTest(unittest.TestCase):
+
+    def test_Snapshot_IsPointInTime(self):
+        collection = storage.VersionedCollection([('a', 1), ('b', 2)])
+        before = collection.Snapshot()
+
+        collection['c'] = 3
+        del collection['a']
+        collection['b'] = 4
+        after = collection.Snapshot()
+
+        self.assertEquals(before.GetAll(), [1, 2])
+        self.assertEquals(before.Get('a'), 1)
+        self.assertEquals(after.GetAll(), [4, 3])
+        self.assertIsNone(after.Get('a'))
+        self.assertTrue('c' in after)
+        self.assertEquals(len(after), 2)
+        self.assertTrue(after.version > before.version)
+
+    def test_Snapshot_ReusedWithoutChanges(self):
+        collection = storage.VersionedCollection([('a', 1)])
+
+        self.assertIs(collection.Snapshot(), collection.Snapshot())
+
+    def test_Snapshot_FollowsInsertionOrder(self):
+        collection = storage.VersionedCollection(
+            ('key%d' % index, index) for index in range(100))
+        expected = OrderedDict(collection)
+        collection.Snapshot()
+
+        for key in ('key5', 'key50'):
+            del collection[key]
+            del expected[key]
+        collection['key5'] = 'again'
+        expected['key5'] = 'again'
+        collection.move_to_end('key7')
+        expected.move_to_end('key7')
+        collection.move_to_end('key9', last=False)
+        expected.move_to_end('key9', last=False)
+        self.assertEquals(collection.pop('key1'), expected.pop('key1'))
+        self.assertEquals(collection.setdefault('new', 1), 1)
+        expected['new'] = 1
+
+        self.assertEquals(list(collection.items()), list(expected.items()))
+        self.assertEquals(collection.Snapshot().GetAll(),
+                          list(expected.values()))
+
+    def test_Clear(self):
+        collection = storage.VersionedCollection([('a', 1)])
+        collection.Snapshot()
+        collection.clear()
+
+        self.assertEquals(collection.Snapshot().GetAll(), [])
+
+    def test_UndoLog_Rollback(self):
+        tracked = storage.VersionedCollection([('a', 1), ('b', 2), ('c', 3)])
+        tracked.Snapshot()
+        untracked = storage.VersionedCollection([('a', 1), ('b', 2)])
+        appended = storage.VersionedCollection([('a', 1)])
+        appended.Snapshot()
+
+        undo_log = storage.UndoLog.Begin()
+        del tracked['a']
+        tracked['a'] = 4
+        tracked.move_to_end('b')
+        untracked.clear()
+        untracked['c'] = 3
+        appended['b'] = 2
+        appended['c'] = 3
+        undo_log.Rollback()
+
+        self.assertEquals(list(tracked.items()), [('a', 1), ('b', 2),
+                                                  ('c', 3)])
+        self.assertEquals(tracked.Snapshot().GetAll(), [1, 2, 3])
+        self.assertEquals(list(untracked.items()), [('a', 1), ('b', 2)])
+        self.assertEquals(list(appended.items()), [('a', 1)])
+        self.assertEquals(appended.Snapshot().GetAll(), [1])
+        self.assertEquals(undo_log.collections, [tracked, untracked,
+                                                 appended])
+        self.assertIsNone(tracked.saved)
+
+    def test_UndoLog_Commit(self):
+        collection = storage.VersionedCollection([('a', 1)])
+
+        undo_log = storage.UndoLog.Begin()
+        collection['b'] = 2
+        undo_log.Commit()
+        collection['c'] = 3
+
+        self.assertEquals(list(collection), ['a', 'b', 'c'])
+        self.assertIsNone(collection.saved)
+
+    def test_UndoLog_OtherThreadsSeeSavedContents(self):
+        collection = storage.VersionedCollection([('a', 1)])
+        results = []
+
+        def Read():
+            results.append(collection.Snapshot().GetAll())
+
+        undo_log = storage.UndoLog.Begin()
+        collection['b'] = 2
+        thread = threading.Thread(target=Read)
+        thread.start()
+        thread.join()
+        results.append(collection.Snapshot().GetAll())
+        undo_log.Commit()
+        Read()
+
+        self.assertEquals(results, [[1], [1, 2], [1, 2]])
+
+
+class SqliteBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ResetInstances()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'bloggerengine.db')
+        self.blogger_engine = engine.BloggerEngine()
+        self.backend = self.blogger_engine.OpenSqliteStorage(self.path)
+
+    def tearDown(self):
+        self.blogger_engine.CloseStorage()
+        shutil.rmtree(self.directory)
+        del self.blogger_engine
+
+    def ResetInstances(self):
+        author_model.Author.instances = {}
+        base_model.BaseModel.instances = {}
+        blogpost_model.Blogpost.instances = {}
+        comment_model.Comment.instances = {}
+        label_model.Label.instances = {}
+
+    def PopulateEngine(self):
+        zack = self.blogger_engine.SubmitBlogpost('zack', 'Hi!', u'L\xf6rem.')
+        colin = self.blogger_engine.SubmitBlogpost('colin', None, 'Ipsum.')
+        removed = self.blogger_engine.SubmitBlogpost('zack', 'Oops', 'Typo.')
+
+        self.blogger_engine.AddLabelToBlogpost('intro', zack.id)
+        self.blogger_engine.AddLabelToBlogpost('intro', colin.id)
+        self.blogger_engine.AddLabelToBlogpost('funny', colin.id)
+        self.blogger_engine.SubmitComment('colin', 'Welcome!', zack.id)
+        comment = self.blogger_engine.SubmitComment('zack', 'Spam', colin.id)
+        self.blogger_engine.SubmitComment('colin', 'Gone', removed.id)
+
+        self.blogger_engine.RemoveCommentFromBlogpost(comment.id)
+        self.blogger_engine.RemoveLabelFromBlogpost('intro', colin.id)
+        self.blogger_engine.DeleteBlogpost(removed.id)
+
+    def DumpDatastore(self):
+        return dict((kind, [instance.ToJson()
+                            for instance in model_class.GetAll()])
+                    for kind, model_class in engine.MODEL_CLASSES.items())
+
+    def Reopen(self):
+        self.ResetInstances()
+        self.backend = self.blogger_engine.OpenSqliteStorage(self.path)
+
+    def test_Snapshot_CopiesInstances(self):
+        self.PopulateEngine()
+        blogposts = self.blogger_engine.GetAllBlogposts()
+
+        result = self.blogger_engine.GetSnapshot()['Blogpost']
+
+        self.assertEquals(result.GetAll(), blogposts)
+        self.assertIs(result.Get(blogposts[0].id), blogposts[0])
+
+    def test_Reopen_RestoresDatastore(self):
+        self.PopulateEngine()
+        expected = self.DumpDatastore()
+
+        self.Reopen()
+
+        self.assertEquals(self.DumpDatastore(), expected)
+        self.assertEquals(author_model.Author.instances, {})
+
+    def test_Reopen_RestoresRelationships(self):
+        self.PopulateEngine()
+        self.Reopen()
+
+        zack = self.blogger_engine.GetAuthorByUsername('zack')
+        blogpost = zack.GetBlogposts()[0]
+        colin = self.blogger_engine.GetBlogpostsByUsername('colin')[0]
+        removed = zack.GetRemovedBlogposts()[0]
+
+        self.assertIs(blogpost.author, zack)
+        self.assertIs(blogpost.labels['intro'],
+                      self.blogger_engine.GetLabel('intro'))
+        self.assertEquals(list(colin.labels), ['funny'])
+        self.assertEquals(len(zack.GetRemovedComments()), 1)
+        self.assertEquals(
+            self.blogger_engine.GetCommentsByBlogpost(blogpost.id)[0]
+            .comment_text, 'Welcome!')
+        self.assertEquals(removed.headline, 'Oops')
+        self.assertIsNone(self.blogger_engine.GetBlogpostById(removed.id))
+
+    def test_Reopen_KeepsMutating(self):
+        self.PopulateEngine()
+        self.Reopen()
+
+        blogpost = self.blogger_engine.SubmitBlogpost('zack', 'Again', 'Yo.')
+        self.blogger_engine.DeleteLabel('intro')
+        self.Reopen()
+
+        zack = self.blogger_engine.GetAuthorByUsername('zack')
+        self.assertEquals([post.headline for post in zack.GetBlogposts()],
+                          [u'Hi!', u'Again'])
+        self.assertIsNone(self.blogger_engine.GetLabel('intro'))
+        self.assertEquals(
+            self.blogger_engine.GetLabelsByBlogpost(blogpost.id), [])
+
+    def test_GetMany(self):
+        self.PopulateEngine()
+        blogposts = self.blogger_engine.GetAllBlogposts()
+        self.Reopen()
+
+        with mock.patch.object(storage, 'SQLITE_MAX_PARAMETERS', 1):
+            result = self.blogger_engine.GetBlogpostsByIds(
+                [blogposts[1].id, 'missing', blogposts[0].id,
+                 blogposts[1].id])
+
+        self.assertEquals([blogpost and blogpost.id for blogpost in result],
+                          [blogposts[1].id, None, blogposts[0].id,
+                           blogposts[1].id])
+        self.assertIs(result[0], result[3])
+
+    def test_Batching_CommitsOnce(self):
+        with base_model.BaseModel.Batching():
+            blogposts = self.blogger_engine.SubmitBlogposts(
+                [('zack', 'Bulk', 'Post.'), ('colin', 'Bulk', 'Post.')])
+            self.assertTrue(self.backend.Connection_().in_transaction)
+            self.blogger_engine.AddLabelsToBlogposts(
+                [('bulk', blogpost.id) for blogpost in blogposts])
+        self.assertFalse(self.backend.Connection_().in_transaction)
+        expected = self.DumpDatastore()
+
+        self.Reopen()
+
+        self.assertEquals(self.DumpDatastore(), expected)
+
+    def test_Transaction_RollsBack(self):
+        self.PopulateEngine()
+        expected = self.DumpDatastore()
+        zack = self.blogger_engine.GetAuthorByUsername('zack')
+        blogposts = list(zack.blogposts)
+
+        with self.assertRaises(ValueError):
+            with self.blogger_engine.Transaction():
+                self.blogger_engine.DeleteBlogpost(blogposts[0])
+                self.blogger_engine.SubmitBlogpost('zack', 'Again', 'Yo.')
+                raise ValueError()
+
+        self.assertFalse(self.backend.Connection_().in_transaction)
+        self.assertEquals(list(zack.blogposts), blogposts)
+        self.assertEquals(self.DumpDatastore(), expected)
+        self.Reopen()
+        self.assertEquals(self.DumpDatastore(), expected)
+
+    def test_Materialize_LoadsRelationsLazily(self):
+        self.PopulateEngine()
+        blogpost_id = self.blogger_engine.GetAllBlogposts()[0].id
+        self.Reopen()
+
+        blogpost = self.blogger_engine.GetBlogpostById(blogpost_id)
+
+        self.assertIsInstance(blogpost.comments, storage.LazyRelation)
+        self.assertFalse(blogpost.comments.loaded)
+        self.assertEquals(len(blogpost.comments), 1)
+        self.assertTrue(blogpost.comments.loaded)
+
+    def test_Materialize_ReusesLoadedInstances(self):
+        self.PopulateEngine()
+        blogpost_id = self.blogger_engine.GetAllBlogposts()[0].id
+        self.Reopen()
+
+        self.assertIs(self.blogger_engine.GetBlogpostById(blogpost_id),
+                      self.blogger_engine.GetBlogpostById(blogpost_id))
+
+    def test_Connection_PerThread(self):
+        connections = []
+        thread = threading.Thread(
+            target=lambda: connections.append(self.backend.Connection_()))
+        thread.start()
+        thread.join()
+
+        self.assertIsNot(connections[0], self.backend.Connection_())
+        self.assertIs(self.backend.Connection_(), self.backend.Connection_())
+
+    def test_Connection_ClosedWhenThreadExits(self):
+        self.backend.Connection_()
+        connections = []
+
+        def Query():
+            connection = self.backend.Connection_()
+            connection.execute('SELECT 1').fetchone()
+            connections.append(connection)
+
+        for unused_index in range(50):
+            thread = threading.Thread(target=Query)
+            thread.start()
+            thread.join()
+
+        self.assertEquals(len(self.backend.connections), 1)
+        self.assertRaises(sqlite3.ProgrammingError, connections[0].execute,
+                          'SELECT 1')
+        self.backend.Connection_().execute('SELECT 1')
+
+    def test_Schema_IndexesForeignKeys(self):
+        connection = sqlite3.connect(self.path)
+        result = set(name for name, in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"))
+        connection.close()
+
+        for index in ('blogposts_author_id', 'comments_author_id',
+                      'comments_blogpost_id', 'blogpost_labels_owner',
+                      'label_blogposts_owner', 'label_blogposts_target'):
+            self.assertIn(index, result)
+
+if __name__ == '__main__':
+    unittest.main()